@@ -0,0 +1,326 @@
+import argparse
+import ctypes
+from datetime import datetime, timedelta
+import json
+from multiprocessing import Lock, Queue, RawArray, RawValue
+import os
+import platform
+import queue
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable
+import numpy as np
+from block_ring import BlockCursors
+from command import RecvCommand, make_recv_frame
+from config import (
+    CONSUMERS,
+    DAS_CONFIG,
+    DEVICES,
+    HANDLE_INTERVAL,
+    PINGPONG_SIZE,
+    REMOTE_ADDRESS,
+    SAVE_CONFIG,
+)
+from das_udp import ServerProtocol
+from data_handler import DataHandler
+from main import DataRecorder
+from metrics import MetricsRegistry
+from transform_file import rms_downsample
+from utils import DataBuffer
+
+TARGET = "振动解调数据"
+DEVICE = next(iter(DEVICES))
+# 分片长度，接近以太网MTU下单个UDP数据报的负载
+FRAGMENT_SIZE = 1472
+CONCAT_FRAMES = 8
+# 相对基准变慢超过该比例时视为性能退化
+THRESHOLD = 0.1
+
+
+def synthetic_frames(
+    name: str,
+    count: int,
+    dataSize: int = DAS_CONFIG["dataSize"],
+    seed: int = 0,
+) -> list[bytes]:
+    """生成count帧随机数据，每帧dataSize个点"""
+    rng = np.random.default_rng(seed)
+    data = rng.integers(-2000, 2000, (count, dataSize), dtype=np.int16)
+    return [make_recv_frame(name, row.astype("<i2").tobytes()) for row in data]
+
+
+def measure(
+    func: Callable[[], int], repeat: int, setup: Callable[[], None] | None = None
+) -> dict[str, float]:
+    """运行repeat次func，func返回本次完成的操作数，结果为每次操作的耗时，单位: 微秒"""
+    costs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        begin = time.perf_counter()
+        ops = func()
+        costs.append((time.perf_counter() - begin) / ops * 1e6)
+    return {
+        "median": statistics.median(costs),
+        "min": min(costs),
+        "max": max(costs),
+    }
+
+
+def bench_recv_parse(repeat: int) -> dict[str, float]:
+    frames = synthetic_frames(TARGET, 1000)
+
+    def run():
+        for frame in frames:
+            RecvCommand(frame)
+        return len(frames)
+
+    return measure(run, repeat)
+
+
+def _protocol() -> tuple[ServerProtocol, list]:
+    protocol = ServerProtocol()
+    received = []
+    protocol.on("command", received.append)
+    protocol.enable = True
+    return protocol, received
+
+
+def bench_datagram_concat(repeat: int) -> dict[str, float]:
+    """每个数据报包含多帧"""
+    frames = synthetic_frames(TARGET, CONCAT_FRAMES * 125)
+    datagrams = [
+        b"".join(frames[i : i + CONCAT_FRAMES])
+        for i in range(0, len(frames), CONCAT_FRAMES)
+    ]
+    protocol, received = _protocol()
+
+    def run():
+        received.clear()
+        for datagram in datagrams:
+            protocol.datagram_received(datagram, REMOTE_ADDRESS)
+        assert len(received) == len(frames), f"只解析出{len(received)}帧"
+        return len(frames)
+
+    return measure(run, repeat)
+
+
+def bench_datagram_fragment(repeat: int) -> dict[str, float]:
+    """每帧被拆成多个数据报"""
+    frames = synthetic_frames(TARGET, 1000)
+    datagrams = [
+        frame[i : i + FRAGMENT_SIZE]
+        for frame in frames
+        for i in range(0, len(frame), FRAGMENT_SIZE)
+    ]
+    protocol, received = _protocol()
+
+    def run():
+        received.clear()
+        for datagram in datagrams:
+            protocol.datagram_received(datagram, REMOTE_ADDRESS)
+        assert len(received) == len(frames), f"只解析出{len(received)}帧"
+        return len(frames)
+
+    return measure(run, repeat)
+
+
+def _pingpong_buffers() -> dict[str, list[DataBuffer]]:
+    return {
+        name: [
+            {
+                "buffer": RawArray(
+                    ctypes.c_byte,
+                    int(
+                        params["sampleRate"]
+                        * HANDLE_INTERVAL
+                        * len(DAS_CONFIG["validPointRange"])
+                        * DAS_CONFIG["dtype"].itemsize
+                    ),
+                ),
+                "lock": Lock(),
+            }
+            for _ in range(PINGPONG_SIZE)
+        ]
+        for name, params in DAS_CONFIG["targets"].items()
+    }
+
+
+def bench_data_recorder(repeat: int) -> dict[str, float]:
+    taskQueue = Queue()
+    buffers = _pingpong_buffers()
+    cursors = {name: BlockCursors(CONSUMERS) for name in buffers}
+    frameCounts = {name: RawValue(ctypes.c_uint64, 0) for name in buffers}
+    # 所有消费者共用一个队列，取出时释放数据块
+    recorder = DataRecorder(
+        buffers,
+        {consumer: taskQueue for consumer in CONSUMERS},
+        cursors,
+        frameCounts,
+        MetricsRegistry(),
+        DEVICE,
+    )
+    commands = [RecvCommand(frame) for frame in synthetic_frames(TARGET, 100)]
+    # 每次运行写满若干个数据块，包含换块时的入队
+    count = int(DAS_CONFIG["targets"][TARGET]["sampleRate"] * HANDLE_INTERVAL) * 2
+
+    def run():
+        for i in range(count):
+            recorder.on_command(commands[i % len(commands)])
+        return count
+
+    def drain():
+        try:
+            while True:
+                name, block, *_ = taskQueue.get_nowait()
+                for consumer in CONSUMERS:
+                    cursors[name].release(consumer, block)
+        except queue.Empty:
+            pass
+
+    result = measure(run, repeat, drain)
+    assert frameCounts[TARGET].value == count * repeat, "数据帧未被写入缓冲区"
+    return result
+
+
+def bench_save_data(repeat: int, tmpDir: str) -> dict[str, float]:
+    """向tmpfs保存数据，排除磁盘速度的影响，结果为每个数据块的耗时"""
+    buffers = _pingpong_buffers()
+    cursors = {name: BlockCursors(CONSUMERS) for name in buffers}
+    handler = DataHandler(
+        "saver", buffers, Queue(), cursors, {}, MetricsRegistry(), DEVICE
+    )
+    block = buffers[TARGET][0]
+    np.frombuffer(block["buffer"], dtype=np.uint8)[:] = np.random.default_rng(
+        0
+    ).integers(0, 256, len(block["buffer"]), dtype=np.uint8)
+    interval = SAVE_CONFIG["targets"][TARGET]["interval"]
+    blocks = int(interval / HANDLE_INTERVAL) * 5
+    saveTime = SAVE_CONFIG["begin"]
+    # 保存路径为相对路径时在临时目录下创建
+    cwd = os.getcwd()
+    os.chdir(tmpDir)
+    savePath = DEVICES[DEVICE]["savePath"]
+    os.makedirs(savePath, exist_ok=True)
+
+    def run():
+        nonlocal saveTime
+        for _ in range(blocks):
+            saveTime += timedelta(seconds=HANDLE_INTERVAL)
+            handler.save_data(TARGET, block, saveTime)
+        return blocks
+
+    def clean():
+        shutil.rmtree(savePath)
+        os.makedirs(savePath)
+
+    try:
+        return measure(run, repeat, clean)
+    finally:
+        shutil.rmtree(savePath, ignore_errors=True)
+        os.chdir(cwd)
+
+
+def bench_rms_downsample(repeat: int) -> dict[str, float]:
+    """每次处理一个1秒的数据文件"""
+    rng = np.random.default_rng(0)
+    data = rng.integers(
+        -2000,
+        2000,
+        (int(DAS_CONFIG["targets"][TARGET]["sampleRate"]), DAS_CONFIG["dataSize"]),
+        dtype=np.int16,
+    )
+
+    def run():
+        rms_downsample(data, 10)
+        return 1
+
+    return measure(run, repeat)
+
+
+def run(repeat: int, tmpDir: str, cases: list[str] | None = None) -> dict:
+    benchmarks: dict[str, Callable[[], dict[str, float]]] = {
+        "recv_parse": lambda: bench_recv_parse(repeat),
+        "datagram_concat": lambda: bench_datagram_concat(repeat),
+        "datagram_fragment": lambda: bench_datagram_fragment(repeat),
+        "data_recorder": lambda: bench_data_recorder(repeat),
+        "save_data": lambda: bench_save_data(repeat, tmpDir),
+        "rms_downsample": lambda: bench_rms_downsample(repeat),
+    }
+    results = {}
+    for name, bench in benchmarks.items():
+        if cases and name not in cases:
+            continue
+        results[name] = bench()
+        print(
+            f"{name:20s} 中位数 {results[name]['median']:10.2f}us, 最小 {results[name]['min']:10.2f}us"
+        )
+    return {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "dataSize": DAS_CONFIG["dataSize"],
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(basePath: str, newPath: str, threshold: float) -> bool:
+    """逐项比较中位数，返回是否存在性能退化"""
+    with open(basePath, "r", encoding="utf-8") as f:
+        base = json.load(f)["results"]
+    with open(newPath, "r", encoding="utf-8") as f:
+        new = json.load(f)["results"]
+    regressed = False
+    for name in new:
+        if name not in base:
+            print(f"{name:20s} 基准中没有该项")
+            continue
+        change = new[name]["median"] / base[name]["median"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  <-- 退化"
+            regressed = True
+        print(
+            f"{name:20s} {base[name]['median']:10.2f}us -> {new[name]['median']:10.2f}us ({change:+.1%}){flag}"
+        )
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="接收到保存链路的性能测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    runParser = subparsers.add_parser("run", help="运行性能测试")
+    runParser.add_argument("-o", "--output", help="结果保存路径(JSON)")
+    runParser.add_argument("-r", "--repeat", type=int, default=5, help="重复次数")
+    runParser.add_argument("-c", "--case", nargs="*", help="只运行指定的测试项")
+    runParser.add_argument(
+        "--tmp",
+        default="/dev/shm" if os.path.isdir("/dev/shm") else None,
+        help="保存测试使用的临时目录，默认使用tmpfs",
+    )
+    compareParser = subparsers.add_parser("compare", help="与基准结果比较")
+    compareParser.add_argument("base", help="基准结果")
+    compareParser.add_argument("new", help="新结果")
+    compareParser.add_argument(
+        "-t", "--threshold", type=float, default=THRESHOLD, help="允许变慢的比例"
+    )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        tmpDir = tempfile.mkdtemp(dir=args.tmp)
+        try:
+            result = run(args.repeat, tmpDir, args.case)
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+    else:
+        if compare(args.base, args.new, args.threshold):
+            raise SystemExit(1)
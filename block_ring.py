@@ -0,0 +1,47 @@
+import ctypes
+from multiprocessing import RawArray, RawValue
+from config import CONSUMER_CONFIG, CONSUMERS, PINGPONG_SIZE
+
+
+class BlockCursors:
+    """
+    一个数据源环形缓冲区的生产者和消费者游标
+    接收进程记录已写满的数据块数，每个消费者记录已处理完的数据块数。第n个数据块写入第n % PINGPONG_SIZE个位置，
+    只有所有required消费者都处理完该位置上一个数据块后才能写入，其余消费者不阻止写入，处理后检查数据块是否已被覆盖。
+    游标只由一个进程写入，无需加锁。consumers为该设备实际运行的消费者，未运行的消费者不阻止写入
+    """
+
+    def __init__(self, consumers: list[str]):
+        self._written = RawValue(ctypes.c_uint64, 0)
+        self._released = RawArray(ctypes.c_uint64, len(CONSUMERS))
+        self._required = [
+            index
+            for index, name in enumerate(CONSUMERS)
+            if name in consumers and CONSUMER_CONFIG[name]["required"]
+        ]
+
+    @property
+    def written(self) -> int:
+        return self._written.value
+
+    def writable(self) -> bool:
+        """下一个数据块的位置是否已被所有required消费者释放"""
+        block = self._written.value - PINGPONG_SIZE
+        return all(self._released[index] > block for index in self._required)
+
+    def publish(self) -> int:
+        """写满一个数据块，返回其序号"""
+        block = self._written.value
+        self._written.value = block + 1
+        return block
+
+    def valid(self, block: int, margin: int = 0) -> bool:
+        """
+        数据块是否还未被覆盖，接收进程写满一个数据块后就可能开始覆盖最早的位置，
+        margin为还需要保留的数据块数，用于判断处理完成前是否会被覆盖
+        """
+        return self._written.value + margin < block + PINGPONG_SIZE
+
+    def release(self, consumer: str, block: int):
+        """消费者处理完第block个数据块"""
+        self._released[CONSUMERS.index(consumer)] = block + 1
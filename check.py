@@ -1,42 +1,356 @@
+import argparse
+from datetime import datetime, timedelta
+import glob
+import json
 import os
-from datetime import datetime
-from config import SAVE_CONFIG
-from utils import extract_timestamp
-import pandas as pd
+from typing import NamedTuple
+import numpy as np
+from config import DEVICES, SAVE_CONFIG
 
-PRECISION = 1
-INTERVAL = SAVE_CONFIG["targets"]["振动解调数据"]["interval"]
-PATH = SAVE_CONFIG["path"]
-BEGIN_TIME = SAVE_CONFIG["begin"]
-END_TIME = SAVE_CONFIG["end"]
+TARGET = "振动解调数据"
+# 文件名中时间部分的格式，如2024-05-29_15-32-00.123
+TIME_FORMAT = "YYYY-MM-DD_hh-mm-ss.fff"
+DIGITS = [i for i, c in enumerate(TIME_FORMAT) if c.isalpha()]
+SEPARATORS = {i: c for i, c in enumerate(TIME_FORMAT) if not c.isalpha()}
+# 文件名时间偏离所在时间槽超过该比例的interval时视为漂移
+DRIFT_TOL = 0.05
+# 每类问题最多列出的条数
+REPORT_LIMIT = 20
+JOURNAL_PREFIX = "rename_"
 
 
-def main():
-    files = os.listdir(PATH)
-    fileDict = {}
+class Continuity(NamedTuple):
+    files: np.ndarray  # 按时间排序的有效文件名
+    times: np.ndarray  # 文件名中的时间，datetime64[ms]
+    # 每个文件最接近的时间槽，第n个时间槽为origin + phase + n·interval
+    slots: np.ndarray
+    origin: np.datetime64
+    phase: np.timedelta64  # 文件名时间相对origin的中位相位，在[0, interval)内
+    interval: np.timedelta64
+    expected: int  # 检查范围内的时间槽数
+    clamped: bool  # 仍在保存，检查范围截止到当前时间而不是end
+    invalid: list[str]  # 文件名不符合格式的文件
 
-    for file in files:
-        _, timestamp = extract_timestamp(file)
-        timestamp = int(timestamp // PRECISION) * PRECISION
-        fileDict[timestamp] = file
 
-    for dt in pd.date_range(BEGIN_TIME, END_TIME, freq=f"{INTERVAL}s"):
-        timestamp = dt.to_pydatetime().timestamp()
-        if timestamp not in fileDict:
-            print(f"{dt} not found")
-            return
+def parse_times(names: list[str], prefix: str) -> tuple[np.ndarray, np.ndarray]:
+    """一次性解析所有文件名中的时间，返回(datetime64[ms]数组, 文件名是否有效)"""
+    width = len(TIME_FORMAT)
+    # 多取5个字符检查".dat"后缀和文件名长度，按UCS-4编码，不同文件名的同一字符位于同一列
+    chars = (
+        np.array([name[len(prefix) :] for name in names], dtype=f"U{width + 5}")
+        .view(np.uint32)
+        .reshape(len(names), width + 5)
+    )
+    digits = chars[:, DIGITS].astype(np.int64) - ord("0")
+    valid = np.all((digits >= 0) & (digits <= 9), axis=1)
+    for index, separator in SEPARATORS.items():
+        valid &= chars[:, index] == ord(separator)
+    valid &= np.all(chars[:, width : width + 4] == [ord(c) for c in ".dat"], axis=1)
+    valid &= chars[:, width + 4] == 0
 
-    confirm = input("文件检查无误，是否重命名？(y/n)")
-    if confirm != "y":
-        return
+    def number(begin: int, end: int) -> np.ndarray:
+        value = np.zeros(len(names), dtype=np.int64)
+        for i in range(begin, end):
+            value = value * 10 + digits[:, i]
+        return value
 
-    for timestamp, file in fileDict.items():
-        dateStr = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d_%H-%M-%S.%f")[
-            :-3
-        ]
-        # os.rename(file, f"Raw{dateStr}.dat")
-        os.rename(os.path.join(PATH, file), os.path.join(PATH, f"Raw{dateStr}.dat"))
+    # 依次为年(4位)、月、日、时、分、秒(各2位)、毫秒(3位)
+    year, month, day = number(0, 4), number(4, 6), number(6, 8)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0)
+    days = np.where(valid, day - 1, 0)
+    dates = months.astype("datetime64[M]").astype("datetime64[D]") + days.astype(
+        "timedelta64[D]"
+    )
+    milliseconds = (
+        (number(8, 10) * 60 + number(10, 12)) * 60 + number(12, 14)
+    ) * 1000 + number(14, 17)
+    times = dates.astype("datetime64[ms]") + milliseconds.astype("timedelta64[ms]")
+    return times, valid
+
+
+def list_times(path: str, prefix: str) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """返回(按时间排序的有效文件名, 文件名中的时间, 文件名无效的文件)"""
+    names = [
+        entry.name
+        for entry in os.scandir(path)
+        if entry.name.startswith(prefix) and entry.name.endswith(".dat")
+    ]
+    times, valid = parse_times(names, prefix)
+    files = np.array(names, dtype=object)
+    invalid = files[~valid].tolist()
+    files, times = files[valid], times[valid]
+    order = np.argsort(times, kind="stable")
+    return files[order], times[order], invalid
+
+
+def analyze(
+    path: str, prefix: str, interval: float, begin: datetime, end: datetime
+) -> Continuity:
+    """
+    按文件名时间排序，时间槽按文件名相对interval的中位相位对齐，每个文件取最接近的时间槽，
+    文件名在时间槽前后抖动不会落到相邻的时间槽
+    """
+    files, times, invalid = list_times(path, prefix)
+    origin = np.datetime64(begin, "ms")
+    step = np.timedelta64(round(interval * 1000), "ms")
+    offsets = (times - origin).astype(np.int64)
+    width = step.astype(np.int64)
+    phase = 0
+    if len(offsets):
+        # 相位在0和interval附近来回时直接取中位数会偏到中间，先以粗略的中位数为中心展开再取中位数
+        center = int(np.median(offsets % width))
+        unwrapped = (offsets - center + width // 2) % width - width // 2
+        phase = (center + int(np.median(unwrapped))) % width
+    slots = (offsets - phase + width // 2) // width
+
+    def slot_count(until: datetime) -> int:
+        """[begin, until)内的时间槽数，向上取整"""
+        span = (np.datetime64(until, "ms") - origin).astype(np.int64)
+        return max(int(-((phase - span) // width)), 0)
+
+    # 仍在保存时检查到当前时间，正在写入的文件不算缺失，末尾停止保存造成的缺失同样会报告
+    expected = slot_count(end)
+    current = slot_count(datetime.now() - timedelta(seconds=interval))
+    if len(slots):
+        current = max(current, int(slots.max()) + 1)
+    clamped = current < expected
+    return Continuity(
+        files,
+        times,
+        slots,
+        origin,
+        np.timedelta64(phase, "ms"),
+        step,
+        min(expected, current),
+        clamped,
+        invalid,
+    )
+
+
+def _runs(indexes: np.ndarray) -> list[tuple[int, int]]:
+    """连续整数的(起始值, 个数)"""
+    if not len(indexes):
+        return []
+    breaks = np.flatnonzero(np.diff(indexes) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    counts = np.diff(np.concatenate((starts, [len(indexes)])))
+    return list(zip(indexes[starts].tolist(), counts.tolist()))
+
+
+def report(result: Continuity, limit: int = REPORT_LIMIT) -> bool:
+    """输出完整的连续性报告，返回是否没有问题"""
+    slots = result.slots
+
+    def slot_time(slot: int | np.ndarray) -> np.datetime64 | np.ndarray:
+        return result.origin + result.phase + slot * result.interval
+
+    inRange = (slots >= 0) & (slots < result.expected)
+    uniqueSlots, counts = np.unique(slots[inRange], return_counts=True)
+    present = np.zeros(result.expected, dtype=bool)
+    present[uniqueSlots] = True
+    missing = _runs(np.flatnonzero(~present))
+    duplicates = uniqueSlots[counts > 1]
+    # 相对所在时间槽的偏移，正常情况下所有文件都接近0
+    drift = (result.times - slot_time(slots)).astype(np.int64)
+    drifted = np.flatnonzero(np.abs(drift) > DRIFT_TOL * result.interval.astype(int))
+
+    seconds = result.interval.astype(int) / 1000
+    print(f"有效文件数: {len(result.files)}, 文件名无效: {len(result.invalid)}")
+    for name in result.invalid[:limit]:
+        print(f"  {name}")
+    if len(result.times):
+        print(f"文件时间范围: {result.times[0]} ~ {result.times[-1]}")
+    print(
+        f"检查范围: {result.origin} ~ {slot_time(result.expected)}{'(仍在保存，截止到当前时间)' if result.clamped else ''}, 时间槽 {result.expected}个, 间隔 {seconds:g}s"
+    )
+    coverage = present.sum() / result.expected if result.expected else 1
+    print(
+        f"覆盖率: {coverage:.4%}, 缺失 {result.expected - present.sum()}个时间槽({(result.expected - present.sum()) * seconds:g}s), 共{len(missing)}段"
+    )
+    for slot, count in sorted(missing, key=lambda run: -run[1])[:limit]:
+        print(f"  {slot_time(slot)} ~ {slot_time(slot + count)} 缺失{count}个")
+    print(f"重复时间槽: {len(duplicates)}个")
+    for slot in duplicates[:limit]:
+        names = result.files[slots == slot]
+        print(f"  {slot_time(slot)}: {', '.join(names)}")
+    print(f"范围外文件: {np.count_nonzero(~inRange)}个")
+    if len(drift):
+        worst = int(np.argmax(np.abs(drift)))
+        print(
+            f"时间漂移: 超过{DRIFT_TOL * seconds * 1000:g}ms的文件 {len(drifted)}个, 最大 {drift[worst]}ms({result.files[worst]})"
+        )
+        for index in drifted[:limit]:
+            print(f"  {result.files[index]}: {drift[index]:+d}ms")
+    return not (missing or len(duplicates) or result.invalid or len(drifted))
+
+
+def plan_renames(result: Continuity, prefix: str) -> list[tuple[str, str]]:
+    """将范围内、不重复的文件改名为所在时间槽的时间"""
+    slots = result.slots
+    inRange = (slots >= 0) & (slots < result.expected)
+    uniqueSlots, counts = np.unique(slots[inRange], return_counts=True)
+    single = inRange & np.isin(slots, uniqueSlots[counts == 1])
+    newTimes = result.origin + result.phase + slots * result.interval
+    # 文件名时间恰好在时间槽上的不需要改名
+    changed = np.flatnonzero(single & (newTimes != result.times))
+    # 逐字符替换为文件名中的时间格式
+    chars = (
+        np.datetime_as_string(newTimes[changed], unit="ms")
+        .astype(f"U{len(TIME_FORMAT)}")
+        .view(np.uint32)
+        .reshape(len(changed), len(TIME_FORMAT))
+        .copy()
+    )
+    for index, separator in SEPARATORS.items():
+        chars[:, index] = ord(separator)
+    newNames = chars.view(f"U{len(TIME_FORMAT)}").ravel()
+    return [
+        (old, f"{prefix}{new}.dat")
+        for old, new in zip(result.files[changed].tolist(), newNames.tolist())
+    ]
+
+
+def rename_order(pairs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    按依赖排序改名，目标是另一个待改名的源文件时先改名该文件(A→B、B→C时先执行B→C)，
+    源文件或目标重复、改名成环时抛出ValueError
+    """
+    renames = dict(pairs)
+    if len(renames) != len(pairs):
+        raise ValueError("源文件重复")
+    if len(set(renames.values())) != len(pairs):
+        raise ValueError("目标文件重复")
+    ordered: list[tuple[str, str]] = []
+    done: set[str] = set()
+    for old in renames:
+        chain: list[str] = []
+        while old in renames and old not in done:
+            if old in chain:
+                raise ValueError(f"改名成环: {chain}")
+            chain.append(old)
+            old = renames[old]
+        for source in reversed(chain):
+            ordered.append((source, renames[source]))
+            done.add(source)
+    return ordered
+
+
+def apply_renames(path: str, pairs: list[tuple[str, str]]) -> str:
+    """
+    批量改名，按依赖排序后先将全部改名写入日志并落盘再执行，中途出错时撤销已完成的改名
+    日志按执行顺序记录，rollback逆序撤销。返回日志路径，可用rollback撤销整批改名
+    """
+    pairs = rename_order(pairs)
+    sources = {old for old, _ in pairs}
+    # 目标是同一批中先改名的源文件时不算冲突
+    conflicts = [
+        new
+        for _, new in pairs
+        if new not in sources and os.path.exists(os.path.join(path, new))
+    ]
+    if conflicts:
+        raise FileExistsError(f"目标文件已存在: {conflicts[:REPORT_LIMIT]}")
+    journalPath = os.path.join(
+        path, f"{JOURNAL_PREFIX}{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl"
+    )
+    with open(journalPath, "w", encoding="utf-8") as journal:
+        for old, new in pairs:
+            journal.write(json.dumps({"old": old, "new": new}, ensure_ascii=False))
+            journal.write("\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+    done = 0
+    try:
+        for old, new in pairs:
+            os.rename(os.path.join(path, old), os.path.join(path, new))
+            done += 1
+    except OSError:
+        for old, new in reversed(pairs[:done]):
+            os.rename(os.path.join(path, new), os.path.join(path, old))
+        os.remove(journalPath)
+        raise
+    return journalPath
+
+
+def rollback(path: str, journalPath: str | None = None) -> int:
+    """按日志撤销一批改名，默认撤销最近一次，返回撤销的文件数"""
+    if journalPath is None:
+        journals = sorted(
+            glob.glob(os.path.join(glob.escape(path), f"{JOURNAL_PREFIX}*.jsonl"))
+        )
+        if not journals:
+            raise FileNotFoundError(f"{path}下没有改名日志")
+        journalPath = journals[-1]
+    with open(journalPath, "r", encoding="utf-8") as journal:
+        pairs = [json.loads(line) for line in journal if line.strip()]
+    restored = 0
+    for pair in reversed(pairs):
+        old, new = os.path.join(path, pair["old"]), os.path.join(path, pair["new"])
+        # 中断时部分改名可能还未执行
+        if os.path.exists(new) and not os.path.exists(old):
+            os.rename(new, old)
+            restored += 1
+    os.replace(journalPath, journalPath + ".rolledback")
+    return restored
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="检查保存数据的连续性")
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="数据文件夹，默认为各设备的保存路径",
+    )
+    parser.add_argument("--target", default=TARGET, help="检查的数据")
+    parser.add_argument(
+        "--begin",
+        type=datetime.fromisoformat,
+        default=SAVE_CONFIG["begin"],
+        help="检查范围的开始时间，默认为SAVE_CONFIG中的begin",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.fromisoformat,
+        default=SAVE_CONFIG["end"],
+        help="检查范围的结束时间，默认为SAVE_CONFIG中的end，仍在保存时截止到当前时间",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=REPORT_LIMIT, help="每类问题最多列出的条数"
+    )
+    parser.add_argument(
+        "--rename", action="store_true", help="将文件改名为所在时间槽的时间"
+    )
+    parser.add_argument("-y", "--yes", action="store_true", help="改名前不再确认")
+    parser.add_argument(
+        "--rollback",
+        nargs="?",
+        const="",
+        help="撤销改名，可指定日志文件，默认撤销最近一次",
+    )
+    args = parser.parse_args()
+
+    prefix = SAVE_CONFIG["targets"][args.target]["prefix"]
+    interval = SAVE_CONFIG["targets"][args.target]["interval"]
+    paths = args.paths or list(
+        dict.fromkeys(device["savePath"] for device in DEVICES.values())
+    )
+    ok = True
+    for path in paths:
+        print(f"== {path}")
+        if args.rollback is not None:
+            print(f"已撤销{rollback(path, args.rollback or None)}个文件的改名")
+            continue
+        result = analyze(path, prefix, interval, args.begin, args.end)
+        ok = report(result, args.limit) and ok
+        if not args.rename:
+            continue
+        pairs = plan_renames(result, prefix)
+        if not pairs:
+            print("没有需要改名的文件")
+            continue
+        if not args.yes and input(f"将改名{len(pairs)}个文件，是否继续？(y/n)") != "y":
+            continue
+        print(f"改名完成，日志: {apply_renames(path, pairs)}")
+    if not ok:
+        raise SystemExit(1)
@@ -7,6 +7,8 @@ SEND_START = bytes([0xCC, 0x55])
 RECV_START = bytes([0x33, 0x55])
 SEND_END = bytes([0xCC, 0xAA])
 RECV_END = bytes([0x33, 0xAA])
+# DAS配置中发送标志的数据类型顺序
+DAS_DATA_TYPES = ["光强数据", "振动RMS数据", "振动解调数据", "差分解调数据"]
 
 
 class _CommandTypeBase(TypedDict):
@@ -37,7 +39,7 @@ class Command:
     BODY_LENGTH_LEN = 4
     FRAME_END_LEN = 2
     COMMAND_TYPE_DICT: dict[str, CommandType]
-    MAX_BODY_LENGTH = 5000
+    MAX_BODY_LENGTH = max(5000, DAS_CONFIG["dataSize"] * DAS_CONFIG["dtype"].itemsize)
 
     def __init__(self, bytesData: bytes):
         pos = 0
@@ -206,16 +208,15 @@ class SendCommand(Command):
         if name == "DAS配置":
             pulseWidth = data["pulseWidth"] // 4
             body += pulseWidth.to_bytes(4, "little", signed=False)
-            DATA_TYPE = ["光强数据", "振动RMS数据", "振动解调数据", "差分解调数据"]
-            sendFlag = [False] * len(DATA_TYPE) * 2
+            sendFlag = [False] * len(DAS_DATA_TYPES) * 2
             for name, params in data["targets"].items():
                 if params["channel"] not in [0, 1]:
                     raise ValueError(f"Invalid channel value {params['channel']}")
-                if name not in DATA_TYPE:
+                if name not in DAS_DATA_TYPES:
                     raise ValueError(f"Invalid targetData value {name}")
-                sendFlag[len(DATA_TYPE) * params["channel"] + DATA_TYPE.index(name)] = (
-                    True
-                )
+                sendFlag[
+                    len(DAS_DATA_TYPES) * params["channel"] + DAS_DATA_TYPES.index(name)
+                ] = True
             bitFlag = 0
             for i, flag in enumerate(sendFlag):
                 bitFlag |= flag << i
@@ -243,3 +244,19 @@ class SendCommand(Command):
             bytesData += len(body).to_bytes(4, "little", signed=False) + body
         bytesData += SEND_END
         super().__init__(bytesData)
+
+
+def make_recv_frame(name: str, body: bytes) -> bytes:
+    """按设备发送格式构造一帧数据，用于模拟器和性能测试"""
+    cmdType = RecvCommand.COMMAND_TYPE_DICT[name]
+    return (
+        RECV_START
+        + DAS_TYPE
+        + cmdType["head0"]
+        + cmdType["head1"]
+        + cmdType.get("head2", bytes([0x00]))
+        + Command.BODY_INCLUDED_TRUE
+        + len(body).to_bytes(Command.BODY_LENGTH_LEN, "little", signed=False)
+        + body
+        + RECV_END
+    )
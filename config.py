@@ -1,11 +1,35 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
 import logging
+import multiprocessing
+import os
 from typing import Final
 
+# 环境变量覆盖，供模拟器和压力测试在不修改本文件的情况下运行完整流程:
+# - DAS_REMOTE_ADDRESS / DAS_LOCAL_ADDRESS: 设备和本机地址，格式为host:port
+# - DAS_DATA_SIZE: 每帧点数，有效点位范围随之设为全部点位，不应小于默认值
+# - DAS_SAMPLE_RATE: 振动解调数据的采样率，光强数据为其1/50
+# - DAS_SAVE_PATH: 保存路径，设置后从启动时开始保存
+# - DAS_SAVE_BEGIN: 与DAS_SAVE_PATH一起使用的保存开始时间(ISO格式)，未设置时为主进程的启动时间
+# - DAS_METRICS_PORT: 指标服务端口
+# - DAS_HEADLESS: 为1时关闭图表和声音，绘图、声音及其依赖的库都不会被导入
+
+# 无界面运行
+HEADLESS: Final = os.environ.get("DAS_HEADLESS") == "1"
+# 配置只在主进程中校验一次，spawn方式创建的子进程重新导入本文件时跳过
+VALIDATE: Final = multiprocessing.current_process().name == "MainProcess"
+
+
+def _env_address(name: str, default: tuple[str, int]) -> tuple[str, int]:
+    if not os.environ.get(name):
+        return default
+    host, port = os.environ[name].rsplit(":", 1)
+    return (host, int(port))
+
+
 # 原始地址
-REMOTE_ADDRESS: Final = ("192.168.1.240", 8007)
-LOCAL_ADDRESS: Final = ("192.168.1.100", 8009)
+REMOTE_ADDRESS: Final = _env_address("DAS_REMOTE_ADDRESS", ("192.168.1.240", 8007))
+LOCAL_ADDRESS: Final = _env_address("DAS_LOCAL_ADDRESS", ("192.168.1.100", 8009))
 
 # # 使用cpp程序转发后的地址
 # REMOTE_ADDRESS = ("192.168.1.100", 8009)
@@ -29,25 +53,68 @@ DAS_CONFIG: Final = {
     },
     "dtype": np.dtype("<i2"),
 }
+if os.environ.get("DAS_DATA_SIZE"):
+    DAS_CONFIG["dataSize"] = int(os.environ["DAS_DATA_SIZE"])
+    DAS_CONFIG["validPointRange"] = range(0, DAS_CONFIG["dataSize"])
+if os.environ.get("DAS_SAMPLE_RATE"):
+    DAS_CONFIG["targets"]["振动解调数据"]["sampleRate"] = int(
+        os.environ["DAS_SAMPLE_RATE"]
+    )
+    DAS_CONFIG["targets"]["光强数据"]["sampleRate"] = (
+        int(os.environ["DAS_SAMPLE_RATE"]) // 50
+    )
 # 配置校验
-assert (
-    0
-    <= DAS_CONFIG["validPointRange"].start
-    < DAS_CONFIG["validPointRange"].stop
-    <= DAS_CONFIG["dataSize"]
-), f"{DAS_CONFIG['validPointRange']}不在有效范围内"
-assert (
-    DAS_CONFIG["validPointRange"].step == 1
-), f"{DAS_CONFIG['validPointRange']}步长不为1"
+if VALIDATE:
+    assert (
+        0
+        <= DAS_CONFIG["validPointRange"].start
+        < DAS_CONFIG["validPointRange"].stop
+        <= DAS_CONFIG["dataSize"]
+    ), f"{DAS_CONFIG['validPointRange']}不在有效范围内"
+    assert (
+        DAS_CONFIG["validPointRange"].step == 1
+    ), f"{DAS_CONFIG['validPointRange']}步长不为1"
 
 FRAME_COUNTER: Final = {
     "interval": 60,  # 统计间隔，单位: 秒
-    "gist": "振动解调数据",  # 统计依据
+    "capacityFactor": 1.5,  # 到达时间数组容量相对每个间隔理论帧数的倍数
+    "historySize": 60,  # 估计DAS时钟速率使用的最近间隔数
+    "minHistory": 3,  # 间隔数不足时按名义采样率计算丢帧
+    "maxDrift": 1e-3,  # 时钟速率相对名义采样率的最大偏差
+    # 拟合时钟速率时每段取最早到达的一帧作为下包络，时钟误差在一段内的累积应远小于半个周期
+    "envelopeFrames": 50,
+    "percentiles": [50, 90, 99, 99.9],  # 抖动分位数
+    "gapBins": [0, 0.5, 1.5, 2.5, 5, 10, 100],  # 到达间隔直方图分界，单位: 帧周期
+}
+# 配置校验
+if VALIDATE:
+    assert (
+        FRAME_COUNTER["capacityFactor"] > 1
+    ), f"{FRAME_COUNTER['capacityFactor']}必须大于1"
+    assert (
+        FRAME_COUNTER["envelopeFrames"] * FRAME_COUNTER["maxDrift"] < 0.1
+    ), f"{FRAME_COUNTER['envelopeFrames']}帧内的最大时钟误差超过0.1个周期"
+    assert (
+        99 in FRAME_COUNTER["percentiles"]
+    ), f"{FRAME_COUNTER['percentiles']}必须包含99分位数"
+    assert FRAME_COUNTER["gapBins"] == sorted(
+        FRAME_COUNTER["gapBins"]
+    ), f"{FRAME_COUNTER['gapBins']}必须递增"
+
+# 帧时钟配置，数据块的时间由帧序号和拟合的DAS时钟推算，不受到达时间抖动的影响
+FRAME_CLOCK: Final = {
+    "window": 60,  # 拟合使用的最近数据块数，也是系统时间偏移量的平滑系数
+    "minPoints": 3,  # 数据块数不足时按名义采样率推算
+    "lossThreshold": 0.75,  # 整块最早到达的帧偏离模型超过该周期数时按丢帧补齐帧序号
 }
 # 配置校验
-assert (
-    FRAME_COUNTER["gist"] in DAS_CONFIG["targets"]
-), f"{FRAME_COUNTER['gist']}未在DAS_CONFIG中定义"
+if VALIDATE:
+    assert (
+        FRAME_CLOCK["window"] >= FRAME_CLOCK["minPoints"] >= 2
+    ), "需要window >= minPoints >= 2"
+    assert (
+        0.5 <= FRAME_CLOCK["lossThreshold"] < 1
+    ), f"{FRAME_CLOCK['lossThreshold']}不在[0.5, 1)范围内"
 
 # 处理数据的最小时间间隔，所有处理任务都必须是它的整数倍，单位: 秒
 HANDLE_INTERVAL: Final = 1
@@ -55,9 +122,10 @@ HANDLE_INTERVAL: Final = 1
 # 如果不为空，则会强制校准该数据的处理开始时间，但在保存时段之前的所有数据均不会被处理
 STRICT_BEGIN_TARGET: Final = "振动解调数据"
 # 配置校验
-assert (
-    not STRICT_BEGIN_TARGET or STRICT_BEGIN_TARGET in DAS_CONFIG["targets"]
-), f"{STRICT_BEGIN_TARGET}未在DAS_CONFIG中定义"
+if VALIDATE:
+    assert (
+        not STRICT_BEGIN_TARGET or STRICT_BEGIN_TARGET in DAS_CONFIG["targets"]
+    ), f"{STRICT_BEGIN_TARGET}未在DAS_CONFIG中定义"
 
 SAVE_CONFIG: Final = {
     "enable": False,  # 是否保存数据
@@ -75,24 +143,230 @@ SAVE_CONFIG: Final = {
         },
     },
 }
+if os.environ.get("DAS_SAVE_PATH"):
+    # 开始时间由主进程确定后写入环境变量，spawn启动的子进程重新导入配置时沿用同一时间
+    os.environ.setdefault("DAS_SAVE_BEGIN", datetime.now().isoformat())
+    SAVE_CONFIG["enable"] = True
+    SAVE_CONFIG["path"] = os.environ["DAS_SAVE_PATH"]
+    SAVE_CONFIG["begin"] = datetime.fromisoformat(os.environ["DAS_SAVE_BEGIN"])
+    SAVE_CONFIG["end"] = SAVE_CONFIG["begin"] + timedelta(days=365)
 # 配置校验
-for _, params in SAVE_CONFIG["targets"].items():
+if VALIDATE:
+    for _, params in SAVE_CONFIG["targets"].items():
+        assert (
+            params["interval"] % HANDLE_INTERVAL == 0
+        ), f"{params['interval']}不是{HANDLE_INTERVAL}的整数倍"
+    for target in SAVE_CONFIG["targets"]:
+        assert target in DAS_CONFIG["targets"], f"{target}未在DAS_CONFIG中定义"
+
+# 在线生成标注文件，输出与transform_file.py相同，保存在数据保存路径下的label文件夹中
+# 数据块在内存中时直接降采样，在SAVE_CONFIG的保存时间范围内生成，无需事后再读取原始文件
+LABEL_CONFIG: Final = {
+    "enable": False,  # 是否在线生成标注文件
+    "target": "振动解调数据",  # 生成标注文件的数据
+    "interval": 30,  # 每个标注文件的时长，单位: 秒
+    "overlap": 0.5,  # 相邻标注文件的重叠率
+    "downsample": 10,  # RMS降采样倍数
+}
+# 配置校验
+if VALIDATE:
+    assert (
+        LABEL_CONFIG["target"] in DAS_CONFIG["targets"]
+    ), f"{LABEL_CONFIG['target']}未在DAS_CONFIG中定义"
+    assert (
+        LABEL_CONFIG["interval"] % HANDLE_INTERVAL == 0
+    ), f"{LABEL_CONFIG['interval']}不是{HANDLE_INTERVAL}的整数倍"
+    assert (
+        0 <= LABEL_CONFIG["overlap"] < 1
+    ), f"{LABEL_CONFIG['overlap']}不在[0, 1)范围内"
     assert (
-        params["interval"] % HANDLE_INTERVAL == 0
-    ), f"{params['interval']}不是{HANDLE_INTERVAL}的整数倍"
-for target in SAVE_CONFIG["targets"]:
-    assert target in DAS_CONFIG["targets"], f"{target}未在DAS_CONFIG中定义"
+        LABEL_CONFIG["overlap"] * LABEL_CONFIG["interval"] % HANDLE_INTERVAL == 0
+    ), f"重叠时长不是{HANDLE_INTERVAL}的整数倍"
+    assert (
+        DAS_CONFIG["targets"][LABEL_CONFIG["target"]]["sampleRate"] * HANDLE_INTERVAL
+    ) % LABEL_CONFIG["downsample"] == 0, (
+        f"每个数据块的帧数不是{LABEL_CONFIG['downsample']}的整数倍"
+    )
+
+# DAS设备配置，每台设备使用独立的本机端口、接收进程、数据缓冲区和数据处理进程
+# 所有设备的点数和数据源与DAS_CONFIG相同，das中的项覆盖DAS_CONFIG中不影响数据尺寸的参数
+# 多台设备时数据保存在SAVE_CONFIG["path"]下以设备名命名的子文件夹中，指标带有device标签
+# 绘图、声音、物理量换算、f-k滤波、感兴趣区域和数据流服务只处理第一台设备
+DEVICES: Final = {
+    "das": {
+        "remote": REMOTE_ADDRESS,  # 设备地址
+        "local": LOCAL_ADDRESS,  # 本机地址，每台设备的端口不能相同
+        "cpus": None,  # 接收进程绑定的CPU核，如[2]，None为不绑定
+        "das": {},  # 如{"pulseWidth": 200}
+    },
+}
+DEVICE_OVERRIDES: Final = [
+    "pulseWidth",
+    "opticalSwitchFlag",
+    "opticalSwitchCounterThreshold",
+]
+MULTI_DEVICE: Final = len(DEVICES) > 1
+for name, device in DEVICES.items():
+    device["savePath"] = (
+        os.path.join(SAVE_CONFIG["path"], name) if MULTI_DEVICE else SAVE_CONFIG["path"]
+    )
+# 配置校验
+if VALIDATE:
+    assert DEVICES, "DEVICES不能为空"
+    assert len({tuple(device["local"]) for device in DEVICES.values()}) == len(
+        DEVICES
+    ), "各设备的本机地址不能相同"
+    for name, device in DEVICES.items():
+        for key in device["das"]:
+            assert key in DEVICE_OVERRIDES, f"设备{name}的{key}不能单独配置"
+        assert device["cpus"] is None or device["cpus"], f"设备{name}的cpus不能为空"
+
+# 低延迟接收配置，接收进程被调度出去时内核接收缓冲区可能溢出，开启后尽量让接收进程独占CPU核
+RECEIVER_CONFIG: Final = {
+    "lowLatency": False,  # 是否启用低延迟模式，以下参数只在该模式下生效
+    "isolatedCpus": True,  # 设备未配置cpus时，依次绑定到由isolcpus隔离的CPU核(仅Linux)
+    "priority": 50,  # SCHED_FIFO实时优先级(仅Linux，需要CAP_SYS_NICE)，其它平台改为高优先级
+    "recvBuffer": 32 * 2**20,  # 套接字接收缓冲区大小，单位: 字节，None为系统默认
+    "busyPoll": 50,  # SO_BUSY_POLL忙轮询时长(仅Linux)，单位: 微秒，0为不启用
+    "gcFreeze": True,  # 冻结启动时的对象并关闭自动垃圾回收，改为每秒集中回收新对象
+    "fullGcInterval": 60,  # 每隔多少秒做一次完整回收，回收进入最老一代的循环引用
+}
+if os.environ.get("DAS_LOW_LATENCY"):
+    RECEIVER_CONFIG["lowLatency"] = os.environ["DAS_LOW_LATENCY"] == "1"
+# 配置校验
+if VALIDATE:
+    assert (
+        1 <= RECEIVER_CONFIG["priority"] <= 99
+    ), f"{RECEIVER_CONFIG['priority']}不在[1, 99]范围内"
+    assert (
+        RECEIVER_CONFIG["recvBuffer"] is None or RECEIVER_CONFIG["recvBuffer"] > 0
+    ), f"{RECEIVER_CONFIG['recvBuffer']}不是正数"
+    assert RECEIVER_CONFIG["busyPoll"] >= 0, f"{RECEIVER_CONFIG['busyPoll']}不能为负数"
+    assert (
+        isinstance(RECEIVER_CONFIG["fullGcInterval"], int)
+        and RECEIVER_CONFIG["fullGcInterval"] > 0
+    ), f"{RECEIVER_CONFIG['fullGcInterval']}不是正整数"
+
+# 物理量换算配置，每个数据块只换算一次，换算结果在各处理环节间共享
+PHYSICAL_CONFIG: Final = {
+    "targets": {
+        "振动解调数据": {
+            "unit": "rad",  # 换算单位，可选: raw, rad, strain
+            "scale": np.pi / 255,  # 标定系数，原始值到弧度的比例
+        },
+        "光强数据": {
+            "unit": "rad",
+            "scale": np.pi / 255,
+        },
+    },
+    # 相位到应变的换算参数，仅在unit为strain时使用
+    "strain": {
+        "wavelength": 1550.12e-9,  # 激光波长，单位: m
+        "refractiveIndex": 1.4682,  # 光纤折射率
+        "photoelasticFactor": 0.78,  # 光弹系数修正因子
+        "gaugeLength": 10,  # 标距长度，单位: m
+    },
+}
+PHYSICAL_UNITS: Final = ["raw", "rad", "strain"]
+# 配置校验
+if VALIDATE:
+    for name, params in PHYSICAL_CONFIG["targets"].items():
+        assert name in DAS_CONFIG["targets"], f"{name}未在DAS_CONFIG中定义"
+        assert params["unit"] in PHYSICAL_UNITS, f"{params['unit']}不是有效的换算单位"
+
+# f-k二维滤波配置，按视速度在频率-波数域去除(或保留)相干噪声，输出比输入滞后一个处理间隔
+FK_CONFIG: Final = {
+    "enable": False,  # 是否启用f-k滤波
+    "pointSpacing": 1.0,  # 相邻点位的空间间隔，单位: m
+    "targets": {
+        "振动解调数据": {
+            "velocity": (5, 40),  # 视速度范围，单位: m/s
+            "mode": "reject",  # reject: 去除该速度范围, pass: 只保留该速度范围
+            "taper": 0.1,  # 速度边界的相对过渡宽度
+        },
+    },
+}
+FK_MODES: Final = ["reject", "pass"]
+# 配置校验
+if VALIDATE:
+    assert FK_CONFIG["pointSpacing"] > 0, f"{FK_CONFIG['pointSpacing']}不是正数"
+    for name, params in FK_CONFIG["targets"].items():
+        assert name in PHYSICAL_CONFIG["targets"], f"{name}未在PHYSICAL_CONFIG中定义"
+        assert (
+            0 < params["velocity"][0] < params["velocity"][1]
+        ), f"{params['velocity']}不是有效的速度范围"
+        assert params["mode"] in FK_MODES, f"{params['mode']}不是有效的滤波模式"
+        assert 0 <= params["taper"] < 1, f"{params['taper']}不在[0, 1)范围内"
+
+DATA_SOURCES: Final = ["phys", "fk"]
+
+# 感兴趣区域配置，每个区域只处理自己的点位范围，stages中出现的环节才会运行
+REGION_CONFIG: Final = {
+    "regions": {
+        "井口": {
+            "target": "振动解调数据",
+            "points": range(1800, 1999),  # 区域点位范围
+            "decimation": 1,  # 降采样倍数
+            "source": "phys",  # 数据来源，phys: 物理量换算结果, fk: f-k滤波结果
+            "stages": {
+                "filter": {"lowcut": 100, "highcut": 1000, "order": 4},  # 带通滤波
+                "fft": {},  # 频谱计算，每个点位的主频和幅值作为频谱事件发布
+                "detection": {"threshold": 5},  # RMS超过阈值时触发事件
+                # "save": {"prefix": "Region"},  # 保存区域数据(float32)
+            },
+        },
+    },
+}
+REGION_STAGES: Final = ["filter", "fft", "detection", "save"]
+# 配置校验
+if VALIDATE:
+    for name, params in REGION_CONFIG["regions"].items():
+        assert (
+            params["target"] in PHYSICAL_CONFIG["targets"]
+        ), f"区域{name}的{params['target']}未在PHYSICAL_CONFIG中定义"
+        assert (
+            DAS_CONFIG["validPointRange"].start
+            <= params["points"].start
+            < params["points"].stop
+            <= DAS_CONFIG["validPointRange"].stop
+        ), f"区域{name}的{params['points']}不在有效点位范围内"
+        assert params["points"].step == 1, f"区域{name}的{params['points']}步长不为1"
+        assert (
+            isinstance(params["decimation"], int) and params["decimation"] > 0
+        ), f"区域{name}的降采样倍数{params['decimation']}不是正整数"
+        for stage in params["stages"]:
+            assert stage in REGION_STAGES, f"区域{name}的{stage}不是有效的处理环节"
+        sampleRate = DAS_CONFIG["targets"][params["target"]]["sampleRate"]
+        assert (
+            sampleRate * HANDLE_INTERVAL % params["decimation"] == 0
+        ), f"区域{name}每个数据块的帧数不是降采样倍数{params['decimation']}的整数倍"
+        if "filter" in params["stages"]:
+            assert (
+                params["stages"]["filter"]["highcut"] * 2 * params["decimation"]
+                <= sampleRate
+            ), f"区域{name}的滤波上限频率超过降采样后的奈奎斯特频率"
+        assert (
+            params["source"] in DATA_SOURCES
+        ), f"区域{name}的{params['source']}不是有效的数据来源"
+        if params["source"] == "fk":
+            assert (
+                FK_CONFIG["enable"] and params["target"] in FK_CONFIG["targets"]
+            ), f"区域{name}的{params['target']}未启用f-k滤波"
 
 PLOT_CONFIG: Final = {
     "enable": True,  # 是否显示图表
     "interval": 20,  # 图表更新间隔，单位: ms
+    "publishInterval": 10,  # 接收进程发布最新帧的间隔，单位: ms
+    "statInterval": 60,  # 绘制耗时统计的输出间隔，单位: 秒
     "targets": {
         "振动解调数据": {
             "charts": [
-                {"type": "heat", "size": 100},
+                {"type": "heat", "size": 100},  # agg可选: max, rms, last
                 {"type": "space"},
-                {"type": "time", "point": 500, "size": 100},
-                {"type": "time", "point": 1000, "size": 100},
+                # 时间波形显示全部采样，size为显示的采样数，decimate控制是否按像素宽度做最值抽取
+                {"type": "time", "point": 500, "size": 5000},
+                {"type": "time", "point": 1000, "size": 5000},
+                # {"type": "heat", "size": 100, "source": "fk"},  # 最近一个f-k滤波数据块
             ],
             "min": -20,
             "max": 20,
@@ -107,31 +381,152 @@ PLOT_CONFIG: Final = {
         },
     },
 }
+if HEADLESS:
+    PLOT_CONFIG["enable"] = False
 PLOT_TYPES: Final = {
     "heat": ["size"],
     "space": [],
     "time": ["point", "size"],
 }
+# 接收进程按刷新区间聚合的统计量，图表可通过agg参数选择显示哪一种
+PLOT_AGGREGATES: Final = ["max", "rms", "last"]
+# 各类型图表默认显示的统计量
+PLOT_DEFAULT_AGG: Final = {
+    "heat": "max",
+    "space": "last",
+    "time": "last",
+}
 # 配置校验
-for name, target in PLOT_CONFIG["targets"].items():
-    assert name in DAS_CONFIG["targets"], f"{name}未在DAS_CONFIG中定义"
-    for chart in target["charts"]:
-        assert chart["type"] in PLOT_TYPES, f"{chart['type']}不是有效的图表类型"
-        for param in PLOT_TYPES[chart["type"]]:
-            assert param in chart, f"{chart['type']}类型缺少{param}参数"
-        if "size" in chart:
-            assert (
-                isinstance(chart["size"], int) and chart["size"] > 0
-            ), f"{chart['size']} 不是正整数"
-        if "point" in chart:
-            assert (
-                chart["point"] in DAS_CONFIG["validPointRange"]
-            ), f"{chart['point']} 不在有效点位范围内"
+if VALIDATE:
+    assert (
+        0 < PLOT_CONFIG["publishInterval"] <= PLOT_CONFIG["interval"]
+    ), f"{PLOT_CONFIG['publishInterval']}不在(0, {PLOT_CONFIG['interval']}]范围内"
+    for name, target in PLOT_CONFIG["targets"].items():
+        assert name in DAS_CONFIG["targets"], f"{name}未在DAS_CONFIG中定义"
+        assert name in PHYSICAL_CONFIG["targets"], f"{name}未在PHYSICAL_CONFIG中定义"
+        for chart in target["charts"]:
+            assert chart["type"] in PLOT_TYPES, f"{chart['type']}不是有效的图表类型"
+            for param in PLOT_TYPES[chart["type"]]:
+                assert param in chart, f"{chart['type']}类型缺少{param}参数"
+            if "size" in chart:
+                assert (
+                    isinstance(chart["size"], int) and chart["size"] > 0
+                ), f"{chart['size']} 不是正整数"
+            if "point" in chart:
+                assert (
+                    chart["point"] in DAS_CONFIG["validPointRange"]
+                ), f"{chart['point']} 不在有效点位范围内"
+            if "agg" in chart:
+                assert (
+                    chart["agg"] in PLOT_AGGREGATES
+                ), f"{chart['agg']}不是有效的统计量"
+            if chart.get("source", "phys") == "fk":
+                assert chart["type"] == "heat", f"{chart['type']}类型不支持f-k数据来源"
+                assert (
+                    FK_CONFIG["enable"] and name in FK_CONFIG["targets"]
+                ), f"{name}未启用f-k滤波"
+
+# 实时数据流服务配置，供远程观看者订阅，与本地绘图共用接收进程发布的区间统计量
+STREAM_CONFIG: Final = {
+    "enable": False,  # 是否启动数据流服务
+    "host": "127.0.0.1",  # 监听地址
+    "port": 8765,  # 监听端口
+    "targets": ["振动解调数据", "光强数据"],  # 可订阅的数据
+    "maxRate": 50,  # 单个订阅的最大发送速率，单位: Hz
+    "pollInterval": 10,  # 读取共享内存的间隔，单位: ms
+    "queueSize": 256,  # 每个客户端发送队列的最大消息数，满时丢弃最旧的消息
+}
+# 配置校验
+if VALIDATE:
+    for name in STREAM_CONFIG["targets"]:
+        assert name in DAS_CONFIG["targets"], f"{name}未在DAS_CONFIG中定义"
+        assert name in PHYSICAL_CONFIG["targets"], f"{name}未在PHYSICAL_CONFIG中定义"
+    assert STREAM_CONFIG["maxRate"] > 0, f"{STREAM_CONFIG['maxRate']}不是正数"
+    assert STREAM_CONFIG["queueSize"] > 0, f"{STREAM_CONFIG['queueSize']}不是正数"
+
+# 历史数据查询服务配置
+# GET /query?target=名称&begin=开始时间&end=结束时间，时间为ISO格式的本地时间，可选参数:
+# - device: 设备名，默认为第一台设备
+# - points: start,stop,step，默认为全部有效点位
+# - step: 降采样倍数，不指定agg时每step帧取一帧
+# - agg: 每step帧聚合为一帧，可选QUERY_AGGREGATES中的方式，输出float32
+# 响应体为一行JSON元数据(数据类型、列数、帧率和连续的时间段)和按帧排列的二进制数组，格式见query_server.py
+QUERY_AGGREGATES: Final = ["mean", "rms", "min", "max", "absmax"]
+QUERY_CONFIG: Final = {
+    "enable": False,  # 是否启动查询服务
+    "host": "127.0.0.1",  # 监听地址
+    "port": 8766,  # 监听端口
+    "cacheSize": 512 * 2**20,  # 解码后数据文件的缓存上限，单位: 字节
+    "indexInterval": 5,  # 文件夹有变化时重新建立文件索引的最小间隔，单位: 秒
+}
+# 配置校验
+if VALIDATE:
+    assert QUERY_CONFIG["cacheSize"] > 0, f"{QUERY_CONFIG['cacheSize']}不是正数"
+    assert (
+        QUERY_CONFIG["indexInterval"] >= 0
+    ), f"{QUERY_CONFIG['indexInterval']}不能为负数"
+
+# 运行指标配置
+METRICS_CONFIG: Final = {
+    "enable": True,  # 是否启动指标服务
+    "host": "127.0.0.1",  # 监听地址
+    "port": 9108,  # 监听端口，文本格式指标位于 /metrics
+    "snapshotInterval": 60,  # 快照写入间隔，单位: 秒
+    "snapshotPath": "logs/metrics.jsonl",  # 快照文件路径，每行一个JSON
+}
+if os.environ.get("DAS_METRICS_PORT"):
+    METRICS_CONFIG["port"] = int(os.environ["DAS_METRICS_PORT"])
+# 配置校验
+if VALIDATE:
+    assert (
+        METRICS_CONFIG["snapshotInterval"] > 0
+    ), f"{METRICS_CONFIG['snapshotInterval']}不是正数"
+
+# 性能分析配置
+# 在PROFILE_CONFIG["controlDir"]下创建以进程角色(receiver/saver/analytics/plotter)命名的文件，
+# 或向该进程发送SIGUSR1(仅POSIX)即可开始分析，文件内容可为"时长 方式"，如"10 sampling"
+PROFILE_MODES: Final = ["cprofile", "sampling"]
+PROFILE_CONFIG: Final = {
+    "timing": False,  # 是否统计主要回调的耗时，关闭时不做任何包装
+    "mode": "cprofile",  # 默认分析方式，sampling为定期采样调用栈，开销较小
+    "duration": 30,  # 默认分析时长，单位: 秒
+    "sampleInterval": 0.005,  # 采样间隔，单位: 秒
+    "controlDir": "profile",  # 控制文件所在文件夹
+    "path": "logs/profile",  # 分析结果保存路径
+}
+# 配置校验
+if VALIDATE:
+    assert (
+        PROFILE_CONFIG["mode"] in PROFILE_MODES
+    ), f"{PROFILE_CONFIG['mode']}不是有效的分析方式"
+    assert PROFILE_CONFIG["duration"] > 0, f"{PROFILE_CONFIG['duration']}不是正数"
+    assert (
+        PROFILE_CONFIG["sampleInterval"] > 0
+    ), f"{PROFILE_CONFIG['sampleInterval']}不是正数"
 
 # pingpong缓冲区大小
 PINGPONG_SIZE: Final = 3
 # 配置校验
-assert PINGPONG_SIZE >= 2, f"PINGPONG_SIZE必须大于等于2"
+if VALIDATE:
+    assert PINGPONG_SIZE >= 2, f"PINGPONG_SIZE必须大于等于2"
+
+# 数据块消费者，每台设备的每个消费者一个进程，各自从环形缓冲区读取数据块，互不等待
+# - saver: 保存数据和生成标注文件
+# - analytics: 物理量换算、f-k滤波、区域检测和声音播放，只处理第一台设备
+# required为True时数据块在该消费者处理完之前不会被覆盖，处理不及时时接收进程丢弃新的数据块；
+# 为False时不阻止数据块被覆盖，落后时跳过数据块。nice为进程优先级的降低量，0为不变
+CONSUMERS: Final = ["saver", "analytics"]
+CONSUMER_CONFIG: Final = {
+    "saver": {"required": True, "nice": 0},
+    "analytics": {"required": False, "nice": 5},
+}
+# 配置校验
+if VALIDATE:
+    assert sorted(CONSUMER_CONFIG) == sorted(
+        CONSUMERS
+    ), f"CONSUMER_CONFIG必须包含{CONSUMERS}"
+    for name, params in CONSUMER_CONFIG.items():
+        assert params["nice"] >= 0, f"{name}的nice不能为负数"
 
 # 声音播放配置
 SOUND_CONFIG: Final = {
@@ -142,22 +537,37 @@ SOUND_CONFIG: Final = {
     "lowcut": 100,  # 低通滤波截止频率
     "highcut": 1000,  # 高通滤波截止频率
     "order": 5,  # 滤波器阶数
+    "blocksize": 128,  # 声卡回调每次读取的采样数
+    "latency": 0.05,  # 目标缓冲时长，单位: 秒
+    "ringTime": 1,  # 环形缓冲区容量，单位: 秒
+    "maxMixPoints": 8,  # 可同时混合监听的最大点位数
 }
+if HEADLESS:
+    SOUND_CONFIG["enable"] = False
 # 配置校验
-assert (
-    SOUND_CONFIG["target"] in DAS_CONFIG["targets"]
-), f"{SOUND_CONFIG['target']}未在DAS_CONFIG中定义"
-assert (
-    SAVE_CONFIG["point"] in DAS_CONFIG["validPointRange"]
-), f"{SAVE_CONFIG['point']}不在有效点位范围"
+if VALIDATE:
+    assert (
+        SOUND_CONFIG["target"] in DAS_CONFIG["targets"]
+    ), f"{SOUND_CONFIG['target']}未在DAS_CONFIG中定义"
+    assert (
+        SOUND_CONFIG["latency"] * 2 < SOUND_CONFIG["ringTime"]
+    ), f"{SOUND_CONFIG['latency']}的两倍必须小于环形缓冲区容量{SOUND_CONFIG['ringTime']}"
+    assert (
+        SOUND_CONFIG["point"] in DAS_CONFIG["validPointRange"]
+    ), f"{SOUND_CONFIG['point']}不在有效点位范围"
 
 # 日志配置
 LOG_CONFIG: Final = {
     "level": "DEBUG",  # 动态帧率显示仅在DEBUG等级下显示
     "path": "logs",  # 日志保存路径
     "backupCount": 7,  # 日志备份天数
+    "rateInterval": 10,  # 限流窗口，单位: 秒
+    "rateBurst": 5,  # 同一消息在每个限流窗口内最多输出的条数
 }
 # 配置校验
-assert (
-    LOG_CONFIG["level"] in logging._nameToLevel
-), f"{LOG_CONFIG['level']}不是有效的日志级别"
+if VALIDATE:
+    assert (
+        LOG_CONFIG["level"] in logging._nameToLevel
+    ), f"{LOG_CONFIG['level']}不是有效的日志级别"
+    assert LOG_CONFIG["rateInterval"] > 0, f"{LOG_CONFIG['rateInterval']}不是正数"
+    assert LOG_CONFIG["rateBurst"] > 0, f"{LOG_CONFIG['rateBurst']}不是正数"
@@ -0,0 +1,55 @@
+import ctypes
+import numpy as np
+from config import DAS_CONFIG, PHYSICAL_CONFIG
+from utils import DataBuffer
+
+
+class PhysicalConverter:
+    """
+    原始int16数据到物理量(相位或应变)的float32换算
+    每个数据块只换算一次，结果写入复用的输出缓冲区，供区域检测和f-k滤波等分析环节共享读取。
+    共享缓冲区只在数据块写满并由analytics消费者换算后才可用，且analytics落后时会跳过数据块，因此:
+    绘图需要在数据块写满前实时显示，只换算接收进程发布的区间统计量和新到达的少量列，不读取共享缓冲区；
+    保存的文件保持设备的原始格式，由transform_file.py等离线工具换算
+    """
+
+    def __init__(self, name: str):
+        params = PHYSICAL_CONFIG["targets"][name]
+        self.name = name
+        self.unit: str = params["unit"]
+        scale = params.get("scale", 1)
+        if self.unit == "strain":
+            # 相位到应变: ε = φ·λ / (4π·n·ξ·L)
+            strain = PHYSICAL_CONFIG["strain"]
+            scale *= strain["wavelength"] / (
+                4
+                * np.pi
+                * strain["refractiveIndex"]
+                * strain["photoelasticFactor"]
+                * strain["gaugeLength"]
+            )
+        self.scale = np.float32(scale)
+
+    def convert(self, raw: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        if out is None:
+            out = np.empty(raw.shape, dtype=np.float32)
+        return np.multiply(raw, self.scale, out=out)
+
+    def convert_block(self, rawBuffer: DataBuffer, physBuffer: DataBuffer):
+        """
+        将一个原始数据块换算到对应的共享物理量缓冲区
+        rawBuffer为analytics复制的私有副本，接收进程覆盖环形缓冲区不影响换算，无需加锁
+        """
+        raw = np.frombuffer(rawBuffer["buffer"], dtype=DAS_CONFIG["dtype"])
+        phys = np.frombuffer(physBuffer["buffer"], dtype=np.float32)
+        with physBuffer["lock"]:
+            self.convert(raw, out=phys)
+
+
+def phys_block_size(rawBuffer: DataBuffer) -> int:
+    """与原始数据块对应的float32缓冲区字节数"""
+    return (
+        len(rawBuffer["buffer"])
+        // DAS_CONFIG["dtype"].itemsize
+        * ctypes.sizeof(ctypes.c_float)
+    )
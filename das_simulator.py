@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import signal
+import time
+import numpy as np
+from command import (
+    Command,
+    DAS_DATA_TYPES,
+    DataNotReceived,
+    SEND_END,
+    SEND_START,
+    SendCommand,
+    make_recv_frame,
+)
+from config import DAS_CONFIG, REMOTE_ADDRESS
+from utils import bytes_to_hex, log
+
+# 每个数据源预先生成的帧数，发送时循环使用
+POOL_SIZE = 256
+# 发送循环的间隔，单位: 秒
+TICK = 0.001
+# 收到开始发送命令到发出第一帧的延迟，单位: 秒
+# 接收端在发送开始命令0.2秒后才开始处理数据，延迟更短时开头的帧会被计为丢失
+START_DELAY = 0.5
+
+
+class DeviceCommand(Command):
+    """设备端收到的命令"""
+
+    COMMAND_TYPE_DICT = SendCommand.COMMAND_TYPE_DICT
+
+    def __init__(self, cmdBytes: bytes):
+        super().__init__(cmdBytes)
+        if self.frameStart != SEND_START:
+            raise ValueError(
+                f"Invalid frameStart value {bytes_to_hex(self.frameStart)}"
+            )
+        if self.frameEnd != SEND_END:
+            raise ValueError(f"Invalid frameEnd value {bytes_to_hex(self.frameEnd)}")
+
+
+def frame_pool(name: str, sampleRate: float, seed: int = 0) -> list[bytes]:
+    """正弦信号叠加噪声，每个点位的频率不同，便于在图表中辨认"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(POOL_SIZE)[:, None] / sampleRate
+    freq = np.linspace(10, sampleRate / 4, DAS_CONFIG["dataSize"])[None, :]
+    data = 500 * np.sin(2 * np.pi * freq * t) + rng.normal(
+        0, 50, (POOL_SIZE, DAS_CONFIG["dataSize"])
+    )
+    return [
+        make_recv_frame(name, row.astype(DAS_CONFIG["dtype"]).tobytes()) for row in data
+    ]
+
+
+class DASSimulator(asyncio.DatagramProtocol):
+    """
+    模拟DAS设备
+    收到DAS配置后按其中的发送标志确定数据源，收到开始/停止发送命令后按配置的采样率发送数据帧。
+    每个周期按经过的时间补齐应发送的帧数，因此长期速率是精确的。可按比例注入丢帧和相邻帧乱序
+    """
+
+    def __init__(
+        self,
+        loss: float = 0,
+        reorder: float = 0,
+        seed: int = 0,
+        startDelay: float = START_DELAY,
+    ):
+        self._loss = loss
+        self._startDelay = startDelay
+        self._reorder = reorder
+        self._rng = np.random.default_rng(seed)
+        self._transport: asyncio.DatagramTransport | None = None
+        self._client = None
+        self._pools: dict[str, list[bytes]] = {}
+        self._streamTask: asyncio.Task | None = None
+        # 实际发出的帧数和主动丢弃的帧数
+        self.sent: dict[str, int] = {}
+        self.dropped: dict[str, int] = {}
+        # 累计发送时长，单位: 秒
+        self.elapsed = 0.0
+        self._beginTime: float | None = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            cmd = DeviceCommand(bytes(data))
+        except (ValueError, DataNotReceived) as e:
+            log.warning("无效命令: %s", e)
+            return
+        self._client = addr
+        if cmd.name == "DAS配置":
+            self.configure(bytes(cmd.body))
+        elif cmd.name == "高速数据开始发送":
+            if self._streamTask is None:
+                log.info("开始发送数据: %s", list(self._pools))
+                self._streamTask = asyncio.create_task(self.stream())
+        elif cmd.name == "高速数据停止发送":
+            self.stop()
+
+    def configure(self, body: bytes):
+        flags = int.from_bytes(body[4:8], "little", signed=False)
+        self._pools = {}
+        for i, name in enumerate(DAS_DATA_TYPES * 2):
+            if not flags >> i & 1 or name in self._pools:
+                continue
+            if name not in DAS_CONFIG["targets"]:
+                log.warning("%s未在DAS_CONFIG中定义采样率，不发送", name)
+                continue
+            self._pools[name] = frame_pool(
+                name, DAS_CONFIG["targets"][name]["sampleRate"]
+            )
+            self.sent.setdefault(name, 0)
+            self.dropped.setdefault(name, 0)
+        log.info("收到DAS配置: %s", list(self._pools))
+
+    def stop(self):
+        if self._streamTask is not None:
+            self._streamTask.cancel()
+            self._streamTask = None
+            if self._beginTime is not None:
+                self.elapsed += time.monotonic() - self._beginTime
+                self._beginTime = None
+            log.info(
+                "停止发送数据, 发送帧数: %s, 主动丢弃帧数: %s", self.sent, self.dropped
+            )
+
+    async def stream(self):
+        assert self._transport is not None
+        await asyncio.sleep(self._startDelay)
+        self._beginTime = beginTime = time.monotonic()
+        total = {name: 0 for name in self._pools}
+        # 等待与下一帧交换顺序的帧
+        held: dict[str, bytes | None] = {name: None for name in self._pools}
+        while True:
+            await asyncio.sleep(TICK)
+            elapsed = time.monotonic() - beginTime
+            for name, pool in self._pools.items():
+                due = int(elapsed * DAS_CONFIG["targets"][name]["sampleRate"])
+                count = due - total[name]
+                if count <= 0:
+                    continue
+                drops = self._rng.random(count) < self._loss
+                swaps = self._rng.random(count) < self._reorder
+                for i in range(count):
+                    frame = pool[(total[name] + i) % len(pool)]
+                    if drops[i]:
+                        self.dropped[name] += 1
+                        continue
+                    if held[name] is None and swaps[i]:
+                        held[name] = frame
+                        continue
+                    self._transport.sendto(frame, self._client)
+                    self.sent[name] += 1
+                    if held[name] is not None:
+                        self._transport.sendto(held[name], self._client)
+                        self.sent[name] += 1
+                        held[name] = None
+                total[name] = due
+
+
+async def simulate(
+    address: tuple[str, int], loss: float, reorder: float, startDelay: float
+) -> DASSimulator:
+    loop = asyncio.get_running_loop()
+    simulator = DASSimulator(loss, reorder, startDelay=startDelay)
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: simulator, local_addr=address
+    )
+    log.info("DAS模拟器已启动: %s:%s", address[0], address[1])
+    stopEvent = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGINT, stopEvent.set)
+        loop.add_signal_handler(signal.SIGTERM, stopEvent.set)
+    except NotImplementedError:
+        # Windows下由KeyboardInterrupt结束
+        pass
+    try:
+        await stopEvent.wait()
+    finally:
+        simulator.stop()
+        transport.close()
+    return simulator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DAS设备模拟器")
+    parser.add_argument(
+        "--address",
+        default=f"{REMOTE_ADDRESS[0]}:{REMOTE_ADDRESS[1]}",
+        help="监听地址，默认为REMOTE_ADDRESS",
+    )
+    parser.add_argument("--loss", type=float, default=0, help="主动丢帧比例")
+    parser.add_argument("--reorder", type=float, default=0, help="相邻帧乱序比例")
+    parser.add_argument(
+        "--start-delay",
+        type=float,
+        default=START_DELAY,
+        help="收到开始发送命令到发出第一帧的延迟，单位: 秒",
+    )
+    parser.add_argument("--report", help="退出时将发送和丢弃的帧数写入该JSON文件")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(":", 1)
+    simulator = asyncio.run(
+        simulate((host, int(port)), args.loss, args.reorder, args.start_delay)
+    )
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "sent": simulator.sent,
+                    "dropped": simulator.dropped,
+                    "elapsed": simulator.elapsed,
+                },
+                f,
+                ensure_ascii=False,
+            )
@@ -1,12 +1,59 @@
 import asyncio
-from command import RecvCommand, RECV_START, RECV_END, DataNotReceived
+import socket
+import sys
+from command import Command, RecvCommand, RECV_START, RECV_END, DataNotReceived
 from config import REMOTE_ADDRESS
+from utils import log
+
+# Linux的套接字选项，socket模块中没有定义
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46)
+
+
+def receiver_socket(
+    localAddress: tuple[str, int], recvBuffer: int | None = None, busyPoll: int = 0
+) -> socket.socket:
+    """
+    创建并绑定接收数据的UDP套接字
+    recvBuffer超过net.core.rmem_max时先尝试SO_RCVBUFFORCE(需要CAP_NET_ADMIN)，
+    失败时退回SO_RCVBUF，实际大小以日志为准。busyPoll为SO_BUSY_POLL的忙轮询时长，单位: 微秒
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if recvBuffer is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, recvBuffer)
+        except OSError:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recvBuffer)
+        # Linux返回的大小包含内核的簿记开销，为设置值的两倍
+        actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if sys.platform.startswith("linux"):
+            actual //= 2
+        if actual < recvBuffer:
+            log.warning(
+                "接收缓冲区只有%s字节，小于配置的%s字节，"
+                "需要调大net.core.rmem_max或以CAP_NET_ADMIN权限运行",
+                actual,
+                recvBuffer,
+            )
+        else:
+            log.info("接收缓冲区大小: %s字节", actual)
+    if busyPoll and sys.platform.startswith("linux"):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, busyPoll)
+        except OSError as e:
+            log.warning("无法设置SO_BUSY_POLL: %s", e)
+    sock.bind(localAddress)
+    sock.setblocking(False)
+    return sock
 
 
 class ServerProtocol(asyncio.DatagramProtocol):
-    MAX_FRAME_SIZE = 5000
+    # 帧长随点数变化，至少能容纳一帧完整数据
+    MAX_FRAME_SIZE = max(5000, Command.MAX_BODY_LENGTH + 16)
 
-    def __init__(self):
+    def __init__(self, remoteAddress: tuple[str, int] = REMOTE_ADDRESS):
+        # 只接收该设备发来的数据
+        self.remoteAddress = remoteAddress
         self.enable = False
         self.dataCache = bytearray()
         self.cmdListener = []
@@ -29,7 +76,7 @@ class ServerProtocol(asyncio.DatagramProtocol):
             raise ValueError(f"Unknown event name {name}")
 
     def datagram_received(self, data, addr):
-        if addr != REMOTE_ADDRESS or not self.enable:
+        if addr != self.remoteAddress or not self.enable:
             return
         self.dataCache.extend(data)
         # 一次数据可能有多个命令
@@ -1,53 +1,136 @@
 import ctypes
 from datetime import datetime, timedelta
-from multiprocessing import RawArray, Queue
+from multiprocessing import Lock, RawArray, Queue
+import multiprocessing.queues
 import multiprocessing.synchronize
 import os
 from typing import TypedDict
 import queue
+import time
 import numpy as np
-from config import DAS_CONFIG, SAVE_CONFIG, SOUND_CONFIG, HANDLE_INTERVAL
-from utils import DataBuffer, log, butter_bandpass_filter
-import sounddevice as sd
+from config import (
+    CONSUMER_CONFIG,
+    DAS_CONFIG,
+    DEVICES,
+    HANDLE_INTERVAL,
+    LABEL_CONFIG,
+    MULTI_DEVICE,
+    PINGPONG_SIZE,
+    SAVE_CONFIG,
+    SOUND_CONFIG,
+)
+from utils import DataBuffer, log, lower_priority
+from block_ring import BlockCursors
+from sound_monitor import SoundMonitor
+from converter import PhysicalConverter
+from region import RegionEngine
+from fk_filter import FKFilter, FKOutput
+from label_writer import LabelWriter
+from metrics import MetricsRegistry, target_labels
+from profiling import Profiler, callback_timer, timed
+
+
+def in_save_range(saveTime: datetime, interval: float) -> bool:
+    """saveTime为结束时间，保存的文件冗余一定的时间，确保所需的数据都能保存到文件中"""
+    return (
+        SAVE_CONFIG["begin"] - timedelta(seconds=interval)
+        <= saveTime
+        <= SAVE_CONFIG["end"] + timedelta(seconds=interval)
+    )
 
 
 class DataHandler:
+    """
+    一个消费者的数据处理进程
+    saver保存数据和生成标注文件，analytics换算物理量、f-k滤波、区域检测并打开声音回调，物理量等输出只传给analytics。
+    处理完的数据块释放给接收进程，非required消费者落后时跳过数据块；
+    接收进程不等待非required消费者，数据块先复制到私有缓冲区，复制完成时仍未被覆盖才处理和发布结果
+    """
+
     class _BufferDict(TypedDict):
         buffer: ctypes.Array[ctypes.c_byte]
         offset: int
 
-    def __init__(self, pingpangBuffers: dict[str, list[DataBuffer]], taskQueue: Queue):
+    def __init__(
+        self,
+        consumer: str,
+        pingpangBuffers: dict[str, list[DataBuffer]],
+        taskQueue: Queue,
+        cursors: dict[str, BlockCursors],
+        physBuffers: dict[str, list[DataBuffer]],
+        metrics: MetricsRegistry,
+        device: str,
+        soundMonitor: SoundMonitor | None = None,
+        fkOutputs: dict[str, FKOutput] | None = None,
+        eventQueue: multiprocessing.queues.Queue | None = None,
+    ):
+        self._consumer = consumer
+        self._required = CONSUMER_CONFIG[consumer]["required"]
+        self._cursors = cursors
+        self._device = device
+        self._savePath = DEVICES[device]["savePath"]
         self._pingpangBuffers = pingpangBuffers
         self._taskQueue = taskQueue
+        self._physBuffers = physBuffers
+        self._converters = {name: PhysicalConverter(name) for name in physBuffers}
+        # 区域处理和f-k滤波会导入scipy，在analytics进程中启动时才创建
+        self.regionEngine: RegionEngine | None = None
+        self._fkOutputs = fkOutputs or {}
+        self._fkFilters: dict[str, FKFilter] = {}
+        # 每个数据源上一个处理的数据块序号，跳过数据块后流式状态不能延续
+        self._lastBlocks: dict[str, int] = {}
+        self._eventQueue = eventQueue
+        self._soundMonitor = soundMonitor
+        self._blocksConsumed = {
+            name: metrics.counter(
+                "das_blocks_consumed_total",
+                **target_labels(device, name),
+                consumer=consumer,
+            )
+            for name in pingpangBuffers
+        }
+        self._blocksSkipped = {
+            name: metrics.counter(
+                "das_blocks_skipped_total",
+                **target_labels(device, name),
+                consumer=consumer,
+            )
+            for name in pingpangBuffers
+        }
+        self._handoffLatency = {
+            name: metrics.histogram(
+                "das_block_handoff_seconds",
+                **target_labels(device, name),
+                consumer=consumer,
+            )
+            for name in pingpangBuffers
+        }
+        self._writeLatency = {
+            name: metrics.histogram(
+                "das_file_write_seconds", **target_labels(device, name)
+            )
+            for name in pingpangBuffers
+        }
+        self._saveTimer = callback_timer(metrics, "save_data", device)
+        self._audioTimer = callback_timer(metrics, "audio_callback", device)
 
-        if SAVE_CONFIG["enable"]:
-            self._saving = False
-            self._saveCache: dict[str, DataHandler._BufferDict] = {}
-            for name in SAVE_CONFIG["targets"]:
-                self._saveCache[name] = {
-                    "buffer": RawArray(
-                        ctypes.c_byte,
-                        DAS_CONFIG["targets"][name]["sampleRate"]
-                        * SAVE_CONFIG["targets"][name]["interval"]
-                        * len(DAS_CONFIG["validPointRange"])
-                        * DAS_CONFIG["dtype"].itemsize,
-                    ),
-                    "offset": 0,  # 缓存的偏移量"
-                }
-        if SOUND_CONFIG["enable"]:
-            self.stream = None
+        self._saving = False
+        self._labelWriter = (
+            LabelWriter(self._savePath)
+            if consumer == "saver"
+            and LABEL_CONFIG["enable"]
+            and LABEL_CONFIG["target"] in pingpangBuffers
+            else None
+        )
+        # 保存缓存在首次保存时分配
+        self._saveCache: dict[str, DataHandler._BufferDict] = {}
+        # 非required消费者的数据块副本，在首次复制时分配
+        self._snapshots: dict[str, DataBuffer] = {}
 
     def save_data(self, name: str, dataBuffer: DataBuffer, saveTime: datetime):
         if not name in SAVE_CONFIG["targets"]:
             return
-        # saveTime为结束时间，保存的文件冗余一定的时间，确保所需的数据都能保存到文件中
-        if not (
-            SAVE_CONFIG["begin"]
-            - timedelta(seconds=SAVE_CONFIG["targets"][name]["interval"])
-            <= saveTime
-            <= SAVE_CONFIG["end"]
-            + timedelta(seconds=SAVE_CONFIG["targets"][name]["interval"])
-        ):
+        if not in_save_range(saveTime, SAVE_CONFIG["targets"][name]["interval"]):
             if self._saving:
                 log.info("停止保存数据")
                 self._saving = False
@@ -55,69 +138,158 @@ class DataHandler:
         if not self._saving:
             self._saving = True
             log.info("开始保存数据")
+        if name not in self._saveCache:
+            self._saveCache[name] = {
+                "buffer": RawArray(
+                    ctypes.c_byte,
+                    DAS_CONFIG["targets"][name]["sampleRate"]
+                    * SAVE_CONFIG["targets"][name]["interval"]
+                    * len(DAS_CONFIG["validPointRange"])
+                    * DAS_CONFIG["dtype"].itemsize,
+                ),
+                "offset": 0,  # 缓存的偏移量"
+            }
         addr = (
             ctypes.addressof(self._saveCache[name]["buffer"])
             + self._saveCache[name]["offset"]
         )
-        with dataBuffer["lock"]:
-            ctypes.memmove(addr, dataBuffer["buffer"], len(dataBuffer["buffer"]))
+        ctypes.memmove(addr, dataBuffer["buffer"], len(dataBuffer["buffer"]))
         self._saveCache[name]["offset"] += len(dataBuffer["buffer"])
         # 还未满则先不保存
         if self._saveCache[name]["offset"] != len(self._saveCache[name]["buffer"]):
             return
         self._saveCache[name]["offset"] = 0
-        filePath = f"{SAVE_CONFIG['path']}/{SAVE_CONFIG['targets'][name]['prefix']}{saveTime.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3]}.dat"
+        filePath = f"{self._savePath}/{SAVE_CONFIG['targets'][name]['prefix']}{saveTime.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3]}.dat"
         if os.path.exists(filePath):
-            log.warning(f"文件 {filePath} 已存在，将被覆盖")
+            log.warning("文件 %s 已存在，将被覆盖", filePath)
             return
+        beginTime = time.perf_counter()
         with open(filePath, "wb") as f:
             os.write(f.fileno(), self._saveCache[name]["buffer"])
+        self._writeLatency[name].observe(time.perf_counter() - beginTime)
 
-    def play_sound(self, name: str, dataBuffer: DataBuffer):
-        if name != SOUND_CONFIG["target"]:
-            return
-        with dataBuffer["lock"]:
-            data = (
-                np.frombuffer(dataBuffer["buffer"], dtype=DAS_CONFIG["dtype"])
-                .reshape(-1, len(DAS_CONFIG["validPointRange"]))[
-                    :, SOUND_CONFIG["point"]
-                ]
-                .astype(np.float32)
+    def snapshot(self, name: str, dataBuffer: DataBuffer) -> DataBuffer:
+        """将环形缓冲区中的数据块复制到私有缓冲区"""
+        if name not in self._snapshots:
+            self._snapshots[name] = {
+                "buffer": RawArray(ctypes.c_byte, len(dataBuffer["buffer"])),
+                "lock": Lock(),
+            }
+        ctypes.memmove(
+            self._snapshots[name]["buffer"],
+            dataBuffer["buffer"],
+            len(dataBuffer["buffer"]),
+        )
+        return self._snapshots[name]
+
+    def process(
+        self,
+        name: str,
+        pingpong: int,
+        dataBuffer: DataBuffer,
+        recordTime: datetime,
+        continuous: bool,
+    ):
+        """
+        dataBuffer为第pingpong个位置上的数据块或其副本，
+        continuous为False时与上一个处理的数据块不相接，重置滤波器等流式状态
+        """
+        if not continuous:
+            if name in self._fkFilters:
+                self._fkFilters[name].reset()
+            if self.regionEngine is not None:
+                self.regionEngine.reset(name)
+        # 物理量换算每块只做一次，后续环节直接读取共享的float32缓冲区
+        if name in self._converters:
+            self._converters[name].convert_block(
+                dataBuffer, self._physBuffers[name][pingpong]
             )
+            if self.regionEngine is not None:
+                self.regionEngine.process(
+                    name, self._physBuffers[name][pingpong], recordTime
+                )
+        if name in self._fkFilters:
+            self.fk_filter(name, pingpong, recordTime)
+        # 文件保存设备的原始格式，不使用换算后的物理量
+        if self._consumer == "saver" and SAVE_CONFIG["enable"]:
+            self.save_data(name, dataBuffer, recordTime)
+        if self._labelWriter is not None and name == self._labelWriter.name:
+            # 与原始数据在相同的时间范围内生成标注文件
+            if in_save_range(recordTime, HANDLE_INTERVAL):
+                self._labelWriter.process(dataBuffer, recordTime, continuous)
+            else:
+                self._labelWriter.reset()
 
-        sampleRate = DAS_CONFIG["targets"][name]["sampleRate"]
-        data = butter_bandpass_filter(
-            data,
-            SOUND_CONFIG["lowcut"],
-            SOUND_CONFIG["highcut"],
-            sampleRate,
-            order=SOUND_CONFIG["order"],
-        )
-        assert data is np.ndarray
-        # 绝对值大于最大值的数据置零
-        data[np.abs(data) > SOUND_CONFIG["max"]] = 0
-        # 数据缩放到[-1, 1]之间
-        data = data / SOUND_CONFIG["max"]
-        if self.stream is None:
-            self.stream = sd.OutputStream(
-                samplerate=sampleRate,
-                channels=1,
-                dtype=np.float32,
-                blocksize=sampleRate * HANDLE_INTERVAL,
+    def fk_filter(self, name: str, pingpong: int, recordTime: datetime):
+        physBuffer = self._physBuffers[name][pingpong]
+        fkOutput = self._fkOutputs[name]
+        fkBuffer = fkOutput["buffers"][pingpong]
+        shape = (-1, len(DAS_CONFIG["validPointRange"]))
+        with physBuffer["lock"], fkBuffer["lock"]:
+            fkTime = self._fkFilters[name].process(
+                np.frombuffer(physBuffer["buffer"], dtype=np.float32).reshape(shape),
+                recordTime,
+                np.frombuffer(fkBuffer["buffer"], dtype=np.float32).reshape(shape),
             )
-            self.stream.start()
-        self.stream.write(data[: self.stream.write_available])
+        # 前两块没有输出，之后的输出对应上一个数据块的记录时间
+        if fkTime is None:
+            return
+        fkOutput["latest"].value = pingpong
+        if self.regionEngine is not None:
+            self.regionEngine.process(name, fkBuffer, fkTime, source="fk")
+
+    def forward_event(self, event: dict):
+        # 数据流服务未及时取走时丢弃事件，不阻塞数据处理
+        try:
+            self._eventQueue.put_nowait(event)  # type: ignore
+        except queue.Full:
+            pass
 
     def on_command(self, exit_event: multiprocessing.synchronize.Event):
+        profiler = Profiler(
+            f"{self._consumer}-{self._device}" if MULTI_DEVICE else self._consumer
+        )
+        if CONSUMER_CONFIG[self._consumer]["nice"]:
+            lower_priority(CONSUMER_CONFIG[self._consumer]["nice"])
+        self.save_data = timed(self.save_data, self._saveTimer)
+        if self._physBuffers:
+            self.regionEngine = RegionEngine(self._savePath)
+            if self._eventQueue is not None:
+                self.regionEngine.on("event", self.forward_event)
+        self._fkFilters = {name: FKFilter(name) for name in self._fkOutputs}
+        # 声音由接收进程逐帧送入环形缓冲区，这里只负责打开声卡回调
+        if SOUND_CONFIG["enable"] and self._soundMonitor is not None:
+            self._soundMonitor.start(self._audioTimer)
         while not exit_event.is_set():
+            profiler.poll()
             try:
-                (name, pingpong, recordTime) = self._taskQueue.get(timeout=1)
-                if SAVE_CONFIG["enable"]:
-                    self.save_data(
-                        name, self._pingpangBuffers[name][pingpong], recordTime
-                    )
-                if SOUND_CONFIG["enable"]:
-                    self.play_sound(name, self._pingpangBuffers[name][pingpong])
-
+                name, block, recordTime, continuous = self._taskQueue.get(timeout=1)
             except queue.Empty:
-                pass
+                continue
+            self._blocksConsumed[name].inc()
+            cursors = self._cursors[name]
+            # 处理期间接收进程至少还要写满一个数据块，来不及时直接跳过，尽快追上最新的数据块
+            if not self._required and not cursors.valid(block, 1):
+                self._blocksSkipped[name].inc()
+                continue
+            self._handoffLatency[name].observe(
+                (datetime.now() - recordTime).total_seconds()
+            )
+            pingpong = block % PINGPONG_SIZE
+            dataBuffer = self._pingpangBuffers[name][pingpong]
+            if not self._required:
+                dataBuffer = self.snapshot(name, dataBuffer)
+                # 复制期间接收进程开始覆盖该位置时副本可能不完整，不能换算和发布
+                if not cursors.valid(block):
+                    self._blocksSkipped[name].inc()
+                    log.warning("%s的%s数据块在复制期间被覆盖", self._consumer, name)
+                    continue
+            # 时钟补齐帧或本消费者跳过了数据块时，与上一个处理的数据块不相接
+            continuous = continuous and self._lastBlocks.get(name) == block - 1
+            self._lastBlocks[name] = block
+            self.process(name, pingpong, dataBuffer, recordTime, continuous)
+            cursors.release(self._consumer, block)
+        if self._soundMonitor is not None:
+            self._soundMonitor.stop()
+        if self._labelWriter is not None:
+            self._labelWriter.reset()
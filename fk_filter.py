@@ -0,0 +1,175 @@
+import ctypes
+from datetime import datetime
+from typing import TypedDict
+import numpy as np
+from config import DAS_CONFIG, FK_CONFIG, HANDLE_INTERVAL
+from utils import DataBuffer
+
+
+class FKOutput(TypedDict):
+    # 与原始数据块一一对应的f-k滤波结果缓冲区(float32)
+    buffers: list[DataBuffer]
+    # 最近一次写入结果的缓冲区下标，尚无结果时为-1
+    latest: ctypes.c_int
+
+
+def _smooth_step(x: np.ndarray) -> np.ndarray:
+    return 0.5 - 0.5 * np.cos(np.pi * np.clip(x, 0, 1))
+
+
+def fk_mask(
+    frameLength: int,
+    points: int,
+    sampleRate: float,
+    pointSpacing: float,
+    velocity: tuple[float, float],
+    mode: str,
+    taper: float,
+) -> np.ndarray:
+    """
+    按视速度构造f-k域扇形掩码，形状为(frameLength // 2 + 1, points)
+    视速度 v = |f| / |k|，reject模式去除velocity范围内的分量，pass模式只保留该范围
+    """
+    import scipy.fft
+
+    f = scipy.fft.rfftfreq(frameLength, 1 / sampleRate)[:, None]
+    k = np.abs(scipy.fft.fftfreq(points, pointSpacing))[None, :]
+    with np.errstate(divide="ignore"):
+        v = np.where(k > 0, f / np.where(k > 0, k, 1), np.inf)
+    vmin, vmax = velocity
+    if taper > 0:
+        # 边界处使用余弦过渡，减少振铃
+        inside = _smooth_step((v - vmin * (1 - taper)) / (2 * taper * vmin))
+        inside *= _smooth_step((vmax * (1 + taper) - v) / (2 * taper * vmax))
+    else:
+        inside = ((vmin <= v) & (v <= vmax)).astype(np.float64)
+    mask = inside if mode == "pass" else 1 - inside
+    return mask.astype(np.float32)
+
+
+class FKFilter:
+    """
+    f-k二维滤波
+    每次将上一块与当前块拼接为两块长的帧，加周期汉宁窗后做rfft2，乘以缓存的掩码再逆变换，
+    以半帧步长重叠相加输出，因此输出是连续的，但比输入滞后一个数据块。
+    第一个数据块只经过汉宁窗上升沿的加权，重叠相加不完整，因此不输出；
+    输入的数据块不相接时调用reset，重新开始预热，不将不相邻的数据块拼接为一帧
+    """
+
+    def __init__(self, name: str, blockLength: int | None = None):
+        params = FK_CONFIG["targets"][name]
+        self.name = name
+        self.sampleRate = DAS_CONFIG["targets"][name]["sampleRate"]
+        self.points = len(DAS_CONFIG["validPointRange"])
+        self.blockLength = blockLength or int(self.sampleRate * HANDLE_INTERVAL)
+        self.frameLength = self.blockLength * 2
+        self.mask = fk_mask(
+            self.frameLength,
+            self.points,
+            self.sampleRate,
+            FK_CONFIG["pointSpacing"],
+            params["velocity"],
+            params["mode"],
+            params["taper"],
+        )
+        # 周期汉宁窗在50%重叠下相加恒为1
+        self.window = (
+            0.5
+            - 0.5 * np.cos(2 * np.pi * np.arange(self.frameLength) / self.frameLength)
+        ).astype(np.float32)[:, None]
+        self._frame = np.zeros((self.frameLength, self.points), dtype=np.float32)
+        self._work = np.empty_like(self._frame)
+        self._tail = np.zeros((self.blockLength, self.points), dtype=np.float32)
+        # 开始输出前还需输入的数据块数
+        self._warmup = 2
+        self._lastTime: datetime | None = None
+
+    def reset(self):
+        """丢弃上一块和重叠相加的尾部，下一块重新开始预热"""
+        self._tail[:] = 0
+        self._warmup = 2
+        self._lastTime = None
+
+    def process(
+        self, block: np.ndarray, recordTime: datetime, out: np.ndarray
+    ) -> datetime | None:
+        """
+        输入一块(blockLength, points)的数据，将上一块的滤波结果写入out
+        返回写入数据对应的记录时间，前两块没有输出时返回None
+        """
+        import scipy.fft
+
+        frame = self._frame
+        # 前半帧为上一块，后半帧为当前块
+        frame[: self.blockLength] = frame[self.blockLength :]
+        frame[self.blockLength :] = block
+        lastTime = self._lastTime
+        self._lastTime = recordTime
+        if self._warmup == 2:
+            self._warmup -= 1
+            return None
+
+        np.multiply(frame, self.window, out=self._work)
+        spectrum = scipy.fft.rfft2(
+            self._work, axes=(1, 0), overwrite_x=True, workers=-1
+        )
+        spectrum *= self.mask
+        filtered = scipy.fft.irfft2(
+            spectrum,
+            s=(self.points, self.frameLength),
+            axes=(1, 0),
+            overwrite_x=True,
+            workers=-1,
+        )
+        if self._warmup:
+            # 首块只有窗口的上升沿部分，丢弃，只保留重叠相加所需的后半帧
+            self._warmup -= 1
+            self._tail[:] = filtered[self.blockLength :]
+            return None
+        np.add(self._tail, filtered[: self.blockLength], out=out)
+        self._tail[:] = filtered[self.blockLength :]
+        return lastTime
+
+
+def benchmark(repeat: int = 5):
+    import time
+    import tracemalloc
+
+    name = next(iter(FK_CONFIG["targets"]))
+    blockLength = 5000
+    points = 1999
+    fkFilter = FKFilter(name, blockLength)
+    if fkFilter.points != points:
+        print(f"注意: 当前有效点位数为{fkFilter.points}，而非{points}")
+    rng = np.random.default_rng(0)
+    block = rng.standard_normal((blockLength, fkFilter.points), dtype=np.float32)
+    out = np.empty_like(block)
+    for _ in range(2):
+        fkFilter.process(block, datetime.now(), out)
+
+    tracemalloc.start()
+    costs = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        fkFilter.process(block, datetime.now(), out)
+        costs.append(time.perf_counter() - begin)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    resident = (
+        fkFilter._frame.nbytes
+        + fkFilter._work.nbytes
+        + fkFilter._tail.nbytes
+        + fkFilter.mask.nbytes
+        + fkFilter.window.nbytes
+    )
+    print(f"数据块: {blockLength} x {fkFilter.points}")
+    print(
+        f"单块耗时: 平均 {np.mean(costs)*1000:.1f}ms, 最大 {np.max(costs)*1000:.1f}ms"
+    )
+    print(f"常驻内存: {resident / 2**20:.1f}MB")
+    print(f"单块处理峰值临时内存: {peak / 2**20:.1f}MB")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,105 @@
+from collections import deque
+from datetime import datetime
+import math
+import time
+import numpy as np
+from config import DAS_CONFIG, FRAME_CLOCK, FRAME_COUNTER
+from utils import log
+
+
+class FrameClock:
+    """
+    由帧序号推算时间的DAS时钟
+    第n帧的时间为 a + n·T，T和a由最近若干数据块拟合，网络和调度延迟只会让帧晚到，因此:
+    - 逐帧只记录到达时间相对当前模型的最小偏差，每个数据块得到一个延迟最小的包络点
+    - T取包络点两两斜率的中位数(Theil-Sen)，并限制在名义周期的maxDrift范围内，a取残差的中位数
+    - 连续两个数据块的最小偏差都超过lossThreshold个周期且方向相同时说明之前有丢帧，帧序号按偏差补齐；
+      只有一个数据块偏离时是整块延迟(如接收进程暂停)，不改变帧序号
+    - 没有补齐帧序号时，数据块紧接上一个数据块的结束时间，模型向后的变化不到lossThreshold个周期时不留间隙；
+      补齐帧序号或模型偏离过大时重新按模型对齐，但不早于上一个数据块的结束时间，数据块之间不会重叠
+    时间在单调时钟上拟合，换算到系统时间的偏移量按数据块平滑，不受系统时钟分辨率和校时跳变的影响
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._nominalPeriod = 1 / DAS_CONFIG["targets"][name]["sampleRate"]
+        self.period = self._nominalPeriod
+        self._intercept: float | None = None
+        # 下一帧的序号，包含补齐的丢帧
+        self._index = 0
+        self._minOffset = math.inf
+        self._minIndex = 0
+        # 上一个数据块偏离的周期数，下一个数据块同向偏离时才补齐
+        self._pendingShift = 0
+        self._lastEnd: float | None = None
+        # 最近一个数据块是否紧接上一个数据块，不连续时下游需要丢弃跨越该数据块的结果
+        self.continuous = False
+        self._points: deque[tuple[int, float]] = deque(maxlen=FRAME_CLOCK["window"])
+        self._wallOffset: float | None = None
+        self._wallResolution = time.get_clock_info("time").resolution
+        # 最近一个数据块包络点相对模型的偏差，单位: 秒
+        self.residual = 0.0
+
+    def tick(self):
+        """每收到一帧调用一次"""
+        offset = time.perf_counter() - self._index * self.period
+        if offset < self._minOffset:
+            self._minOffset = offset
+            self._minIndex = self._index
+        self._index += 1
+
+    def block_start(self, frames: int) -> datetime:
+        """一个数据块的最后一帧到达后调用，返回该块第一帧的时间，同时更新模型"""
+        pointTime = self._minOffset + self._minIndex * self.period
+        shift = 0
+        if self._intercept is not None:
+            self.residual = self._minOffset - self._intercept
+            candidate = 0
+            if abs(self.residual) >= FRAME_CLOCK["lossThreshold"] * self.period:
+                candidate = round(self.residual / self.period)
+            if candidate * self._pendingShift > 0:
+                shift = candidate
+                self._index += shift
+                self.residual -= shift * self.period
+                # 上一个数据块的包络点同样偏离了这些帧
+                lastIndex, lastTime = self._points[-1]
+                self._points[-1] = (lastIndex + shift, lastTime)
+                self._pendingShift = 0
+                log.info("%s时钟补齐%d帧", self.name, shift)
+            else:
+                self._pendingShift = candidate
+        firstIndex = self._index - frames
+        self._points.append((self._minIndex + shift, pointTime))
+        self._minOffset = math.inf
+        self._fit()
+
+        # 系统时间相对单调时钟的偏移量，系统时钟按分辨率截断(Windows下约15.6ms)，平均偏早半个分辨率
+        wallOffset = time.time() + self._wallResolution / 2 - time.perf_counter()
+        if self._wallOffset is None:
+            self._wallOffset = wallOffset
+        else:
+            self._wallOffset += (wallOffset - self._wallOffset) / FRAME_CLOCK["window"]
+        assert self._intercept is not None
+        start = self._wallOffset + self._intercept + firstIndex * self.period
+        self.continuous = (
+            self._lastEnd is not None
+            and shift == 0
+            and start - self._lastEnd < FRAME_CLOCK["lossThreshold"] * self.period
+        )
+        if self._lastEnd is not None:
+            start = self._lastEnd if self.continuous else max(start, self._lastEnd)
+        self._lastEnd = start + frames * self.period
+        return datetime.fromtimestamp(start)
+
+    def _fit(self):
+        indexes = np.array([point[0] for point in self._points], dtype=np.float64)
+        times = np.array([point[1] for point in self._points])
+        if len(self._points) >= FRAME_CLOCK["minPoints"]:
+            i, j = np.triu_indices(len(indexes), 1)
+            slopes = (times[j] - times[i]) / (indexes[j] - indexes[i])
+            maxDrift = FRAME_COUNTER["maxDrift"]
+            self.period = min(
+                max(float(np.median(slopes)), self._nominalPeriod * (1 - maxDrift)),
+                self._nominalPeriod * (1 + maxDrift),
+            )
+        self._intercept = float(np.median(times - indexes * self.period))
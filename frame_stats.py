@@ -0,0 +1,187 @@
+from collections import deque
+from datetime import datetime
+import json
+import math
+import time
+from typing import Any
+import numpy as np
+from command import RecvCommand
+from config import DAS_CONFIG, FRAME_COUNTER, MULTI_DEVICE
+from metrics import MetricsRegistry, target_labels
+from utils import log
+
+
+def fit_rate(times: np.ndarray, rate: float, chunk: int) -> float | None:
+    """
+    由到达时间拟合DAS时钟速率，rate为当前的估计值，时间过短时返回None
+    到达时间按接收顺序减去估计的时钟后，每chunk帧取最早到达的一帧作为下包络。丢帧使之后的下包络整体推迟一个周期，
+    到达延迟(如接收进程暂停)只使下包络暂时升高，时钟误差则在每个chunk内只累积很小的偏差。
+    因此相邻下包络之差按周期取整即为期间丢失(或暂停后追上)的帧数，补齐帧序号后线性拟合得到的速率不受丢帧影响
+    """
+    n = len(times) // chunk * chunk
+    if n < 2 * chunk:
+        return None
+    period = 1 / rate
+    residual = times[:n] - times[0] - np.arange(n) * period
+    positions = residual.reshape(-1, chunk).argmin(axis=1) + np.arange(0, n, chunk)
+    steps = np.rint(np.diff(residual[positions]) / period)
+    indexes = positions + np.concatenate(([0], np.cumsum(steps)))
+    slope = np.polyfit(indexes, times[positions] - times[0], 1)[0]
+    return 1 / slope if slope > 0 else None
+
+
+class FrameStatistics:
+    """
+    每个数据源的帧到达统计
+    逐帧只把单调时钟的到达时间写入预分配的数组，每个统计间隔结束时再用numpy一次性计算:
+    - 实际接收速率和估计的DAS时钟速率
+    - 到达间隔相对帧周期的抖动分位数
+    - 以帧周期为单位的到达间隔直方图，用于观察突发和断流
+    - 按估计的时钟速率计算的丢帧数，不再把DAS时钟误差计入丢帧
+    时钟速率不由接收速率得到，否则持续的少量丢帧会被当作时钟误差，见fit_rate
+    """
+
+    def __init__(self, metrics: MetricsRegistry, device: str):
+        self._device = device
+        self._interval = FRAME_COUNTER["interval"]
+        self._targets = {}
+        for name, params in DAS_CONFIG["targets"].items():
+            labels = target_labels(device, name)
+            self._targets[name] = {
+                "times": np.empty(
+                    math.ceil(
+                        params["sampleRate"]
+                        * self._interval
+                        * FRAME_COUNTER["capacityFactor"]
+                    ),
+                    dtype=np.float64,
+                ),
+                "count": 0,
+                # 数组写满后只计数不记录时间
+                "overflow": 0,
+                "reported": 0,
+                "lastTime": None,
+                "rates": deque(maxlen=FRAME_COUNTER["historySize"]),
+                "totalFrames": 0,
+                "totalLost": 0,
+                "received": metrics.counter("das_frames_received_total", **labels),
+                "lost": metrics.counter("das_frames_lost_total", **labels),
+                "rate": metrics.gauge("das_frame_rate_hz", **labels),
+                "jitter": metrics.gauge("das_frame_jitter_p99_seconds", **labels),
+            }
+        self._beginTime = time.monotonic()
+
+    def on_command(self, cmd: RecvCommand):
+        target = self._targets.get(cmd.name)
+        if target is None:
+            return
+        count = target["count"]
+        if count < len(target["times"]):
+            target["times"][count] = time.monotonic()
+            target["count"] = count + 1
+        else:
+            target["overflow"] += 1
+
+    def update(self):
+        """由接收进程每秒调用，统计间隔结束时输出结构化记录"""
+        rates = {}
+        for name, target in self._targets.items():
+            frames = target["count"] + target["overflow"]
+            rates[name] = frames - target["reported"]
+            target["received"].inc(rates[name])
+            target["reported"] = frames
+        # 滚动显示的实时帧率，格式化在日志线程中进行
+        log.debug("实时帧率: %s", rates)
+        if time.monotonic() - self._beginTime < self._interval:
+            return
+        self._beginTime = time.monotonic()
+        for name in self._targets:
+            record = self.compute(name)
+            if record is not None:
+                log.info("帧统计: %s", json.dumps(record, ensure_ascii=False))
+
+    def compute(self, name: str) -> dict[str, Any] | None:
+        """计算并清空一个数据源在本间隔内的统计，从未收到数据时返回None"""
+        target = self._targets[name]
+        count = target["count"]
+        overflow = target["overflow"]
+        if count == 0 and target["lastTime"] is None:
+            return None
+        record: dict[str, Any] = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "target": name,
+            "frames": count + overflow,
+        }
+        if MULTI_DEVICE:
+            record["device"] = self._device
+        times = target["times"][:count]
+        if target["lastTime"] is not None:
+            times = np.concatenate(([target["lastTime"]], times))
+        target["count"] = 0
+        target["overflow"] = 0
+        target["reported"] = 0
+        # 本间隔没有新数据时不计算，下个间隔从上次的最后一帧开始统计
+        if len(times) < 2:
+            return record
+        target["lastTime"] = times[-1]
+
+        nominalRate = DAS_CONFIG["targets"][name]["sampleRate"]
+        diffs = np.diff(times)
+        duration = times[-1] - times[0]
+        # 有到达时间的帧数(首帧属于上个间隔)，数组写满后的帧不在duration内，不参与速率和丢帧计算
+        frames = len(diffs)
+        rate = frames / duration if duration > 0 else nominalRate
+        # 写满后的帧到达时间未知，下个间隔重新开始，否则跨越这些帧的间隔会被当作丢帧
+        if overflow:
+            target["lastTime"] = None
+        previousRate = (
+            float(np.median(target["rates"])) if target["rates"] else nominalRate
+        )
+        fittedRate = fit_rate(times, previousRate, FRAME_COUNTER["envelopeFrames"])
+        if fittedRate is not None:
+            target["rates"].append(fittedRate)
+        if len(target["rates"]) >= FRAME_COUNTER["minHistory"]:
+            deviceRate = float(np.median(target["rates"]))
+        else:
+            deviceRate = nominalRate
+        maxDrift = FRAME_COUNTER["maxDrift"]
+        deviceRate = min(
+            max(deviceRate, nominalRate * (1 - maxDrift)), nominalRate * (1 + maxDrift)
+        )
+        period = 1 / deviceRate
+        lost = max(round(duration * deviceRate) - frames, 0)
+        nominalLost = max(round(duration * nominalRate) - frames, 0)
+        target["totalFrames"] += frames + overflow
+        target["totalLost"] += lost
+
+        jitter = np.percentile(diffs - period, FRAME_COUNTER["percentiles"])
+        gapBins = FRAME_COUNTER["gapBins"]
+        gapCounts, _ = np.histogram(diffs / period, bins=[*gapBins, np.inf])
+        gapLabels = [f"{low}~{high}" for low, high in zip(gapBins, gapBins[1:])]
+        gapLabels.append(f">{gapBins[-1]}")
+
+        record.update(
+            {
+                "duration": round(duration, 6),
+                "rate": round(rate, 6),
+                "deviceRate": round(deviceRate, 6),
+                "driftPpm": round((deviceRate / nominalRate - 1) * 1e6, 3),
+                "lost": lost,
+                "lossRate": lost / (frames + lost),
+                "nominalLost": nominalLost,
+                "totalFrames": target["totalFrames"],
+                "totalLost": target["totalLost"],
+                "totalLossRate": target["totalLost"]
+                / (target["totalFrames"] + target["totalLost"]),
+                "jitterMs": {
+                    f"p{p:g}": round(v * 1000, 4)
+                    for p, v in zip(FRAME_COUNTER["percentiles"], jitter)
+                },
+                "gaps": dict(zip(gapLabels, gapCounts.tolist())),
+                "overflow": overflow,
+            }
+        )
+        target["lost"].inc(lost)
+        target["rate"].set(deviceRate)
+        target["jitter"].set(float(jitter[FRAME_COUNTER["percentiles"].index(99)]))
+        return record
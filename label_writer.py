@@ -0,0 +1,89 @@
+from datetime import datetime
+import os
+from typing import BinaryIO, TypedDict
+import numpy as np
+from config import DAS_CONFIG, HANDLE_INTERVAL, LABEL_CONFIG
+from transform_file import rms_downsample, timestamp_to_label_format
+from utils import DataBuffer, log
+
+
+class LabelWriter:
+    """
+    在线生成标注文件
+    每个数据块降采样一次，追加到所有未完成的标注文件中，写入量均匀分布在每个处理间隔内。
+    标注文件写满后由临时文件改名为 开始时间_结束时间_点位数.dat，数据块不连续时丢弃未完成的标注文件
+    """
+
+    class _Window(TypedDict):
+        path: str  # 临时文件路径
+        file: BinaryIO
+        blocks: int  # 已写入的数据块数
+
+    def __init__(self, savePath: str):
+        self.name = LABEL_CONFIG["target"]
+        self._path = os.path.join(savePath, "label")
+        os.makedirs(self._path, exist_ok=True)
+        self._points = len(DAS_CONFIG["validPointRange"])
+        self._blocks = int(LABEL_CONFIG["interval"] / HANDLE_INTERVAL)
+        self._step = self._blocks - int(
+            LABEL_CONFIG["overlap"] * LABEL_CONFIG["interval"] / HANDLE_INTERVAL
+        )
+        # 未完成的标注文件，按开始时间排列
+        self._windows: list[LabelWriter._Window] = []
+        # 连续数据块的序号，决定何时开始新的标注文件
+        self._index = 0
+        self._lastTime: datetime | None = None
+
+    def process(self, dataBuffer: DataBuffer, recordTime: datetime, continuous: bool):
+        """recordTime为数据块的结束时间，continuous为数据块是否紧接上一个数据块(帧序号未补齐)"""
+        if self._lastTime is not None and not continuous:
+            log.warning(
+                "%s数据块不连续(%s -> %s)，丢弃未完成的标注文件",
+                self.name,
+                self._lastTime,
+                recordTime,
+            )
+            self.reset()
+        self._lastTime = recordTime
+
+        if self._index % self._step == 0:
+            tmpPath = os.path.join(self._path, f".{self._index}.tmp")
+            self._windows.append(
+                {"path": tmpPath, "file": open(tmpPath, "wb"), "blocks": 0}
+            )
+        self._index += 1
+        data = rms_downsample(
+            np.frombuffer(dataBuffer["buffer"], dtype=DAS_CONFIG["dtype"]).reshape(
+                -1, self._points
+            ),
+            LABEL_CONFIG["downsample"],
+        )
+        for window in self._windows:
+            window["file"].write(data)
+            window["blocks"] += 1
+        while self._windows and self._windows[0]["blocks"] == self._blocks:
+            window = self._windows.pop(0)
+            window["file"].close()
+            # 与原始数据文件名相同，结束时间截断到毫秒
+            endTimestamp = (
+                int(recordTime.replace(microsecond=0).timestamp()) * 1000
+                + recordTime.microsecond // 1000
+            )
+            os.replace(
+                window["path"],
+                os.path.join(
+                    self._path,
+                    timestamp_to_label_format(
+                        endTimestamp, self._points, LABEL_CONFIG["interval"]
+                    ),
+                ),
+            )
+
+    def reset(self):
+        """丢弃未完成的标注文件，下一个数据块开始新的标注文件"""
+        for window in self._windows:
+            window["file"].close()
+            os.remove(window["path"])
+        self._windows = []
+        self._index = 0
+        self._lastTime = None
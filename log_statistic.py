@@ -1,83 +1,366 @@
+import argparse
+from datetime import datetime
+import glob
+import json
+import math
+import os
 import re
+from typing import Iterator, NamedTuple
 import numpy as np
-import matplotlib.pyplot as plt
-import os
-from config import LOG_CONFIG
+from config import DAS_CONFIG, FRAME_COUNTER, LOG_CONFIG, METRICS_CONFIG
 
-# 中文支持
-plt.rcParams["font.sans-serif"] = ["SimHei"]
+# 直方图精度与范围，单位: %
+PRECISION = 0.001
+HIST_MAX = 0.1
+# 时间序列最多保留的点数，超出后相邻两点合并
+MAX_POINTS = 2000
+# 旧版本只统计该数据源，日志中没有数据源名称
+LEGACY_TARGET = "振动解调数据"
 
-PRECISION = 0.0001
+RECORD_PREFIX = " - INFO - 帧统计: "
+LEGACY_PATTERN = re.compile(
+    r" - INFO - 丢帧数: (?P<lost>-?\d+), 丢帧率: (?P<rate>[\d\.]+)%, 全局丢帧数: -?\d+, 全局丢帧率: [\d\.]+%"
+)
 
-with open(os.path.join(LOG_CONFIG["path"], "das.log"), "r", encoding="utf-8") as f:
-    log = f.read()
 
-pattern = re.compile(
-    r"\d{4}-\d{2}-\d{2} (?P<time>\d{2}:\d{2}:\d{2}) - INFO - 丢帧数: -?\d+, 丢帧率: (?P<drop_rate>[\d\.]+)%, 全局丢帧率: (?P<global_drop_rate>[\d\.]+)%"
-)
+def _report_skipped(filePath: str, skipped: int):
+    # 进程仍在写入或异常退出时最后一行可能不完整
+    if skipped:
+        print(f"{filePath}: 跳过{skipped}行无法解析的记录")
 
-matches = pattern.findall(log)
 
-time_stamps = [match[0] for match in matches]
-frame_drop_rates = np.array([float(match[1]) for match in matches])
-global_frame_drop_rates = np.array([float(match[2]) for match in matches])
+class LossRecord(NamedTuple):
+    time: datetime
+    lost: int
+    # 本间隔内理论帧数(接收帧数 + 丢帧数)
+    expected: int
 
 
-# 绘制短时丢帧率变化
-avg_frame_drop_rate = np.mean(frame_drop_rates)
-mid_frame_drop_rate = np.median(frame_drop_rates)
-max_frame_drop_rate = np.max(frame_drop_rates)
+def log_files(path: str) -> list[str]:
+    """按时间顺序返回当前日志及TimedRotatingFileHandler轮转出的备份(das.log.YYYY-MM-DD)"""
+    current = os.path.join(path, "das.log")
+    backups = sorted(glob.glob(glob.escape(current) + ".*"))
+    return backups + ([current] if os.path.exists(current) else [])
 
-max_rate = max_frame_drop_rate / 0.8
 
-plt.plot(frame_drop_rates, label="frame drop rate")
-plt.axhline(
-    avg_frame_drop_rate,  # type: ignore
-    color="r",
-    linestyle="--",
-    label=f"均值 = {avg_frame_drop_rate:.4f}%",
-)
-plt.axhline(
-    mid_frame_drop_rate,  # type: ignore
-    color="g",
-    linestyle="--",
-    label=f"中位数 = {mid_frame_drop_rate:.4f}%",
-)
-plt.axhline(
-    max_frame_drop_rate,
-    color="b",
-    linestyle="--",
-    label=f"最大值 = {max_frame_drop_rate:.4f}%",
-)
-plt.legend()
-plt.title("丢帧率变化")
-# 修改y坐标刻度标签
-yticks = np.arange(0, max_rate, 0.01)
-plt.yticks(yticks, [f"{i:.2f}%" for i in yticks])
-# 修改x坐标刻度标签
-xticks = np.arange(0, len(frame_drop_rates), 20)
-plt.xticks(xticks, [time_stamps[i] for i in xticks])
-plt.show()
-
-# 绘制全局丢帧率变化
-max_global_frame_drop_rate = np.max(global_frame_drop_rates)
-max_rate = max_global_frame_drop_rate / 0.8
-
-plt.plot(global_frame_drop_rates, label="global frame drop rate")
-plt.title("全局丢帧率变化")
-# 修改y坐标刻度标签
-yticks = np.arange(0, max_rate, 0.002)
-plt.yticks(yticks, [f"{i:.3f}%" for i in yticks])
-# 修改x坐标刻度标签
-xticks = np.arange(0, len(global_frame_drop_rates), 20)
-plt.xticks(xticks, [time_stamps[i] for i in xticks])
-plt.show()
-
-
-# 绘制分布直方图
-plt.hist(frame_drop_rates, bins=int((max_rate) / PRECISION / 10))
-plt.title("丢帧率分布直方图")
-# 修改x坐标刻度标签
-xticks = np.arange(0, max_rate + 0.02, 0.01)
-plt.xticks(xticks, [f"{i:.2f}%" for i in xticks])
-plt.show()
+def _file_date(filePath: str) -> datetime | None:
+    try:
+        return datetime.strptime(filePath.rsplit(".", 1)[-1], "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def read_logs(
+    path: str, target: str, begin: datetime | None, end: datetime | None
+) -> Iterator[LossRecord]:
+    """逐行读取日志中的帧统计记录，兼容旧版本的丢帧日志"""
+    legacyExpected = (
+        FRAME_COUNTER["interval"] * DAS_CONFIG["targets"][LEGACY_TARGET]["sampleRate"]
+    )
+    for filePath in log_files(path):
+        fileDate = _file_date(filePath)
+        if fileDate is not None:
+            # 备份文件只包含后缀当天的日志
+            if begin is not None and fileDate.date() < begin.date():
+                continue
+            if end is not None and fileDate.date() > end.date():
+                continue
+        skipped = 0
+        with open(filePath, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                index = line.find(RECORD_PREFIX)
+                if index != -1:
+                    try:
+                        record = json.loads(line[index + len(RECORD_PREFIX) :])
+                    except json.JSONDecodeError:
+                        skipped += 1
+                        continue
+                    if record["target"] != target or "lost" not in record:
+                        continue
+                    lost = record["lost"]
+                    expected = record["frames"] + lost
+                else:
+                    if target != LEGACY_TARGET:
+                        continue
+                    match = LEGACY_PATTERN.search(line)
+                    if match is None:
+                        continue
+                    lost = max(int(match["lost"]), 0)
+                    rate = float(match["rate"]) / 100
+                    expected = round(lost / rate) if rate > 0 else legacyExpected
+                recordTime = datetime.fromisoformat(line[:19])
+                if begin is not None and recordTime < begin:
+                    continue
+                if end is not None and recordTime > end:
+                    break
+                yield LossRecord(recordTime, lost, expected)
+        _report_skipped(filePath, skipped)
+
+
+def read_metrics(
+    filePath: str, target: str, begin: datetime | None, end: datetime | None
+) -> Iterator[LossRecord]:
+    """逐行读取指标快照，由相邻快照的计数器之差得到每个间隔的丢帧，多台设备时汇总所有设备"""
+    label = f'target="{target}"'
+    lastReceived = lastLost = None
+    skipped = 0
+    with open(filePath, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                snapshot = json.loads(line)
+            except json.JSONDecodeError:
+                skipped += 1
+                continue
+            received = lost = 0
+            found = False
+            for key, value in snapshot.items():
+                if label not in key:
+                    continue
+                if key.startswith("das_frames_received_total{"):
+                    received += value
+                    found = True
+                elif key.startswith("das_frames_lost_total{"):
+                    lost += value
+            if not found:
+                continue
+            # 计数器变小说明程序重启过，从0开始计算差值
+            if lastReceived is None or received < lastReceived or lost < lastLost:
+                deltaReceived, deltaLost = received, lost
+            else:
+                deltaReceived, deltaLost = received - lastReceived, lost - lastLost
+            lastReceived, lastLost = received, lost
+            recordTime = datetime.fromisoformat(snapshot["time"])
+            if begin is not None and recordTime < begin:
+                continue
+            if end is not None and recordTime > end:
+                break
+            if deltaReceived + deltaLost == 0:
+                continue
+            yield LossRecord(recordTime, int(deltaLost), int(deltaReceived + deltaLost))
+    _report_skipped(filePath, skipped)
+
+
+class TimeSeriesAggregator:
+    """
+    固定点数的时间序列聚合
+    按时间分桶累计丢帧率的总和、次数和最大值，桶用完时相邻两桶合并、桶宽加倍，内存与数据量无关
+    """
+
+    def __init__(
+        self, size: int = MAX_POINTS, width: float = FRAME_COUNTER["interval"]
+    ):
+        assert size % 2 == 0, f"{size}不是偶数"
+        self._size = size
+        self._width = width
+        self._origin: float | None = None
+        self._sums = np.zeros(size)
+        self._counts = np.zeros(size, dtype=np.int64)
+        self._maxs = np.zeros(size)
+        # 桶内最后一条记录的全局丢帧率
+        self._globals = np.zeros(size)
+
+    def _compact(self):
+        counts = self._counts.reshape(-1, 2)
+        globals = self._globals.reshape(-1, 2)
+        half = self._size // 2
+        self._globals[:half] = np.where(counts[:, 1] > 0, globals[:, 1], globals[:, 0])
+        self._sums[:half] = self._sums.reshape(-1, 2).sum(axis=1)
+        self._maxs[:half] = self._maxs.reshape(-1, 2).max(axis=1)
+        self._counts[:half] = counts.sum(axis=1)
+        for array in (self._sums, self._counts, self._maxs, self._globals):
+            array[half:] = 0
+        self._width *= 2
+
+    def _rebase(self, timestamp: float):
+        """早于起点的记录(如系统时间回调)把起点前移整数个桶，已有的桶整体后移，放不下时先合并"""
+        assert self._origin is not None
+        used = int(np.flatnonzero(self._counts)[-1]) + 1 if self._counts.any() else 0
+        shift = math.ceil((self._origin - timestamp) / self._width)
+        while used + shift > self._size:
+            self._compact()
+            used = (used + 1) // 2
+            shift = math.ceil((self._origin - timestamp) / self._width)
+        for array in (self._sums, self._counts, self._maxs, self._globals):
+            array[shift:] = array[:-shift].copy()
+            array[:shift] = 0
+        self._origin -= shift * self._width
+
+    def add(self, time: datetime, value: float, globalValue: float):
+        timestamp = time.timestamp()
+        if self._origin is None:
+            self._origin = timestamp
+        elif timestamp < self._origin:
+            self._rebase(timestamp)
+        index = int((timestamp - self._origin) // self._width)
+        while index >= self._size:
+            self._compact()
+            index = int((timestamp - self._origin) // self._width)
+        self._sums[index] += value
+        self._counts[index] += 1
+        self._maxs[index] = max(self._maxs[index], value)
+        self._globals[index] = globalValue
+
+    def series(self) -> tuple[list[datetime], np.ndarray, np.ndarray, np.ndarray]:
+        """返回非空桶的(中心时间, 平均值, 最大值, 全局丢帧率)"""
+        if self._origin is None:
+            return [], np.empty(0), np.empty(0), np.empty(0)
+        valid = np.flatnonzero(self._counts)
+        times = [
+            datetime.fromtimestamp(self._origin + (i + 0.5) * self._width)
+            for i in valid
+        ]
+        return (
+            times,
+            self._sums[valid] / self._counts[valid],
+            self._maxs[valid],
+            self._globals[valid],
+        )
+
+
+class LossStatistics:
+    """流式汇总丢帧记录，只保存固定大小的直方图和时间序列"""
+
+    def __init__(self):
+        self.lost = 0
+        self.expected = 0
+        self.records = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.begin: datetime | None = None
+        self.end: datetime | None = None
+        self.edges = np.arange(0, HIST_MAX + PRECISION / 2, PRECISION)
+        # 最后一个桶统计超出HIST_MAX的记录
+        self.hist = np.zeros(len(self.edges), dtype=np.int64)
+        self.series = TimeSeriesAggregator()
+
+    def add(self, record: LossRecord):
+        if record.expected <= 0:
+            return
+        rate = record.lost / record.expected * 100
+        self.lost += record.lost
+        self.expected += record.expected
+        self.records += 1
+        self.sum += rate
+        self.max = max(self.max, rate)
+        if self.begin is None:
+            self.begin = record.time
+        self.end = record.time
+        self.hist[
+            min(np.searchsorted(self.edges, rate, "right") - 1, len(self.hist) - 1)
+        ] += 1
+        self.series.add(record.time, rate, self.global_rate)
+
+    @property
+    def global_rate(self) -> float:
+        return self.lost / self.expected * 100 if self.expected else 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.records if self.records else 0.0
+
+    @property
+    def median(self) -> float:
+        """由直方图估计的中位数，精度为PRECISION"""
+        if not self.records:
+            return 0.0
+        index = np.searchsorted(np.cumsum(self.hist), (self.records + 1) / 2)
+        return float(self.edges[index] + PRECISION / 2)
+
+
+def report(statistics: LossStatistics):
+    if not statistics.records:
+        print("没有找到丢帧记录")
+        return
+    print(f"时间范围: {statistics.begin} ~ {statistics.end}")
+    print(f"记录数: {statistics.records}")
+    print(f"全局丢帧数: {statistics.lost}, 全局丢帧率: {statistics.global_rate:.4f}%")
+    print(
+        f"短时丢帧率: 均值 {statistics.mean:.4f}%, 中位数 {statistics.median:.4f}%, 最大值 {statistics.max:.4f}%"
+    )
+
+
+def plot(statistics: LossStatistics, outputDir: str | None = None):
+    import matplotlib.pyplot as plt
+
+    # 中文支持
+    plt.rcParams["font.sans-serif"] = ["SimHei"]
+
+    def finish(fileName: str):
+        if outputDir is None:
+            plt.show()
+        else:
+            os.makedirs(outputDir, exist_ok=True)
+            plt.savefig(os.path.join(outputDir, fileName))
+        plt.close()
+
+    times, means, maxs, globals = statistics.series.series()
+
+    # 绘制全局丢帧率变化
+    plt.plot(times, globals, label="global frame drop rate")  # type: ignore
+    plt.title("全局丢帧率变化")
+    plt.gca().yaxis.set_major_formatter(lambda y, _: f"{y:.4f}%")
+    plt.gcf().autofmt_xdate()
+    finish("global_time.png")
+
+    # 绘制短时丢帧率变化
+    plt.plot(times, means, label="frame drop rate")  # type: ignore
+    plt.plot(times, maxs, alpha=0.3, label="区间最大值")  # type: ignore
+    plt.axhline(
+        statistics.mean,
+        color="r",
+        linestyle="--",
+        label=f"均值 = {statistics.mean:.4f}%",
+    )
+    plt.axhline(
+        statistics.median,
+        color="g",
+        linestyle="--",
+        label=f"中位数 = {statistics.median:.4f}%",
+    )
+    plt.axhline(
+        statistics.max,
+        color="b",
+        linestyle="--",
+        label=f"最大值 = {statistics.max:.4f}%",
+    )
+    plt.legend()
+    plt.title("丢帧率变化")
+    plt.gca().yaxis.set_major_formatter(lambda y, _: f"{y:.4f}%")
+    plt.gcf().autofmt_xdate()
+    finish("time.png")
+
+    # 绘制分布直方图
+    plt.bar(statistics.edges, statistics.hist, width=PRECISION, align="edge")
+    plt.title("丢帧率分布直方图")
+    plt.gca().xaxis.set_major_formatter(lambda x, _: f"{x:.3f}%")
+    finish("hist.png")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="丢帧统计")
+    parser.add_argument("--path", default=LOG_CONFIG["path"], help="日志文件夹路径")
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        const=METRICS_CONFIG["snapshotPath"],
+        help="改为读取指标快照文件，不指定路径时使用METRICS_CONFIG中的路径",
+    )
+    parser.add_argument("--target", default=LEGACY_TARGET, help="统计的数据源")
+    parser.add_argument(
+        "--begin", type=datetime.fromisoformat, help="开始时间，如2024-01-01 08:00:00"
+    )
+    parser.add_argument("--end", type=datetime.fromisoformat, help="结束时间")
+    parser.add_argument("--output", help="图片保存文件夹，不指定时直接显示")
+    parser.add_argument("--no-plot", action="store_true", help="只输出统计结果")
+    args = parser.parse_args()
+
+    if args.metrics:
+        records = read_metrics(args.metrics, args.target, args.begin, args.end)
+    else:
+        records = read_logs(args.path, args.target, args.begin, args.end)
+    statistics = LossStatistics()
+    for record in records:
+        statistics.add(record)
+    report(statistics)
+    if not args.no_plot and statistics.records:
+        plot(statistics, args.output)
@@ -1,135 +1,226 @@
 # coding=utf-8
 
+import time
+
+# 启动时刻，首帧耗时包括导入模块的时间
+START_TIME = time.monotonic()
+
 import itertools
+import collections
 import functools
-import time
+import threading
 import asyncio
+import gc
 import numpy as np
 import math
 import ctypes
-from multiprocessing import Process, RawArray, Lock, Queue, Event
+from multiprocessing import Process, RawArray, RawValue, Lock, Queue, Event
+import multiprocessing.connection
+import multiprocessing.queues
 import multiprocessing.synchronize
 from typing import TypedDict
 import os
 import atexit
 from datetime import datetime, timedelta
-from das_udp import ServerProtocol
+from das_udp import ServerProtocol, receiver_socket
 from command import RecvCommand, SendCommand
 from config import (
     DAS_CONFIG,
-    REMOTE_ADDRESS,
-    LOCAL_ADDRESS,
+    DEVICES,
+    MULTI_DEVICE,
     PINGPONG_SIZE,
-    FRAME_COUNTER,
+    CONSUMERS,
     HANDLE_INTERVAL,
     SAVE_CONFIG,
     PLOT_CONFIG,
+    PLOT_AGGREGATES,
+    PLOT_DEFAULT_AGG,
     STRICT_BEGIN_TARGET,
+    SOUND_CONFIG,
+    PHYSICAL_CONFIG,
+    FK_CONFIG,
+    QUERY_CONFIG,
+    STREAM_CONFIG,
+    METRICS_CONFIG,
+    RECEIVER_CONFIG,
 )
+from block_ring import BlockCursors
 from data_handler import DataHandler
-from utils import DataBuffer, log
-
-
-class FrameCounter:
-    def __init__(self):
-        self._frames = 0
-        self._totalFrames = 0
-        self._totalBeginTime = time.time()
-        self._beginTime = None
-        self._interval = FRAME_COUNTER["interval"]
-        self._theoSampleRate = DAS_CONFIG["targets"][FRAME_COUNTER["gist"]][
-            "sampleRate"
-        ]
-        self._maxLossRate = 0
-
-    def on_command(self, cmd: RecvCommand):
-        if cmd.name != FRAME_COUNTER["gist"]:
-            return
-        if self._beginTime is None:
-            self._beginTime = time.time()
-            self._totalBeginTime = time.time()
-        self._frames += 1
-        self._totalFrames += 1
-
-    def update(self):
-        if self._beginTime is None:
-            return
-        theoFrame = round((time.time() - self._beginTime) * self._theoSampleRate)
-        lossRate = max(1 - self._frames / theoFrame, 0)
-        totalTheoFrame = round(
-            (time.time() - self._totalBeginTime) * self._theoSampleRate
-        )
-        totalLossRate = max(1 - self._totalFrames / totalTheoFrame, 0)
-        log.debug(
-            f"丢帧数: {theoFrame - self._frames}, 丢帧率: {lossRate*100:.4f}%, 历史最大丢帧率: {self._maxLossRate*100:.4f}%, 全局丢帧数: {totalTheoFrame - self._totalFrames}, 全局丢帧率: {totalLossRate*100:.4f}%"
-        )
-        if time.time() - self._beginTime >= self._interval:
-            log.info(
-                f"丢帧数: {theoFrame - self._frames}, 丢帧率: {lossRate*100:.4f}%, 全局丢帧数: {totalTheoFrame - self._totalFrames}, 全局丢帧率: {totalLossRate*100:.4f}%"
-            )
-            self._maxLossRate = max(self._maxLossRate, lossRate)
-            self._frames = 0
-            self._beginTime = time.time()
+from sound_monitor import SoundMonitor
+from converter import PhysicalConverter, phys_block_size
+from fk_filter import FKOutput
+from seqlock import SeqLockBuffer
+from frame_clock import FrameClock
+from frame_stats import FrameStatistics
+from metrics import MetricsExporter, MetricsRegistry, device_labels, target_labels
+from profiling import Profiler, callback_timer, timed
+from query_server import serve_query
+from stream_server import serve_stream
+from utils import (
+    DataBuffer,
+    isolated_cpus,
+    log,
+    pin_cpus,
+    process_rss,
+    run_with_log,
+    set_realtime,
+    share_log,
+)
 
 
 def das_communicate(
-    protocol: ServerProtocol, exit_event: multiprocessing.synchronize.Event
+    protocol: ServerProtocol,
+    exit_event: multiprocessing.synchronize.Event,
+    metrics: MetricsRegistry,
+    device: str,
 ):
+    params = DEVICES[device]
+    lowLatency = RECEIVER_CONFIG["lowLatency"]
+    cpus = params["cpus"]
+    if cpus is None and lowLatency and RECEIVER_CONFIG["isolatedCpus"]:
+        # 多台设备依次使用隔离的CPU核
+        isolated = isolated_cpus()
+        if isolated:
+            cpus = [isolated[list(DEVICES).index(device) % len(isolated)]]
+    if cpus is not None:
+        pin_cpus(cpus)
+    if lowLatency:
+        set_realtime(RECEIVER_CONFIG["priority"])
+    prefix = f"设备{device}" if MULTI_DEVICE else ""
+    profiler = Profiler(f"receiver-{device}" if MULTI_DEVICE else "receiver")
+    # 回调计时只能在子进程中包装，包装后的函数无法传给子进程
+    protocol.datagram_received = timed(
+        protocol.datagram_received,
+        callback_timer(metrics, "datagram_received", device),
+    )
+    recorderTimer = callback_timer(metrics, "DataRecorder.on_command", device)
+    protocol.cmdListener = [
+        (
+            timed(listener, recorderTimer)
+            if isinstance(getattr(listener, "__self__", None), DataRecorder)
+            else listener
+        )
+        for listener in protocol.cmdListener
+    ]
+
     async def inner():
         nonlocal protocol
         loop = asyncio.get_running_loop()
-        transport, _ = await loop.create_datagram_endpoint(
-            lambda: protocol, local_addr=LOCAL_ADDRESS
+        sock = receiver_socket(
+            params["local"],
+            RECEIVER_CONFIG["recvBuffer"] if lowLatency else None,
+            RECEIVER_CONFIG["busyPoll"] if lowLatency else 0,
+        )
+        transport, _ = await loop.create_datagram_endpoint(lambda: protocol, sock=sock)
+        transport.sendto(
+            SendCommand("DAS配置", {**DAS_CONFIG, **params["das"]}).bytesData,
+            params["remote"],
         )
-        transport.sendto(SendCommand("DAS配置", DAS_CONFIG).bytesData, REMOTE_ADDRESS)
         # 等待数据接收
         await asyncio.sleep(0.2)
-        transport.sendto(SendCommand("高速数据开始发送").bytesData, REMOTE_ADDRESS)
+        transport.sendto(SendCommand("高速数据开始发送").bytesData, params["remote"])
         await asyncio.sleep(0.2)
-        log.info("开始接收数据")
-        frameCounter = FrameCounter()
-        protocol.on("command", frameCounter.on_command)
+        log.info("%s开始接收数据", prefix)
+        frameStatistics = FrameStatistics(metrics, device)
+        protocol.on("command", frameStatistics.on_command)
+        gcTimer = None
+        if lowLatency and RECEIVER_CONFIG["gcFreeze"]:
+            # 启动时分配的对象不再参与回收，接收回调中不会触发自动回收
+            gc.collect()
+            gc.freeze()
+            gc.disable()
+            gcTimer = metrics.histogram(
+                "das_receiver_gc_seconds", **device_labels(device)
+            )
         protocol.enable = True
-        while not exit_event.is_set():
+        for tick in itertools.count(1):
+            if exit_event.is_set():
+                break
             await asyncio.sleep(1)
-            frameCounter.update()
+            frameStatistics.update()
+            profiler.poll()
+            if gcTimer is not None:
+                # 自动回收关闭后不会再回收第2代，每秒只回收前两代中的循环引用，
+                # 每fullGcInterval秒做一次完整回收，回收已晋升到第2代的循环引用，避免内存持续增长
+                begin = time.perf_counter()
+                if tick % RECEIVER_CONFIG["fullGcInterval"] == 0:
+                    gc.collect()
+                else:
+                    gc.collect(1)
+                gcTimer.observe(time.perf_counter() - begin)
 
-        log.info("停止接收数据")
-        transport.sendto(SendCommand("高速数据停止发送").bytesData, REMOTE_ADDRESS)
+        log.info("%s停止接收数据", prefix)
+        transport.sendto(SendCommand("高速数据停止发送").bytesData, params["remote"])
 
     asyncio.run(inner())
 
 
 class ErrorLogger:
-    def __init__(self, minInterval=1):
-        self._lastWarnTime = None
-        self._interval = minInterval
+    def __init__(self, metrics: MetricsRegistry, device: str):
+        self._errors = metrics.counter(
+            "das_parse_errors_total", **device_labels(device)
+        )
 
     def on_error(self, e: Exception):
-        if (
-            self._lastWarnTime is None
-            or time.time() - self._lastWarnTime >= self._interval
-        ):
-            log.error(f"无效命令: {e}")
-            self._lastWarnTime = time.time()
+        self._errors.inc()
+        # 日志按消息模板限流，大量无效命令时只输出被抑制的条数
+        log.error("无效命令: %s", e)
 
 
 class DataRecorder:
+    """
+    将数据帧写入环形缓冲区，每写满一个数据块通知所有消费者
+    接收进程从不等待消费者，required消费者还未释放下一个位置时丢弃数据帧，直到该位置被释放后再开始新的数据块
+    """
+
     class _BufferDict(TypedDict):
         data: list[DataBuffer]
         offset: int
         pingpong: int
+        dropped: int  # 本次环形缓冲区满时已丢弃的帧数
 
-    def __init__(self, dataBuffers: dict[str, list[DataBuffer]], taskQueue):
+    def __init__(
+        self,
+        dataBuffers: dict[str, list[DataBuffer]],
+        taskQueues: dict[str, multiprocessing.queues.Queue],
+        cursors: dict[str, BlockCursors],
+        frameCounts: dict[str, ctypes.c_uint64],
+        metrics: MetricsRegistry,
+        device: str,
+    ):
         self._bufferDicts: dict[str, DataRecorder._BufferDict] = {}
         for name, dataBuffer in dataBuffers.items():
             self._bufferDicts[name] = {
                 "data": dataBuffer,
                 "offset": 0,
                 "pingpong": 0,
+                "dropped": 0,
             }
-            dataBuffer[0]["lock"].acquire()
-        self._taskQueue = taskQueue
+        self._taskQueues = taskQueues
+        self._cursors = cursors
+        # 每个数据源已写入环形缓冲区的总帧数，供绘图进程按帧定位
+        self._frameCounts = frameCounts
+        self._begin = DAS_CONFIG["validPointRange"].start * DAS_CONFIG["dtype"].itemsize
+        self._blocksProduced = {
+            name: metrics.counter(
+                "das_blocks_produced_total", **target_labels(device, name)
+            )
+            for name in dataBuffers
+        }
+        self._overflowFrames = {
+            name: metrics.counter(
+                "das_ring_overflow_frames_total", **target_labels(device, name)
+            )
+            for name in dataBuffers
+        }
+        # 数据块的时间由帧时钟推算，传给处理进程的是块的结束时间
+        self._clocks = {name: FrameClock(name) for name in dataBuffers}
+        self._clockResiduals = {
+            name: metrics.gauge(
+                "das_clock_residual_seconds", **target_labels(device, name)
+            )
+            for name in dataBuffers
+        }
 
     def on_command(self, cmd: RecvCommand):
         if STRICT_BEGIN_TARGET and datetime.now() < SAVE_CONFIG["begin"] - timedelta(
@@ -139,45 +230,254 @@ class DataRecorder:
         if not cmd.name in DAS_CONFIG["targets"]:
             return
         if len(cmd.body) != DAS_CONFIG["dataSize"] * DAS_CONFIG["dtype"].itemsize:
-            log.error(f"无效的数据尺寸: {len(cmd.body)}")
+            log.error("无效的数据尺寸: %d", len(cmd.body))
             return
+        self._clocks[cmd.name].tick()
         bufferDict = self._bufferDicts[cmd.name]
-        addr = (
-            ctypes.addressof(bufferDict["data"][bufferDict["pingpong"]]["buffer"])
-            + bufferDict["offset"]
-        )
+        cursors = self._cursors[cmd.name]
+        if bufferDict["offset"] == 0:
+            if not cursors.writable():
+                bufferDict["dropped"] += 1
+                self._overflowFrames[cmd.name].inc()
+                return
+            if bufferDict["dropped"]:
+                log.warning(
+                    "%s有消费者未及时处理，环形缓冲区已满，丢弃%d帧",
+                    cmd.name,
+                    bufferDict["dropped"],
+                )
+                bufferDict["dropped"] = 0
         BYTE_SIZE = len(DAS_CONFIG["validPointRange"]) * DAS_CONFIG["dtype"].itemsize
-        ctypes.memmove(addr, cmd.body, BYTE_SIZE)
+        # cmd.body为memoryview，不能直接传给ctypes.memmove
+        dst = np.frombuffer(
+            bufferDict["data"][bufferDict["pingpong"]]["buffer"],
+            dtype=np.uint8,
+            count=BYTE_SIZE,
+            offset=bufferDict["offset"],
+        )
+        dst[:] = np.frombuffer(
+            cmd.body, dtype=np.uint8, count=BYTE_SIZE, offset=self._begin
+        )
         bufferDict["offset"] += BYTE_SIZE
+        self._frameCounts[cmd.name].value += 1
         if bufferDict["offset"] == len(
             bufferDict["data"][bufferDict["pingpong"]]["buffer"]
         ):
-            bufferDict["data"][bufferDict["pingpong"]]["lock"].release()
-            self._taskQueue.put((cmd.name, bufferDict["pingpong"], datetime.now()))
+            clock = self._clocks[cmd.name]
+            frames = bufferDict["offset"] // BYTE_SIZE
+            blockEnd = clock.block_start(frames) + timedelta(
+                seconds=frames * clock.period
+            )
+            self._clockResiduals[cmd.name].set(clock.residual)
+            block = cursors.publish()
+            for taskQueue in self._taskQueues.values():
+                taskQueue.put((cmd.name, block, blockEnd, clock.continuous))
+            self._blocksProduced[cmd.name].inc()
             bufferDict["offset"] = 0
-            bufferDict["pingpong"] = (bufferDict["pingpong"] + 1) % PINGPONG_SIZE
-            bufferDict["data"][bufferDict["pingpong"]]["lock"].acquire()
+            bufferDict["pingpong"] = cursors.written % PINGPONG_SIZE
 
 
 class PlotData:
-    def __init__(self, dataBuffers: dict[str, DataBuffer]):
-        self._dataBuffers = dataBuffers
+    """
+    绘图数据的区间聚合
+    逐帧缓存到批次中，每满一批做一次向量化更新，得到每个点位自上次被读取以来的最大绝对值、RMS和最新值，
+    再发布到顺序锁缓冲区。绘图和数据流服务各自有一份缓冲区和确认序号，读取后分别确认，未被读取的批次会继续累积，
+    因此两次刷新之间的帧都不会被遗漏，一个读者的确认也不会清空另一个读者的累积结果
+    """
+
+    # 保留最近若干批次的单批统计量，读取与确认之间又发布了新批次时，只从这些批次重新累积，避免重复计入已读取的批次
+    ACK_HISTORY = 4
+
+    def __init__(self, latestFrames: dict[str, dict[str, SeqLockBuffer]]):
+        """latestFrames: 读者 -> 数据源 -> 该读者的顺序锁缓冲区"""
+        self._latestFrames = latestFrames
+        points = len(DAS_CONFIG["validPointRange"])
+        names = {name for frames in latestFrames.values() for name in frames}
+        self._batches: dict[str, np.ndarray] = {}
+        for name in names:
+            publishEvery = max(
+                1,
+                round(
+                    DAS_CONFIG["targets"][name]["sampleRate"]
+                    * PLOT_CONFIG["publishInterval"]
+                    / 1000
+                ),
+            )
+            self._batches[name] = np.zeros((publishEvery, points), DAS_CONFIG["dtype"])
+        self._rows = {name: 0 for name in names}
+        # 每个数据源最近几个批次的(写入序号, 最大绝对值, 平方和, 帧数)
+        self._history: dict[str, collections.deque] = {
+            name: collections.deque(maxlen=self.ACK_HISTORY) for name in names
+        }
+        self._published = {name: 0 for name in names}
+        # 以下按(读者, 数据源)累积
+        keys = [
+            (reader, name) for reader, frames in latestFrames.items() for name in frames
+        ]
+        self._maxAbs = {key: np.zeros(points, np.float32) for key in keys}
+        self._sumSquares = {key: np.zeros(points, np.float64) for key in keys}
+        self._frames = {key: 0 for key in keys}
+        # 发布内容，按PLOT_AGGREGATES的顺序排列
+        self._outputs = {
+            key: np.zeros((len(PLOT_AGGREGATES), points), np.float32) for key in keys
+        }
+        self._begin = DAS_CONFIG["validPointRange"].start * DAS_CONFIG["dtype"].itemsize
 
     def on_command(self, cmd: RecvCommand):
-        if not cmd.name in self._dataBuffers:
+        if not cmd.name in self._batches:
             return
+        batch = self._batches[cmd.name]
+        batch[self._rows[cmd.name]] = np.frombuffer(
+            cmd.body, DAS_CONFIG["dtype"], count=batch.shape[1], offset=self._begin
+        )
+        self._rows[cmd.name] += 1
+        if self._rows[cmd.name] == len(batch):
+            self._rows[cmd.name] = 0
+            self.publish(cmd.name)
+
+    def publish(self, name: str):
+        batch = self._batches[name]
+        batchMax = np.maximum(
+            batch.max(axis=0).astype(np.float32), -batch.min(axis=0).astype(np.float32)
+        )
+        batchSquares = np.einsum("ij,ij->j", batch, batch, dtype=np.float64)
+        history = self._history[name]
+        self._published[name] += 1
+        for reader, latestFrames in self._latestFrames.items():
+            if name not in latestFrames:
+                continue
+            latestFrame = latestFrames[name]
+            key = (reader, name)
+            maxAbs = self._maxAbs[key]
+            sumSquares = self._sumSquares[key]
+            acknowledged = latestFrame.acknowledged
+            # 读者确认后重新开始累积，只计入确认之后发布的批次
+            if latestFrame.sequence - acknowledged <= len(history):
+                maxAbs.fill(0)
+                sumSquares.fill(0)
+                self._frames[key] = 0
+                for sequence, oldMax, oldSquares, frames in history:
+                    if sequence > acknowledged:
+                        np.maximum(maxAbs, oldMax, out=maxAbs)
+                        sumSquares += oldSquares
+                        self._frames[key] += frames
+            np.maximum(maxAbs, batchMax, out=maxAbs)
+            sumSquares += batchSquares
+            self._frames[key] += len(batch)
+
+            output = self._outputs[key]
+            output[PLOT_AGGREGATES.index("max")] = maxAbs
+            np.sqrt(
+                sumSquares / self._frames[key], out=output[PLOT_AGGREGATES.index("rms")]
+            )
+            output[PLOT_AGGREGATES.index("last")] = batch[-1]
+            latestFrame.write(output)
+        history.append((self._published[name], batchMax, batchSquares, len(batch)))
+
+
+class Waterfall:
+    """
+    热力图的预分配环形缓冲区
+    每行同时写入i和i+size两个位置，任意时刻最近size行都是一段连续视图，刷新时无需整体滚动复制
+    """
+
+    def __init__(self, size: int, points: int):
+        self._size = size
+        self._data = np.zeros((2 * size, points), dtype=np.float32)
+        self._index = 0
+
+    def push(self, row: np.ndarray):
+        line = self._data[self._index]
+        np.abs(row, out=line)
+        np.log1p(line, out=line)
+        self._data[self._index + self._size] = line
+        self._index = (self._index + 1) % self._size
+
+    def view(self) -> np.ndarray:
+        # 从最旧一行到最新一行
+        return self._data[self._index : self._index + self._size]
+
 
-        if not self._dataBuffers[cmd.name]["lock"].acquire(block=False):
+class TimeSeries:
+    """
+    时间波形的预分配环形缓冲区，与Waterfall相同，每个采样写入两份，最近size个采样始终是一段连续视图
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._data = np.zeros(2 * size, dtype=np.float32)
+        self._index = 0
+
+    def extend(self, samples: np.ndarray):
+        samples = samples[-self._size :]
+        first = min(len(samples), self._size - self._index)
+        for offset in (0, self._size):
+            begin = self._index + offset
+            self._data[begin : begin + first] = samples[:first]
+            self._data[offset : offset + len(samples) - first] = samples[first:]
+        self._index = (self._index + len(samples)) % self._size
+
+    def view(self) -> np.ndarray:
+        return self._data[self._index : self._index + self._size]
+
+
+def min_max_decimate(data: np.ndarray, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    将波形按像素列分段，每段只保留最小值和最大值，返回(横坐标, 纵坐标)
+    数据量不超过两倍像素宽度时原样返回
+    """
+    if width <= 0 or len(data) <= 2 * width:
+        return np.arange(len(data)), data
+    step = len(data) // width
+    skip = len(data) - step * width
+    segments = data[skip:].reshape(width, step)
+    y = np.empty(2 * width, dtype=data.dtype)
+    y[0::2] = segments.min(axis=1)
+    y[1::2] = segments.max(axis=1)
+    x = np.repeat(skip + np.arange(width) * step, 2)
+    x[1::2] += step - 1
+    return x, y
+
+
+class DrawStatistics:
+    """统计每帧的数据准备耗时和绘制总耗时，定期输出到日志"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._interval = PLOT_CONFIG["statInterval"]
+        self._beginTime = time.perf_counter()
+        self._updateCosts: list[float] = []
+        self._drawCosts: list[float] = []
+
+    def record(self, updateCost: float, drawCost: float):
+        self._updateCosts.append(updateCost)
+        self._drawCosts.append(drawCost)
+        elapsed = time.perf_counter() - self._beginTime
+        if elapsed < self._interval:
             return
-        addr = (
-            ctypes.addressof(self._dataBuffers[cmd.name]["buffer"])
-            + DAS_CONFIG["validPointRange"].start
+        updateCosts = np.array(self._updateCosts) * 1000
+        drawCosts = np.array(self._drawCosts) * 1000
+        log.info(
+            "%s绘图: 刷新率: %.1ffps, 数据准备: 平均%.2fms, 单帧绘制: 平均%.2fms, P95 %.2fms, 最大%.2fms",
+            self._name,
+            len(drawCosts) / elapsed,
+            updateCosts.mean(),
+            drawCosts.mean(),
+            np.percentile(drawCosts, 95),
+            drawCosts.max(),
         )
-        ctypes.memmove(addr, cmd.body, len(self._dataBuffers[cmd.name]["buffer"]))
-        self._dataBuffers[cmd.name]["lock"].release()
+        self._updateCosts.clear()
+        self._drawCosts.clear()
+        self._beginTime = time.perf_counter()
 
 
-def show_plot(dataBuffers: dict[str, DataBuffer]):
+def show_plot(
+    latestFrames: dict[str, SeqLockBuffer],
+    soundMonitor: SoundMonitor | None = None,
+    fkOutputs: dict[str, FKOutput] | None = None,
+    pingpangBuffers: dict[str, list[DataBuffer]] | None = None,
+    frameCounts: dict[str, ctypes.c_uint64] | None = None,
+):
     import matplotlib.pyplot as plt
     import matplotlib.animation as animation
     import matplotlib.colors as mcolors
@@ -188,28 +488,155 @@ def show_plot(dataBuffers: dict[str, DataBuffer]):
     H_WHITESPACE = 0.05
     V_WHITESPACE = 0.05
 
-    def update_plot(name, datasets, _):
-        nonlocal dataBuffers
+    # 每个数据源一份复用的聚合结果和换算结果，每次刷新只读取并换算一次
+    # 绘图在数据块写满前实时刷新，共享物理量缓冲区要等数据块写满并被换算后才可用，这里只换算少量统计量
+    converters = {name: PhysicalConverter(name) for name in latestFrames}
+    shape = (len(PLOT_AGGREGATES), len(DAS_CONFIG["validPointRange"]))
+    rawFrames = {name: np.zeros(shape, dtype=np.float32) for name in latestFrames}
+    frames = {name: np.zeros(shape, dtype=np.float32) for name in latestFrames}
+    sequences = {name: 0 for name in latestFrames}
+
+    # 每个热力图一个环形缓冲区，键为(数据源, 图表序号)
+    waterfalls: dict[tuple[str, int], Waterfall] = {}
+    # 每个时间波形一个环形缓冲区和对应的坐标轴
+    timeSeries: dict[tuple[str, int], TimeSeries] = {}
+    timeAxes: dict[tuple[str, int], object] = {}
+    # 最近一次数据准备耗时，供绘制统计使用
+    updateCosts: dict[str, float] = {}
+
+    # 时间波形直接从数据块环形缓冲区中按列读取全部采样
+    blockViews: dict[str, list[np.ndarray]] = {}
+    readCounts: dict[str, int] = {}
+    if pingpangBuffers is not None and frameCounts is not None:
+        for name in latestFrames:
+            blockViews[name] = [
+                np.frombuffer(dataBuffer["buffer"], dtype=DAS_CONFIG["dtype"]).reshape(
+                    -1, len(DAS_CONFIG["validPointRange"])
+                )
+                for dataBuffer in pingpangBuffers[name]
+            ]
+            readCounts[name] = frameCounts[name].value
+
+    def gather_samples(name, columns) -> np.ndarray | None:
+        """读取上次刷新以来写入的全部帧中指定列的数据，没有新帧时返回None"""
+        if name not in blockViews:
+            return None
+        assert frameCounts is not None
+        count = frameCounts[name].value
+        framesPerBlock = len(blockViews[name][0])
+        # 正在写入的块之前只有PINGPONG_SIZE-1个已完成的块，更早的数据已被覆盖
+        begin = max(
+            readCounts[name],
+            (count // framesPerBlock - PINGPONG_SIZE + 1) * framesPerBlock,
+        )
+        readCounts[name] = count
+        parts = []
+        for block in range(begin // framesPerBlock, -(-count // framesPerBlock)):
+            offset = block * framesPerBlock
+            parts.append(
+                blockViews[name][block % PINGPONG_SIZE][
+                    max(begin, offset)
+                    - offset : min(count, offset + framesPerBlock)
+                    - offset,
+                    columns,
+                ]
+            )
+        if not parts:
+            return None
+        return np.concatenate(parts)
+
+    def update_plot(name, charts, datasets, _):
+        begin = time.perf_counter()
+        data = frames[name]
+        # 没有新数据或读取被写入打断时沿用上一次的结果
+        sequence = latestFrames[name].read(rawFrames[name])
+        fresh = sequence is not None and sequence != sequences[name]
+        if fresh:
+            latestFrames[name].acknowledge(sequence)
+            sequences[name] = sequence
+            converters[name].convert(rawFrames[name], out=data)
+        # 所有时间波形的点位一次性按列读取
+        timeCharts = [i for i, chart in enumerate(charts) if chart["type"] == "time"]
+        samples = None
+        if timeCharts:
+            samples = gather_samples(
+                name,
+                [
+                    charts[i]["point"] - DAS_CONFIG["validPointRange"].start
+                    for i in timeCharts
+                ],
+            )
+            if samples is not None:
+                samples = converters[name].convert(samples)
         for i, chart in enumerate(charts):
-            with dataBuffers[name]["lock"]:
-                data = np.frombuffer(
-                    dataBuffers[name]["buffer"],
-                    dtype=DAS_CONFIG["dtype"],
-                ) * (np.pi / 255)
-            if chart["type"] == "heat":
-                heatData = np.roll(datasets[i].get_array(), -1, axis=0)
-                heatData[-1, :] = np.log1p(np.abs(data, out=data), out=data)
-                datasets[i].set_data(heatData)
+            agg = PLOT_AGGREGATES.index(
+                chart.get("agg", PLOT_DEFAULT_AGG[chart["type"]])
+            )
+            if chart["type"] == "heat" and chart.get("source", "phys") == "fk":
+                update_fk_heat(name, chart, datasets[i])
+            elif chart["type"] == "heat":
+                waterfall = waterfalls[(name, i)]
+                if fresh:
+                    waterfall.push(data[agg])
+                datasets[i].set_data(waterfall.view())
             elif chart["type"] == "space":
-                datasets[i].set_ydata(data)
+                datasets[i].set_ydata(data[agg])
             elif chart["type"] == "time":
-                timeData = np.roll(datasets[i].get_ydata(), -1)
-                timeData[-1] = data[chart["point"]]
-                datasets[i].set_ydata(timeData)
+                series = timeSeries[(name, i)]
+                if samples is not None:
+                    series.extend(samples[:, timeCharts.index(i)])
+                elif fresh:
+                    # 数据块未在写入(如尚未到保存开始时间)时退化为区间统计量
+                    column = chart["point"] - DAS_CONFIG["validPointRange"].start
+                    series.extend(data[agg, column : column + 1])
+                if chart.get("decimate", True):
+                    width = int(timeAxes[(name, i)].bbox.width)
+                    datasets[i].set_data(*min_max_decimate(series.view(), width))
+                else:
+                    datasets[i].set_ydata(series.view())
             else:
                 raise ValueError(f"无效的图表类型: {chart['type']}")
+        updateCosts[name] = time.perf_counter() - begin
         return datasets
 
+    # f-k滤波结果按数据块更新，记录每个图表上次显示的缓冲区下标
+    fkShown: dict[int, int] = {}
+
+    def update_fk_heat(name, chart, dataset):
+        assert fkOutputs is not None
+        latest = fkOutputs[name]["latest"].value
+        if latest < 0 or fkShown.get(id(chart)) == latest:
+            return
+        fkShown[id(chart)] = latest
+        fkBuffer = fkOutputs[name]["buffers"][latest]
+        with fkBuffer["lock"]:
+            block = np.frombuffer(fkBuffer["buffer"], dtype=np.float32).reshape(
+                -1, len(DAS_CONFIG["validPointRange"])
+            )
+            # 每行显示一段时间内的最大绝对值
+            rows = len(block) // chart["size"] * chart["size"]
+            heatData = (
+                np.abs(block[:rows])
+                .reshape(chart["size"], -1, block.shape[1])
+                .max(axis=1)
+            )
+        dataset.set_data(np.log1p(heatData, out=heatData))
+
+    class TimedAnimation(animation.FuncAnimation):
+        """记录每帧从数据准备到blit完成的总耗时"""
+
+        def __init__(self, name, *args, **kwargs):
+            self.drawStatistics = DrawStatistics(name)
+            self._name = name
+            super().__init__(*args, **kwargs)
+
+        def _draw_next_frame(self, framedata, blit):
+            begin = time.perf_counter()
+            super()._draw_next_frame(framedata, blit)
+            self.drawStatistics.record(
+                updateCosts.get(self._name, 0), time.perf_counter() - begin
+            )
+
     # 保持对动画的引用，防止被回收
     anis = []
 
@@ -231,10 +658,11 @@ def show_plot(dataBuffers: dict[str, DataBuffer]):
         datasets = []
         for i, chart in enumerate(charts):
             if chart["type"] == "heat":
+                waterfalls[(name, i)] = Waterfall(
+                    chart["size"], len(DAS_CONFIG["validPointRange"])
+                )
                 data = axes[i].imshow(
-                    np.log1p(
-                        np.zeros((chart["size"], len(DAS_CONFIG["validPointRange"])))
-                    ),
+                    waterfalls[(name, i)].view(),
                     aspect="auto",
                     norm=mcolors.Normalize(
                         vmin=np.log1p(0),
@@ -242,7 +670,9 @@ def show_plot(dataBuffers: dict[str, DataBuffer]):
                     ),
                 )
                 datasets.append(data)
-                axes[i].set_title("热力图")
+                axes[i].set_title(
+                    "f-k滤波热力图" if chart.get("source", "phys") == "fk" else "热力图"
+                )
             elif chart["type"] == "space":
                 (data,) = axes[i].plot(np.zeros(len(DAS_CONFIG["validPointRange"])))
                 datasets.append(data)
@@ -253,6 +683,8 @@ def show_plot(dataBuffers: dict[str, DataBuffer]):
                 axes[i].set_ylim(target["min"], target["max"])
                 axes[i].set_title("空间波形")
             elif chart["type"] == "time":
+                timeSeries[(name, i)] = TimeSeries(chart["size"])
+                timeAxes[(name, i)] = axes[i]
                 (data,) = axes[i].plot(np.zeros(chart["size"]))
                 datasets.append(data)
                 axes[i].set_xlim(0, chart["size"] - 1)
@@ -265,10 +697,43 @@ def show_plot(dataBuffers: dict[str, DataBuffer]):
         for i in range(len(charts), len(axes)):
             fig.delaxes(axes[i])
 
+        # 在监听数据的空间波形上单击切换监听点位，按住shift单击增删混合点位
+        if soundMonitor is not None and name == SOUND_CONFIG["target"]:
+            spaceAxes = [
+                axes[i] for i, chart in enumerate(charts) if chart["type"] == "space"
+            ]
+
+            def on_click(event, spaceAxes=spaceAxes, fig=fig):
+                if event.inaxes not in spaceAxes or event.xdata is None:
+                    return
+                point = round(event.xdata)
+                if point not in DAS_CONFIG["validPointRange"]:
+                    return
+                points = [point]
+                if event.key == "shift":
+                    points = soundMonitor.points
+                    if point in points:
+                        points.remove(point)
+                    else:
+                        points.append(point)
+                try:
+                    soundMonitor.set_points(points)
+                except ValueError as e:
+                    log.warning(e)
+                    return
+                for ax in spaceAxes:
+                    ax.set_title(f"空间波形(监听点位:{points})")
+                fig.canvas.draw_idle()
+
+            for ax in spaceAxes:
+                ax.set_title(f"空间波形(监听点位:{soundMonitor.points})")
+            fig.canvas.mpl_connect("button_press_event", on_click)
+
         anis.append(
-            animation.FuncAnimation(
+            TimedAnimation(
+                name,
                 fig,
-                functools.partial(update_plot, name, datasets),
+                functools.partial(update_plot, name, charts, datasets),
                 interval=PLOT_CONFIG["interval"],
                 blit=True,
                 frames=itertools.cycle([None]),  # type: ignore
@@ -276,16 +741,19 @@ def show_plot(dataBuffers: dict[str, DataBuffer]):
             )
         )
 
+    # 绘图在主进程的GUI线程中进行，由定时器检查是否需要性能分析
+    profiler = Profiler("plotter")
+    profileTimer = plt.gcf().canvas.new_timer(interval=1000)
+    profileTimer.add_callback(profiler.poll)
+    profileTimer.start()
     plt.show()
 
 
-def main():
-    if not os.path.exists(SAVE_CONFIG["path"]):
-        os.mkdir(SAVE_CONFIG["path"])
-
-    protocol = ServerProtocol()
-    protocol.on("error", ErrorLogger().on_error)
-
+def ring_buffers() -> dict[str, list[DataBuffer]]:
+    """
+    每个数据源PINGPONG_SIZE个数据块，每块为HANDLE_INTERVAL秒的有效点位数据
+    数据块的读写由BlockCursors协调，不使用锁
+    """
     pingpangBuffers: dict[str, list[DataBuffer]] = {}
     for name, params in DAS_CONFIG["targets"].items():
         pingpangBuffers[name] = [
@@ -303,50 +771,261 @@ def main():
             }
             for _ in range(PINGPONG_SIZE)
         ]
-    taskQueue = Queue()
-    protocol.on("command", DataRecorder(pingpangBuffers, taskQueue).on_command)
+    return pingpangBuffers
 
-    if PLOT_CONFIG["enable"]:
-        currentBuffers: dict[str, DataBuffer] = {}
-        for name in PLOT_CONFIG["targets"]:
-            currentBuffers[name] = {
-                "buffer": RawArray(
-                    ctypes.c_byte,
-                    len(DAS_CONFIG["validPointRange"]) * DAS_CONFIG["dtype"].itemsize,
-                ),
+
+def report_startup(
+    frameCounts: list[ctypes.c_uint64],
+    pids: dict[str, int],
+    exit_event: multiprocessing.synchronize.Event,
+):
+    """等待第一帧写入缓冲区，输出首帧耗时和各进程的常驻内存"""
+    while not any(count.value for count in frameCounts):
+        if exit_event.wait(0.01):
+            return
+    log.info("首帧耗时: %.3fs", time.monotonic() - START_TIME)
+    memory = []
+    for role, pid in pids.items():
+        rss = process_rss(pid)
+        if rss is not None:
+            memory.append(f"{role}(pid {pid}) {rss / 2**20:.1f}MB")
+    if memory:
+        log.info("常驻内存: %s", ", ".join(memory))
+
+
+def supervise(receivers: dict[str, Process]):
+    """等待所有接收进程结束，某台设备的接收进程意外退出时记录日志，其它设备不受影响"""
+    running = {process.sentinel: device for device, process in receivers.items()}
+    while running:
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            device = running.pop(sentinel)  # type: ignore
+            if receivers[device].exitcode != 0:
+                log.error(
+                    "设备%s的接收进程意外退出，返回值%s",
+                    device,
+                    receivers[device].exitcode,
+                )
+
+
+def main():
+    # 子进程的日志交给主进程的后台线程统一写入
+    logQueue = share_log()
+    # 指标在创建子进程前分配，各进程直接写入共享内存
+    metrics = MetricsRegistry()
+
+    # 绘图、声音、物理量换算、f-k滤波、感兴趣区域和数据流服务只处理第一台设备
+    primary = next(iter(DEVICES))
+    # 每台设备运行的消费者，其余设备没有analytics进程
+    consumers = {
+        device: [
+            consumer
+            for consumer in CONSUMERS
+            if device == primary or consumer != "analytics"
+        ]
+        for device in DEVICES
+    }
+
+    # 每台设备独立的协议、缓冲区和任务队列
+    protocols: dict[str, ServerProtocol] = {}
+    deviceBuffers: dict[str, dict[str, list[DataBuffer]]] = {}
+    # 每个消费者一个任务队列
+    taskQueues: dict[str, dict[str, multiprocessing.queues.Queue]] = {}
+    cursors: dict[str, dict[str, BlockCursors]] = {}
+    frameCounts: dict[str, dict[str, ctypes.c_uint64]] = {}
+    for device, params in DEVICES.items():
+        os.makedirs(params["savePath"], exist_ok=True)
+        protocols[device] = ServerProtocol(params["remote"])
+        protocols[device].on("error", ErrorLogger(metrics, device).on_error)
+        deviceBuffers[device] = ring_buffers()
+        taskQueues[device] = {consumer: Queue() for consumer in consumers[device]}
+        cursors[device] = {
+            name: BlockCursors(consumers[device]) for name in deviceBuffers[device]
+        }
+        frameCounts[device] = {
+            name: RawValue(ctypes.c_uint64, 0) for name in deviceBuffers[device]
+        }
+        protocols[device].on(
+            "command",
+            DataRecorder(
+                deviceBuffers[device],
+                taskQueues[device],
+                cursors[device],
+                frameCounts[device],
+                metrics,
+                device,
+            ).on_command,
+        )
+
+    protocol = protocols[primary]
+    pingpangBuffers = deviceBuffers[primary]
+
+    # 每个数据块对应一份float32物理量缓冲区，由数据处理进程换算一次后共享
+    physBuffers: dict[str, list[DataBuffer]] = {}
+    for name in PHYSICAL_CONFIG["targets"]:
+        physBuffers[name] = [
+            {
+                "buffer": RawArray(ctypes.c_byte, phys_block_size(dataBuffer)),
                 "lock": Lock(),
             }
-        protocol.on("command", PlotData(currentBuffers).on_command)
+            for dataBuffer in pingpangBuffers[name]
+        ]
+
+    # f-k滤波结果与物理量缓冲区一一对应，供绘图和区域处理读取
+    fkOutputs: dict[str, FKOutput] = {}
+    if FK_CONFIG["enable"]:
+        for name in FK_CONFIG["targets"]:
+            fkOutputs[name] = {
+                "buffers": [
+                    {
+                        "buffer": RawArray(ctypes.c_byte, len(physBuffer["buffer"])),
+                        "lock": Lock(),
+                    }
+                    for physBuffer in physBuffers[name]
+                ],
+                "latest": RawValue(ctypes.c_int, -1),
+            }
+
+    soundMonitor = None
+    if SOUND_CONFIG["enable"]:
+        soundMonitor = SoundMonitor(metrics)
+        protocol.on("command", soundMonitor.on_command)
+
+    # 本地绘图和数据流服务各自读取接收进程发布的区间统计量，分别确认
+    liveTargets: dict[str, list[str]] = {}
+    if PLOT_CONFIG["enable"]:
+        liveTargets["plot"] = list(PLOT_CONFIG["targets"])
+    if STREAM_CONFIG["enable"]:
+        liveTargets["stream"] = STREAM_CONFIG["targets"]
+    latestFrames: dict[str, dict[str, SeqLockBuffer]] = {
+        reader: {
+            name: SeqLockBuffer(
+                len(PLOT_AGGREGATES)
+                * len(DAS_CONFIG["validPointRange"])
+                * ctypes.sizeof(ctypes.c_float)
+            )
+            for name in names
+        }
+        for reader, names in liveTargets.items()
+    }
+    if latestFrames:
+        protocol.on("command", PlotData(latestFrames).on_command)
+    # 区域检测事件由数据处理进程转发给数据流服务
+    eventQueue = Queue(maxsize=1000) if STREAM_CONFIG["enable"] else None
 
     # 退出事件
     exit_event = Event()
-    # 创建数据处理进程
-    dataHandler = DataHandler(pingpangBuffers, taskQueue)
-    handle = Process(target=dataHandler.on_command, args=(exit_event,), daemon=True)
-    handle.start()
-    # 创建数据接收进程
-    communicator = Process(
-        target=das_communicate,
+    # 每台设备的每个消费者一个数据处理进程
+    handlers: dict[tuple[str, str], Process] = {}
+    for device in DEVICES:
+        for consumer in consumers[device]:
+            analytics = consumer == "analytics"
+            dataHandler = DataHandler(
+                consumer,
+                deviceBuffers[device],
+                taskQueues[device][consumer],
+                cursors[device],
+                physBuffers if analytics else {},
+                metrics,
+                device,
+                soundMonitor if analytics else None,
+                fkOutputs if analytics else None,
+                eventQueue if analytics else None,
+            )
+            handlers[(device, consumer)] = Process(
+                target=run_with_log,
+                args=(logQueue, dataHandler.on_command, exit_event),
+                daemon=True,
+            )
+            handlers[(device, consumer)].start()
+    # 创建数据流服务进程
+    streamer = None
+    if STREAM_CONFIG["enable"]:
+        streamer = Process(
+            target=run_with_log,
+            args=(
+                logQueue,
+                serve_stream,
+                latestFrames["stream"],
+                eventQueue,
+                exit_event,
+            ),
+            daemon=True,
+        )
+        streamer.start()
+    # 创建历史数据查询服务进程
+    querier = None
+    if QUERY_CONFIG["enable"]:
+        querier = Process(
+            target=run_with_log,
+            args=(logQueue, serve_query, metrics, exit_event),
+            daemon=True,
+        )
+        querier.start()
+    # 每台设备一个数据接收进程，由主进程统一管理
+    receivers: dict[str, Process] = {}
+    for device in DEVICES:
+        receivers[device] = Process(
+            target=run_with_log,
+            args=(
+                logQueue,
+                das_communicate,
+                protocols[device],
+                exit_event,
+                metrics,
+                device,
+            ),
+            daemon=True,
+        )
+        receivers[device].start()
+    pids = {"main": os.getpid()}
+    for device in DEVICES:
+        suffix = f"-{device}" if MULTI_DEVICE else ""
+        for consumer in consumers[device]:
+            pids[f"{consumer}{suffix}"] = handlers[(device, consumer)].pid  # type: ignore
+        pids[f"receiver{suffix}"] = receivers[device].pid  # type: ignore
+    if streamer is not None:
+        pids["streamer"] = streamer.pid  # type: ignore
+    if querier is not None:
+        pids["querier"] = querier.pid  # type: ignore
+    threading.Thread(
+        target=report_startup,
         args=(
-            protocol,
+            [count for counts in frameCounts.values() for count in counts.values()],
+            pids,
             exit_event,
         ),
         daemon=True,
-    )
-    communicator.start()
+    ).start()
+    exporter = None
+    if METRICS_CONFIG["enable"]:
+        exporter = MetricsExporter(metrics)
+        exporter.start()
 
     def on_exit():
         exit_event.set()
-        handle.join()
-        communicator.join()
+        if exporter is not None:
+            exporter.stop()
+        for process in [*handlers.values(), *receivers.values()]:
+            process.join()
+        if streamer is not None:
+            streamer.join()
+        if querier is not None:
+            querier.join()
 
     atexit.register(on_exit)
 
     if PLOT_CONFIG["enable"]:
-        show_plot(currentBuffers)
+        threading.Thread(target=supervise, args=(receivers,), daemon=True).start()
+        show_plot(
+            latestFrames["plot"],
+            soundMonitor,
+            fkOutputs,
+            pingpangBuffers,
+            frameCounts[primary],
+        )
     else:
         try:
-            communicator.join()
+            supervise(receivers)
         except KeyboardInterrupt:
             raise
 
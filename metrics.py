@@ -0,0 +1,389 @@
+import bisect
+import ctypes
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from multiprocessing import RawArray
+import os
+import threading
+from typing import Any
+from config import CONSUMERS, DAS_CONFIG, DEVICES, METRICS_CONFIG, MULTI_DEVICE
+from utils import log
+
+LATENCY_BUCKETS = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+]
+# 回调耗时通常在微秒级
+CALLBACK_BUCKETS = [
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.1,
+]
+
+
+def device_labels(device: str) -> dict[str, str]:
+    """只有一台设备时不带设备标签，指标与单设备时保持一致"""
+    return {"device": device} if MULTI_DEVICE else {}
+
+
+def target_labels(device: str, target: str) -> dict[str, str]:
+    return {**device_labels(device), "target": target}
+
+
+DEVICE_LABELS = [device_labels(device) for device in DEVICES]
+TARGET_LABELS = [
+    target_labels(device, name) for device in DEVICES for name in DAS_CONFIG["targets"]
+]
+CONSUMER_LABELS = [
+    {**labels, "consumer": consumer}
+    for labels in TARGET_LABELS
+    for consumer in CONSUMERS
+]
+CALLBACK_LABELS = [
+    {**device_labels(device), "callback": name}
+    for device in DEVICES
+    for name in [
+        "datagram_received",
+        "DataRecorder.on_command",
+        "save_data",
+        "audio_callback",
+    ]
+]
+
+# 指标定义: 名称 -> (类型, 说明, 标签组合列表, 直方图分桶)
+# 每个指标序列只能由一个进程写入，不同进程之间无需加锁，多台设备的指标在同一个注册表中汇总
+METRICS: dict[str, tuple[str, str, list[dict[str, str]], list[float] | None]] = {
+    "das_frames_received_total": ("counter", "接收到的数据帧数", TARGET_LABELS, None),
+    "das_frames_lost_total": (
+        "counter",
+        "按估计的DAS时钟速率计算的丢帧数",
+        TARGET_LABELS,
+        None,
+    ),
+    "das_frame_rate_hz": ("gauge", "估计的DAS时钟速率", TARGET_LABELS, None),
+    "das_frame_jitter_p99_seconds": (
+        "gauge",
+        "帧到达间隔抖动的99分位数",
+        TARGET_LABELS,
+        None,
+    ),
+    "das_clock_residual_seconds": (
+        "gauge",
+        "最近一个数据块最早到达的帧相对拟合时钟的偏差",
+        TARGET_LABELS,
+        None,
+    ),
+    "das_parse_errors_total": ("counter", "无效命令数", DEVICE_LABELS, None),
+    "das_blocks_produced_total": ("counter", "写满的数据块数", TARGET_LABELS, None),
+    "das_blocks_consumed_total": (
+        "counter",
+        "各消费者已取走的数据块数，包含跳过的数据块",
+        CONSUMER_LABELS,
+        None,
+    ),
+    "das_blocks_skipped_total": (
+        "counter",
+        "非required消费者落后或数据块已被覆盖时跳过的数据块数",
+        CONSUMER_LABELS,
+        None,
+    ),
+    "das_ring_overflow_frames_total": (
+        "counter",
+        "required消费者未释放环形缓冲区时接收进程丢弃的帧数",
+        TARGET_LABELS,
+        None,
+    ),
+    "das_block_handoff_seconds": (
+        "histogram",
+        "数据块写满到开始处理的延迟",
+        CONSUMER_LABELS,
+        LATENCY_BUCKETS,
+    ),
+    "das_file_write_seconds": (
+        "histogram",
+        "数据文件写入耗时",
+        TARGET_LABELS,
+        LATENCY_BUCKETS,
+    ),
+    "das_callback_seconds": (
+        "histogram",
+        "主要回调的耗时，仅在PROFILE_CONFIG中开启timing时统计",
+        CALLBACK_LABELS,
+        CALLBACK_BUCKETS,
+    ),
+    "das_receiver_gc_seconds": (
+        "histogram",
+        "低延迟模式下接收进程每秒集中垃圾回收的耗时，包含定期的完整回收",
+        DEVICE_LABELS,
+        CALLBACK_BUCKETS,
+    ),
+    "das_sound_dropped_samples_total": (
+        "counter",
+        "声音环形缓冲区满时丢弃的样本数",
+        [{}],
+        None,
+    ),
+    "das_query_requests_total": ("counter", "历史数据查询次数", [{}], None),
+    "das_query_errors_total": ("counter", "参数无效或失败的查询次数", [{}], None),
+    "das_query_bytes_total": ("counter", "查询返回的数据字节数", [{}], None),
+    "das_query_seconds": (
+        "histogram",
+        "查询从收到请求到发送完成的耗时",
+        [{}],
+        LATENCY_BUCKETS,
+    ),
+    "das_query_cache_hits_total": ("counter", "查询命中的缓存文件数", [{}], None),
+    "das_query_cache_misses_total": (
+        "counter",
+        "查询时读取并解码的文件数",
+        [{}],
+        None,
+    ),
+    "das_query_cache_bytes": ("gauge", "查询缓存占用的字节数", [{}], None),
+}
+# 导出时由其它指标计算得到的指标: 名称 -> (说明, 被减数, 减数)，标签与减数相同，被减数取其中的部分标签
+DERIVED_GAUGES = {
+    "das_ring_depth": (
+        "各消费者等待处理的数据块数",
+        "das_blocks_produced_total",
+        "das_blocks_consumed_total",
+    ),
+}
+
+
+def _label_key(labels: dict[str, str]) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _minuend_labels(minuend: str, labels: dict[str, str]) -> dict[str, str]:
+    keys = METRICS[minuend][2][0].keys()
+    return {k: v for k, v in labels.items() if k in keys}
+
+
+def _format_labels(labels: dict[str, str], extra: dict[str, str] | None = None) -> str:
+    items = {**labels, **(extra or {})}
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items.items()) + "}"
+
+
+class Counter:
+    def __init__(self, values: ctypes.Array, index: int):
+        self._values = values
+        self._index = index
+
+    def inc(self, amount: float = 1):
+        self._values[self._index] += amount
+
+
+class Gauge:
+    def __init__(self, values: ctypes.Array, index: int):
+        self._values = values
+        self._index = index
+
+    def set(self, value: float):
+        self._values[self._index] = value
+
+
+class Histogram:
+    """共享内存中的直方图，依次存放各分桶计数(非累积)、+Inf计数、总和、总数"""
+
+    def __init__(self, values: ctypes.Array, index: int, buckets: list[float]):
+        self._values = values
+        self._index = index
+        self._buckets = buckets
+
+    def observe(self, value: float):
+        bucket = bisect.bisect_left(self._buckets, value)
+        self._values[self._index + bucket] += 1
+        self._values[self._index + len(self._buckets) + 1] += value
+        self._values[self._index + len(self._buckets) + 2] += 1
+
+
+class MetricsRegistry:
+    """
+    共享内存指标注册表
+    所有指标在主进程中一次性分配到同一个RawArray中，子进程直接写入对应位置，无需进程间通信
+    """
+
+    def __init__(self):
+        self._layout: dict[str, dict[tuple, int]] = {}
+        size = 0
+        for name, (kind, _, labelsList, buckets) in METRICS.items():
+            self._layout[name] = {}
+            for labels in labelsList:
+                self._layout[name][_label_key(labels)] = size
+                size += len(buckets) + 3 if kind == "histogram" else 1
+        self._values = RawArray(ctypes.c_double, size)
+
+    def _index(self, name: str, kind: str, labels: dict[str, str]) -> int:
+        if METRICS[name][0] != kind:
+            raise ValueError(f"{name}不是{kind}类型的指标")
+        return self._layout[name][_label_key(labels)]
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        return Counter(self._values, self._index(name, "counter", labels))
+
+    def gauge(self, name: str, **labels: str) -> Gauge:
+        return Gauge(self._values, self._index(name, "gauge", labels))
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        buckets = METRICS[name][3]
+        assert buckets is not None
+        return Histogram(self._values, self._index(name, "histogram", labels), buckets)
+
+    def _value(self, name: str, labels: dict[str, str]) -> float:
+        return self._values[self._layout[name][_label_key(labels)]]
+
+    def _histogram_values(
+        self, name: str, labels: dict[str, str]
+    ) -> tuple[list[float], float, float]:
+        """返回(累积分桶计数, 总和, 总数)"""
+        buckets = METRICS[name][3]
+        assert buckets is not None
+        index = self._layout[name][_label_key(labels)]
+        counts = self._values[index : index + len(buckets) + 1]
+        cumulative = []
+        total = 0.0
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return (
+            cumulative,
+            self._values[index + len(buckets) + 1],
+            self._values[index + len(buckets) + 2],
+        )
+
+    def snapshot(self) -> dict[str, Any]:
+        """当前所有指标的快照，直方图只包含总和与总数"""
+        result: dict[str, Any] = {}
+        for name, (kind, _, labelsList, _) in METRICS.items():
+            for labels in labelsList:
+                key = name + _format_labels(labels)
+                if kind == "histogram":
+                    _, total, count = self._histogram_values(name, labels)
+                    result[key] = {"sum": total, "count": count}
+                else:
+                    result[key] = self._value(name, labels)
+        for name, (_, minuend, subtrahend) in DERIVED_GAUGES.items():
+            for labels in METRICS[subtrahend][2]:
+                result[name + _format_labels(labels)] = self._value(
+                    minuend, _minuend_labels(minuend, labels)
+                ) - self._value(subtrahend, labels)
+        return result
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        for name, (kind, help, labelsList, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels in labelsList:
+                if kind != "histogram":
+                    lines.append(
+                        f"{name}{_format_labels(labels)} {self._value(name, labels):g}"
+                    )
+                    continue
+                assert buckets is not None
+                cumulative, total, count = self._histogram_values(name, labels)
+                for bound, value in zip([*buckets, "+Inf"], cumulative):
+                    lines.append(
+                        f"{name}_bucket{_format_labels(labels, {'le': str(bound)})} {value:g}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count:g}")
+        for name, (help, minuend, subtrahend) in DERIVED_GAUGES.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels in METRICS[subtrahend][2]:
+                value = self._value(
+                    minuend, _minuend_labels(minuend, labels)
+                ) - self._value(subtrahend, labels)
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """在主进程中通过HTTP提供文本格式的指标，并定期将快照追加到JSONL文件"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self._registry = registry
+        self._stopEvent = threading.Event()
+        self._server: ThreadingHTTPServer | None = None
+
+    def start(self):
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        # 快照不依赖HTTP服务，端口被占用时仍然写入
+        threading.Thread(target=self._snapshot_loop, daemon=True).start()
+        try:
+            self._server = ThreadingHTTPServer(
+                (METRICS_CONFIG["host"], METRICS_CONFIG["port"]), Handler
+            )
+        except OSError as e:
+            # 指标服务不影响数据采集，启动失败时只记录错误
+            log.error(
+                "指标服务启动失败(%s:%s): %s",
+                METRICS_CONFIG["host"],
+                METRICS_CONFIG["port"],
+                e,
+            )
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        log.info(
+            "指标服务已启动: http://%s:%s/metrics",
+            METRICS_CONFIG["host"],
+            METRICS_CONFIG["port"],
+        )
+
+    def _snapshot_loop(self):
+        os.makedirs(os.path.dirname(METRICS_CONFIG["snapshotPath"]), exist_ok=True)
+        while not self._stopEvent.wait(METRICS_CONFIG["snapshotInterval"]):
+            record = {
+                "time": datetime.now().isoformat(timespec="milliseconds"),
+                **self._registry.snapshot(),
+            }
+            with open(METRICS_CONFIG["snapshotPath"], "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def stop(self):
+        self._stopEvent.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
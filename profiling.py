@@ -0,0 +1,172 @@
+from collections import Counter
+import cProfile
+from datetime import datetime
+import functools
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Callable, TypeVar
+from config import PROFILE_CONFIG, PROFILE_MODES
+from metrics import Histogram, MetricsRegistry, device_labels
+from utils import log
+
+F = TypeVar("F", bound=Callable)
+
+
+def callback_timer(
+    metrics: MetricsRegistry, callback: str, device: str
+) -> Histogram | None:
+    """未开启回调计时时返回None，调用方不做任何包装"""
+    if not PROFILE_CONFIG["timing"]:
+        return None
+    return metrics.histogram(
+        "das_callback_seconds", **device_labels(device), callback=callback
+    )
+
+
+def timed(func: F, histogram: Histogram | None) -> F:
+    """将每次调用的耗时记录到直方图，histogram为None时原样返回"""
+    if histogram is None:
+        return func
+    perf_counter = time.perf_counter
+    observe = histogram.observe
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        begin = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe(perf_counter() - begin)
+
+    return wrapper  # type: ignore
+
+
+class _Sampler(threading.Thread):
+    """在后台线程中定期采集目标线程的调用栈，结果为折叠栈格式，可直接生成火焰图"""
+
+    def __init__(self, threadId: int, interval: float):
+        super().__init__(daemon=True)
+        self._threadId = threadId
+        self._interval = interval
+        self._stopEvent = threading.Event()
+        self.stacks: Counter[str] = Counter()
+
+    def run(self):
+        while not self._stopEvent.wait(self._interval):
+            frame = sys._current_frames().get(self._threadId)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopEvent.set()
+        self.join()
+
+
+class Profiler:
+    """
+    按需性能分析
+    收到SIGUSR1(仅POSIX)或在controlDir下创建以角色命名的文件时，对调用poll的线程分析duration秒，
+    结果按角色和时间命名保存。控制文件内容可为"时长 方式"，分析期间再次触发则提前结束。
+    poll需要在被分析的线程中定期调用，未触发时只检查一次文件是否存在
+    """
+
+    def __init__(self, role: str):
+        self.role = role
+        self._controlPath = os.path.join(PROFILE_CONFIG["controlDir"], role)
+        self._requested = False
+        self._endTime: float | None = None
+        self._mode = PROFILE_CONFIG["mode"]
+        self._profile: cProfile.Profile | None = None
+        self._sampler: _Sampler | None = None
+        if (
+            hasattr(signal, "SIGUSR1")
+            and threading.current_thread() is threading.main_thread()
+        ):
+            signal.signal(signal.SIGUSR1, self._on_signal)
+        log.info(
+            "%s进程(pid %s)可通过SIGUSR1或创建文件%s开始性能分析",
+            role,
+            os.getpid(),
+            self._controlPath,
+        )
+
+    def _on_signal(self, signum, frame):
+        # 信号处理函数中只做标记，由poll在正常流程中开始或结束分析
+        self._requested = True
+
+    def _read_control(self) -> tuple[float, str] | None:
+        try:
+            with open(self._controlPath, "rb") as f:
+                content = f.read().decode("utf-8", errors="replace").split()
+            os.remove(self._controlPath)
+        except FileNotFoundError:
+            return None
+        # 控制文件由人工创建，内容无效时忽略本次请求，不影响所在进程
+        try:
+            duration = float(content[0]) if content else PROFILE_CONFIG["duration"]
+        except ValueError:
+            duration = math.nan
+        if not 0 < duration < math.inf:
+            log.warning(
+                "%s中的分析时长%s无效，忽略本次请求", self._controlPath, content[0]
+            )
+            return None
+        mode = content[1] if len(content) > 1 else PROFILE_CONFIG["mode"]
+        if mode not in PROFILE_MODES:
+            log.warning("%s不是有效的分析方式，使用%s", mode, PROFILE_CONFIG["mode"])
+            mode = PROFILE_CONFIG["mode"]
+        return duration, mode
+
+    def poll(self):
+        request = self._read_control()
+        if self._requested:
+            self._requested = False
+            request = request or (PROFILE_CONFIG["duration"], PROFILE_CONFIG["mode"])
+        if self._endTime is None:
+            if request is not None:
+                self.start(*request)
+        elif request is not None or time.monotonic() >= self._endTime:
+            self.stop()
+
+    def start(self, duration: float, mode: str):
+        self._mode = mode
+        self._endTime = time.monotonic() + duration
+        if mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = _Sampler(
+                threading.get_ident(), PROFILE_CONFIG["sampleInterval"]
+            )
+            self._sampler.start()
+        log.info("%s进程开始性能分析(%s, %ss)", self.role, mode, duration)
+
+    def stop(self):
+        os.makedirs(PROFILE_CONFIG["path"], exist_ok=True)
+        name = f"{self.role}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        if self._profile is not None:
+            self._profile.disable()
+            filePath = os.path.join(PROFILE_CONFIG["path"], f"{name}.prof")
+            self._profile.dump_stats(filePath)
+            self._profile = None
+        else:
+            assert self._sampler is not None
+            self._sampler.stop()
+            filePath = os.path.join(PROFILE_CONFIG["path"], f"{name}.txt")
+            with open(filePath, "w", encoding="utf-8") as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self._sampler = None
+        self._endTime = None
+        log.info("%s进程性能分析结果已保存到%s", self.role, filePath)
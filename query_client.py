@@ -0,0 +1,58 @@
+import argparse
+from http.client import HTTPConnection
+import json
+from urllib.parse import urlencode
+import numpy as np
+
+# 历史数据查询服务的参考客户端，按时间段返回数组，可保存为npz文件
+
+
+def fetch(host: str, port: int, **params) -> list[tuple[np.datetime64, np.ndarray]]:
+    """返回[(第一帧的时间, (帧数, 点位数)数组), ...]，每项为一个连续时间段"""
+    connection = HTTPConnection(host, port)
+    connection.request("GET", "/query?" + urlencode(params))
+    response = connection.getresponse()
+    if response.status != 200:
+        raise ValueError(json.loads(response.read())["error"])
+    meta = json.loads(response.readline())
+    dtype = np.dtype(meta["dtype"])
+    segments = []
+    for time, rows in meta["segments"]:
+        data = np.frombuffer(
+            response.read(rows * meta["columns"] * dtype.itemsize), dtype=dtype
+        )
+        segments.append((np.datetime64(time), data.reshape(rows, meta["columns"])))
+    connection.close()
+    return segments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="历史数据查询客户端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--device", help="设备名，默认为第一台设备")
+    parser.add_argument("--target", default="振动解调数据", help="数据名称")
+    parser.add_argument("begin", help="开始时间，如2024-05-29T15:32:00")
+    parser.add_argument("end", help="结束时间")
+    parser.add_argument("--points", help="点位范围，格式为start,stop,step")
+    parser.add_argument("--step", type=int, default=1, help="降采样倍数")
+    parser.add_argument("--agg", help="聚合方式")
+    parser.add_argument("-o", "--output", help="保存为npz文件")
+    args = parser.parse_args()
+
+    params = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("host", "port", "output") and value is not None
+    }
+    segments = fetch(args.host, args.port, **params)
+    for time, data in segments:
+        print(
+            f"{time}: {data.shape[0]}帧 x {data.shape[1]}点, 范围[{data.min()}, {data.max()}]"
+        )
+    if args.output:
+        np.savez(
+            args.output,
+            **{f"segment{i}": data for i, (_, data) in enumerate(segments)},
+            times=np.array([time for time, _ in segments]),
+        )
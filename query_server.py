@@ -0,0 +1,423 @@
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import multiprocessing.synchronize
+import os
+import threading
+import time
+from typing import Iterator, NamedTuple
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from check import list_times
+from config import (
+    DAS_CONFIG,
+    DEVICES,
+    QUERY_AGGREGATES,
+    QUERY_CONFIG,
+    SAVE_CONFIG,
+)
+from metrics import MetricsRegistry
+from utils import log
+
+# 历史数据查询协议
+# 响应体为 一行JSON元数据 + "\n" + 按帧排列的二进制数组，元数据包含:
+# - dtype: 数组的数据类型，如"<i2"
+# - columns: 每帧的点位数，points: [start, stop, step]
+# - rate: 输出的帧率，单位: Hz
+# - segments: 连续时间段列表 [[第一帧的时间, 帧数], ...]，时间段之间的文件缺失
+# 数据文件按保存顺序逐个解码、切片后发送，响应不会在内存中完整生成
+
+
+class FileIndex:
+    """一个保存文件夹中一种数据的文件索引，文件夹有变化时按间隔重建"""
+
+    def __init__(self, path: str, prefix: str):
+        self._path = path
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._mtime: int | None = None
+        self._indexTime = -math.inf
+        self.files = np.array([], dtype=object)
+        self.times = np.array([], dtype="datetime64[ms]")
+
+    def lookup(
+        self, begin: np.datetime64, end: np.datetime64
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """返回文件名中的时间在(begin, end]内的文件"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._indexTime >= QUERY_CONFIG["indexInterval"]:
+                mtime = os.stat(self._path).st_mtime_ns
+                if mtime != self._mtime:
+                    self.files, self.times, _ = list_times(self._path, self._prefix)
+                    self._mtime = mtime
+                self._indexTime = now
+            files, times = self.files, self.times
+        first = np.searchsorted(times, begin, side="right")
+        last = np.searchsorted(times, end, side="right")
+        return files[first:last], times[first:last]
+
+
+class Piece(NamedTuple):
+    path: str
+    begin: int  # 文件中第一帧的序号
+    end: int
+    frames: int  # 规划时文件中完整的帧数，正在写入的文件只读取完整的帧
+    mtime: int  # 规划时的修改时间，作为缓存的键，单位: ns
+
+
+class ChunkCache:
+    """
+    解码后的数据文件的LRU缓存，按字节数限制大小，键包含规划查询时的修改时间，文件被覆盖或改名后不会读到旧数据
+    只读取规划时的帧数，保证响应长度与响应头一致，文件在规划后被删除或变短时报错
+    """
+
+    def __init__(self, maxBytes: int, metrics: MetricsRegistry):
+        self._maxBytes = maxBytes
+        self._chunks: OrderedDict[tuple[str, int], np.ndarray] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = metrics.counter("das_query_cache_hits_total")
+        self._misses = metrics.counter("das_query_cache_misses_total")
+        self._size = metrics.gauge("das_query_cache_bytes")
+
+    def get(self, piece: Piece, columns: int) -> np.ndarray:
+        key = (piece.path, piece.mtime)
+        with self._lock:
+            data = self._chunks.get(key)
+            if data is not None:
+                self._chunks.move_to_end(key)
+                self._hits.inc()
+                return data
+        with open(piece.path, "rb") as f:
+            if (
+                os.fstat(f.fileno()).st_size
+                < piece.frames * columns * DAS_CONFIG["dtype"].itemsize
+            ):
+                raise ValueError(f"{piece.path}在规划查询后变短")
+            data = np.fromfile(
+                f, dtype=DAS_CONFIG["dtype"], count=piece.frames * columns
+            ).reshape(piece.frames, columns)
+        with self._lock:
+            self._misses.inc()
+            if key not in self._chunks and data.nbytes <= self._maxBytes:
+                self._chunks[key] = data
+                self._bytes += data.nbytes
+                while self._bytes > self._maxBytes:
+                    _, evicted = self._chunks.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+            self._size.set(self._bytes)
+        return data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"chunks": len(self._chunks), "bytes": self._bytes}
+
+
+class Segment(NamedTuple):
+    time: np.datetime64  # 第一帧的时间
+    frames: int  # 降采样前的帧数
+    pieces: list[Piece]
+
+
+class Query:
+    def __init__(self, params: dict[str, list[str]]):
+        def get(key: str, default: str | None = None) -> str:
+            value = params.get(key, [default])[0]
+            if value is None:
+                raise ValueError(f"缺少参数{key}")
+            return value
+
+        self.device = get("device", next(iter(DEVICES)))
+        if self.device not in DEVICES:
+            raise ValueError(f"{self.device}未在DEVICES中定义")
+        self.target = get("target")
+        if self.target not in SAVE_CONFIG["targets"]:
+            raise ValueError(f"{self.target}未在SAVE_CONFIG中定义")
+        self.begin = np.datetime64(datetime.fromisoformat(get("begin")), "ms")
+        self.end = np.datetime64(datetime.fromisoformat(get("end")), "ms")
+        if self.end <= self.begin:
+            raise ValueError("结束时间必须晚于开始时间")
+        validRange = DAS_CONFIG["validPointRange"]
+        default = f"{validRange.start},{validRange.stop},1"
+        start, stop, step = [int(value) for value in get("points", default).split(",")]
+        if not (validRange.start <= start < stop <= validRange.stop and step > 0):
+            raise ValueError(f"{start},{stop},{step}不在有效点位范围内")
+        self.points = [start, stop, step]
+        self.columns = slice(start - validRange.start, stop - validRange.start, step)
+        self.step = int(get("step", "1"))
+        if self.step <= 0:
+            raise ValueError(f"{self.step}不是正整数")
+        self.agg = params.get("agg", [None])[0]
+        if self.agg is not None and self.agg not in QUERY_AGGREGATES:
+            raise ValueError(f"{self.agg}不是{QUERY_AGGREGATES}中的聚合方式")
+        self.rate = DAS_CONFIG["targets"][self.target]["sampleRate"]
+        self.dtype = np.dtype("<f4") if self.agg else DAS_CONFIG["dtype"]
+
+    def rows(self, frames: int) -> int:
+        """一个连续时间段降采样后的帧数，聚合时丢弃末尾不足step帧的部分"""
+        return frames // self.step if self.agg else -(-frames // self.step)
+
+    def plan(self, index: FileIndex) -> list[Segment]:
+        """
+        由文件名和文件大小得到每个文件中所需的帧，相邻文件首尾相接时合并为一个时间段
+        文件大小和修改时间在规划时固定，响应长度由规划结果确定，发送时按规划的帧数读取
+        """
+        interval = SAVE_CONFIG["targets"][self.target]["interval"]
+        # 文件名中的时间为最后一帧之后的时间，结束时间在查询范围之后一个保存间隔内的文件也可能包含所需的数据
+        files, times = index.lookup(
+            self.begin, self.end + np.timedelta64(interval * 1000, "ms")
+        )
+        frameBytes = len(DAS_CONFIG["validPointRange"]) * DAS_CONFIG["dtype"].itemsize
+
+        def frame_index(time: np.datetime64, origin: np.datetime64) -> int:
+            """time之后的第一帧的序号，向上取整到帧"""
+            return -(-int((time - origin).astype(int)) * self.rate // 1000)
+
+        segments: list[Segment] = []
+        lastEnd: np.datetime64 | None = None
+        # 连续文件中的帧按第一个文件的时间和帧序号计时，不受每个文件名毫秒截断的影响
+        origin = self.begin
+        position = 0
+        opened = False
+        for name, fileEnd in zip(files, times):
+            path = os.path.join(DEVICES[self.device]["savePath"], name)
+            stat = os.stat(path)
+            frames = stat.st_size // frameBytes
+            fileBegin = fileEnd - np.timedelta64(round(frames * 1000 / self.rate), "ms")
+            # 与上一个文件的间隔不超过半个保存间隔时视为连续
+            if lastEnd is None or abs((fileBegin - lastEnd).astype(int)) > (
+                interval * 500
+            ):
+                origin, position, opened = fileBegin, 0, False
+            lastEnd = fileEnd
+            first = max(frame_index(self.begin, origin) - position, 0)
+            last = min(frame_index(self.end, origin) - position, frames)
+            position += frames
+            if first >= last:
+                continue
+            piece = Piece(path, first, last, frames, stat.st_mtime_ns)
+            if opened:
+                segment = segments[-1]
+                segments[-1] = segment._replace(
+                    frames=segment.frames + last - first,
+                    pieces=[*segment.pieces, piece],
+                )
+                continue
+            offset = position - frames + first
+            segments.append(
+                Segment(
+                    origin + np.timedelta64(round(offset * 1000 / self.rate), "ms"),
+                    last - first,
+                    [piece],
+                )
+            )
+            opened = True
+        return [segment for segment in segments if self.rows(segment.frames)]
+
+    def stream(self, segments: list[Segment], cache: ChunkCache) -> Iterator[bytes]:
+        """逐个文件切片、降采样，降采样的相位和未满的聚合窗口在时间段内跨文件延续"""
+        columns = len(DAS_CONFIG["validPointRange"])
+        for segment in segments:
+            position = 0
+            carry: np.ndarray | None = None
+            for piece in segment.pieces:
+                data = cache.get(piece, columns)[piece.begin : piece.end, self.columns]
+                if self.agg is None:
+                    output = data[(-position) % self.step :: self.step]
+                    position += len(data)
+                else:
+                    if carry is not None:
+                        data = np.concatenate((carry, data))
+                    windows = len(data) // self.step
+                    output = aggregate(
+                        data[: windows * self.step].reshape(
+                            windows, self.step, data.shape[1]
+                        ),
+                        self.agg,
+                    )
+                    carry = data[windows * self.step :]
+                if len(output):
+                    yield np.ascontiguousarray(output, dtype=self.dtype).tobytes()
+
+
+def aggregate(windows: np.ndarray, agg: str) -> np.ndarray:
+    """windows为(窗口数, 每个窗口的帧数, 点位数)"""
+    if agg == "mean":
+        return windows.mean(axis=1, dtype=np.float32)
+    if agg == "rms":
+        return np.sqrt(np.square(windows, dtype=np.float32).mean(axis=1))
+    if agg == "min":
+        return windows.min(axis=1).astype(np.float32)
+    if agg == "max":
+        return windows.max(axis=1).astype(np.float32)
+    return np.abs(windows.astype(np.float32)).max(axis=1)
+
+
+class QueryServer:
+    """通过HTTP提供保存的历史数据，解码后的文件在所有查询之间共享缓存"""
+
+    def __init__(self, metrics: MetricsRegistry):
+        self._metrics = metrics
+        self._cache = ChunkCache(QUERY_CONFIG["cacheSize"], metrics)
+        self._indexes: dict[tuple[str, str], FileIndex] = {}
+        self._indexLock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    def index(self, device: str, target: str) -> FileIndex:
+        with self._indexLock:
+            if (device, target) not in self._indexes:
+                self._indexes[(device, target)] = FileIndex(
+                    DEVICES[device]["savePath"],
+                    SAVE_CONFIG["targets"][target]["prefix"],
+                )
+            return self._indexes[(device, target)]
+
+    def start(self):
+        server = self
+        metrics = self._metrics
+        requests = metrics.counter("das_query_requests_total")
+        errors = metrics.counter("das_query_errors_total")
+        sentBytes = metrics.counter("das_query_bytes_total")
+        latency = metrics.histogram("das_query_seconds")
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, code: int, value: dict):
+                body = json.dumps(value, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/metrics":
+                    body = metrics.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if url.path == "/stats":
+                    snapshot = metrics.snapshot()
+                    hits = snapshot["das_query_cache_hits_total"]
+                    misses = snapshot["das_query_cache_misses_total"]
+                    self.send_json(
+                        200,
+                        {
+                            **server._cache.stats(),
+                            "hitRatio": hits / (hits + misses) if hits + misses else 0,
+                            "requests": snapshot["das_query_requests_total"],
+                            "latency": snapshot["das_query_seconds"],
+                        },
+                    )
+                    return
+                if url.path != "/query":
+                    self.send_error(404)
+                    return
+                beginTime = time.perf_counter()
+                # 指标序列由多个线程写入，计数时加锁
+                with lock:
+                    requests.inc()
+                try:
+                    query = Query(parse_qs(url.query))
+                    segments = query.plan(server.index(query.device, query.target))
+                except (ValueError, OSError) as e:
+                    with lock:
+                        errors.inc()
+                    self.send_json(400, {"error": str(e)})
+                    return
+                columns = len(range(*query.points))
+                meta = {
+                    "dtype": query.dtype.str,
+                    "columns": columns,
+                    "points": query.points,
+                    "rate": query.rate / query.step,
+                    "segments": [
+                        [
+                            np.datetime_as_string(segment.time, unit="ms"),
+                            query.rows(segment.frames),
+                        ]
+                        for segment in segments
+                    ],
+                }
+                header = json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\n"
+                length = (
+                    len(header)
+                    + sum(query.rows(segment.frames) for segment in segments)
+                    * columns
+                    * query.dtype.itemsize
+                )
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(length))
+                self.end_headers()
+                self.wfile.write(header)
+                try:
+                    for chunk in query.stream(segments, server._cache):
+                        self.wfile.write(chunk)
+                except ConnectionError as e:
+                    log.warning("查询中断: %s", e)
+                    with lock:
+                        errors.inc()
+                    self.close_connection = True
+                    return
+                except (OSError, ValueError) as e:
+                    # 已发送响应头，只能断开连接，客户端读到的数据少于Content-Length
+                    log.error("数据文件在发送期间被改名、删除或覆盖，响应不完整: %s", e)
+                    with lock:
+                        errors.inc()
+                    self.close_connection = True
+                    return
+                with lock:
+                    sentBytes.inc(length)
+                    latency.observe(time.perf_counter() - beginTime)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(
+            (QUERY_CONFIG["host"], QUERY_CONFIG["port"]), Handler
+        )
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        log.info(
+            "查询服务已启动: http://%s:%s/query",
+            QUERY_CONFIG["host"],
+            QUERY_CONFIG["port"],
+        )
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def serve_query(
+    metrics: MetricsRegistry, exit_event: multiprocessing.synchronize.Event
+):
+    server = QueryServer(metrics)
+    server.start()
+    exit_event.wait()
+    server.stop()
+
+
+if __name__ == "__main__":
+    # 单独运行时查询已保存的数据，不需要启动数据接收
+    parser = argparse.ArgumentParser(description="历史数据查询服务")
+    parser.add_argument("--host", default=QUERY_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=QUERY_CONFIG["port"])
+    args = parser.parse_args()
+    QUERY_CONFIG["host"], QUERY_CONFIG["port"] = args.host, args.port
+    server = QueryServer(MetricsRegistry())
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta
+import os
+from typing import Any
+import numpy as np
+from config import DAS_CONFIG, REGION_CONFIG, SAVE_CONFIG
+from utils import DataBuffer, log, butter_bandpass_sos
+
+
+class Region:
+    """单个感兴趣区域，保存区域的点位切片、降采样率以及各环节的流式状态"""
+
+    def __init__(self, name: str, params: dict[str, Any], savePath: str):
+        self.name = name
+        self.target: str = params["target"]
+        points: range = params["points"]
+        start = points.start - DAS_CONFIG["validPointRange"].start
+        self.columns = slice(start, start + len(points))
+        self.points = points
+        self.decimation: int = params["decimation"]
+        self.source: str = params["source"]
+        self.stages: dict[str, dict[str, Any]] = params["stages"]
+        self.sampleRate = DAS_CONFIG["targets"][self.target]["sampleRate"]
+
+        self._sos = None
+        self._zi = None
+        if "filter" in self.stages:
+            stage = self.stages["filter"]
+            self._sos = butter_bandpass_sos(
+                stage["lowcut"], stage["highcut"], self.sampleRate, stage["order"]
+            )
+            self._zi = np.zeros((self._sos.shape[0], 2, len(points)))
+        if "save" in self.stages and SAVE_CONFIG["enable"]:
+            self.savePath = os.path.join(savePath, name)
+            os.makedirs(self.savePath, exist_ok=True)
+        # FFT的频率轴，数据块长度不变时复用
+        self.frequencies: np.ndarray | None = None
+
+    def reset(self):
+        """数据块不相接时清零滤波器状态"""
+        if self._zi is not None:
+            self._zi[:] = 0
+
+    def extract(self, block: np.ndarray) -> np.ndarray:
+        """从数据块中取出本区域的数据，无滤波且不降采样时返回视图不复制"""
+        data = block[:, self.columns]
+        if self._sos is not None:
+            from scipy.signal import sosfilt
+
+            # 全速率滤波后再抽取，同时起到抗混叠作用
+            data, self._zi = sosfilt(self._sos, data, axis=0, zi=self._zi)
+            data = data.astype(np.float32, copy=False)
+        if self.decimation > 1 and self._sos is None:
+            # 无滤波时按块平均后抽取，避免混叠
+            data = data.reshape(-1, self.decimation, data.shape[1]).mean(
+                axis=1, dtype=np.float32
+            )
+        elif self.decimation > 1:
+            data = data[:: self.decimation]
+        return data
+
+
+class RegionEngine:
+    """
+    感兴趣区域处理引擎
+    每个区域只处理自己的点位范围，按各自的降采样率和启用的环节运行，计算量与监测长度成正比
+    """
+
+    def __init__(self, savePath: str):
+        """savePath为设备的数据保存路径，区域数据保存在其下以区域名命名的子文件夹中"""
+        self.regions: dict[str, list[Region]] = {}
+        for name, params in REGION_CONFIG["regions"].items():
+            self.regions.setdefault(params["target"], []).append(
+                Region(name, params, savePath)
+            )
+        self.eventListener = []
+
+    def on(self, name, callback):
+        if name == "event":
+            self.eventListener.append(callback)
+        else:
+            raise ValueError(f"Unknown event name {name}")
+
+    def off(self, name, callback):
+        if name == "event":
+            self.eventListener.remove(callback)
+        else:
+            raise ValueError(f"Unknown event name {name}")
+
+    def reset(self, name: str):
+        """name的数据块不相接时重置其所有区域的流式状态"""
+        for region in self.regions.get(name, []):
+            region.reset()
+
+    def process(
+        self,
+        name: str,
+        dataBuffer: DataBuffer,
+        recordTime: datetime,
+        source: str = "phys",
+    ):
+        """处理一个float32数据块，只运行数据来源为source的区域"""
+        if name not in self.regions:
+            return
+        block = np.frombuffer(dataBuffer["buffer"], dtype=np.float32).reshape(
+            -1, len(DAS_CONFIG["validPointRange"])
+        )
+        with dataBuffer["lock"]:
+            for region in self.regions[name]:
+                if region.source != source:
+                    continue
+                data = region.extract(block)
+                if "fft" in region.stages:
+                    self.fft(region, data, recordTime)
+                if "detection" in region.stages:
+                    self.detect(region, data, recordTime)
+                if "save" in region.stages and SAVE_CONFIG["enable"]:
+                    self.save(region, data, recordTime)
+
+    def emit(self, event: dict):
+        for callback in self.eventListener:
+            callback(event)
+
+    def fft(self, region: Region, data: np.ndarray, recordTime: datetime):
+        """每个点位的主频(不含直流分量)和幅值作为频谱事件发布"""
+        sampleRate = region.sampleRate / region.decimation
+        spectrum = np.abs(np.fft.rfft(data, axis=0)) / len(data)
+        if region.frequencies is None or len(region.frequencies) != len(spectrum):
+            region.frequencies = np.fft.rfftfreq(len(data), 1 / sampleRate)
+        peaks = np.argmax(spectrum[1:], axis=0) + 1
+        self.emit(
+            {
+                "kind": "spectrum",
+                "region": region.name,
+                "time": recordTime,
+                "points": list(region.points),
+                "frequency": region.frequencies[peaks].tolist(),
+                "amplitude": spectrum[peaks, np.arange(len(peaks))].tolist(),
+            }
+        )
+
+    def detect(self, region: Region, data: np.ndarray, recordTime: datetime):
+        stage = region.stages["detection"]
+        rms = np.sqrt(np.mean(np.square(data, dtype=np.float32), axis=0))
+        triggered = np.flatnonzero(rms > stage["threshold"])
+        if not len(triggered):
+            return
+        event = {
+            "kind": "detection",
+            "region": region.name,
+            "time": recordTime,
+            "points": [region.points[i] for i in triggered],
+            "rms": rms[triggered].tolist(),
+        }
+        log.warning(
+            "区域 %s 检测到事件: %d个点位超过阈值, 最大RMS: %.4f",
+            region.name,
+            len(triggered),
+            rms.max(),
+        )
+        self.emit(event)
+
+    def save(self, region: Region, data: np.ndarray, recordTime: datetime):
+        interval = timedelta(seconds=len(data) * region.decimation / region.sampleRate)
+        if not (
+            SAVE_CONFIG["begin"] - interval
+            <= recordTime
+            <= SAVE_CONFIG["end"] + interval
+        ):
+            return
+        prefix = region.stages["save"]["prefix"]
+        filePath = f"{region.savePath}/{prefix}{recordTime.strftime('%Y-%m-%d_%H-%M-%S.%f')[:-3]}.dat"
+        if os.path.exists(filePath):
+            log.warning("文件 %s 已存在，跳过保存", filePath)
+            return
+        with open(filePath, "wb") as f:
+            os.write(f.fileno(), np.ascontiguousarray(data, dtype=np.float32))
@@ -0,0 +1,59 @@
+import ctypes
+from multiprocessing import RawArray, RawValue
+import numpy as np
+
+
+class SeqLockBuffer:
+    """
+    单写多读的顺序锁共享缓冲区
+    写入前后各将序号加1，写入过程中序号为奇数；读者复制前后序号一致且为偶数时数据才完整，否则重试。
+    写者从不等待读者，适合只关心最新值的场景
+    """
+
+    MAX_RETRIES = 100
+
+    def __init__(self, size: int):
+        self.buffer = RawArray(ctypes.c_byte, size)
+        self._sequence = RawValue(ctypes.c_uint64, 0)
+        # 读者已取走的写入次数，写者可据此判断是否需要累积未被读取的数据，多个读者时每个读者使用各自的缓冲区
+        self._acknowledged = RawValue(ctypes.c_uint64, 0)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def sequence(self) -> int:
+        """已完成的写入次数"""
+        return self._sequence.value // 2
+
+    @property
+    def acknowledged(self) -> int:
+        return self._acknowledged.value
+
+    def acknowledge(self, sequence: int):
+        self._acknowledged.value = sequence
+
+    def write(self, data):
+        """写入与缓冲区等长的数据(支持缓冲区协议的对象)"""
+        src = np.frombuffer(data, dtype=np.uint8, count=len(self.buffer))
+        dst = np.frombuffer(self.buffer, dtype=np.uint8)
+        sequence = self._sequence.value
+        self._sequence.value = sequence + 1
+        np.copyto(dst, src)
+        self._sequence.value = sequence + 2
+
+    def read(self, out) -> int | None:
+        """
+        复制最新数据到out(支持缓冲区协议的可写对象)，返回对应的写入次数
+        多次重试仍被写入打断时返回None，out的内容不可用
+        """
+        src = np.frombuffer(self.buffer, dtype=np.uint8)
+        dst = np.frombuffer(out, dtype=np.uint8, count=len(self.buffer))
+        for _ in range(self.MAX_RETRIES):
+            before = self._sequence.value
+            if before & 1:
+                continue
+            np.copyto(dst, src)
+            if self._sequence.value == before:
+                return before // 2
+        return None
@@ -0,0 +1,390 @@
+import argparse
+from datetime import datetime
+import glob
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LOOPBACK = "127.0.0.1"
+METRIC_PATTERN = re.compile(r"^(?P<name>\w+)(?:\{(?P<labels>[^}]*)\})? (?P<value>\S+)$")
+FILE_TIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.\d{3}")
+# 占满一个CPU核的干扰进程，模拟绘图或磁盘写入突增时接收进程被调度出去
+STRESS_CODE = "while True: pass"
+
+
+def free_port(kind: int) -> int:
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind((LOOPBACK, 0))
+        return s.getsockname()[1]
+
+
+def parse_metrics(text: str) -> dict[str, dict[str, float]]:
+    """Prometheus文本格式 -> {指标名: {标签: 值}}"""
+    result: dict[str, dict[str, float]] = {}
+    for line in text.splitlines():
+        match = METRIC_PATTERN.match(line)
+        if match is None:
+            continue
+        result.setdefault(match["name"], {})[match["labels"] or ""] = float(
+            match["value"]
+        )
+    return result
+
+
+def histogram_summary(
+    metrics: dict[str, dict[str, float]],
+    name: str,
+    target: str,
+    consumer: str | None = None,
+) -> dict[str, float] | None:
+    """由分桶计数估计均值和99分位数(取所在分桶的上界)"""
+    label = f'target="{target}"'
+    if consumer is not None:
+        label += f',consumer="{consumer}"'
+    count = metrics.get(f"{name}_count", {}).get(label, 0)
+    if not count:
+        return None
+    buckets = []
+    for labels, value in metrics[f"{name}_bucket"].items():
+        if labels.startswith(label):
+            bound = labels.split('le="')[1].rstrip('"')
+            buckets.append((float(bound), value))
+    buckets.sort()
+    p99 = next(bound for bound, value in buckets if value >= count * 0.99)
+    return {
+        "count": count,
+        "mean": metrics[f"{name}_sum"][label] / count,
+        "p99": p99,
+    }
+
+
+class ProcessSampler:
+    """采样主进程及其子进程的CPU占用和常驻内存，没有psutil时读取/proc(仅Linux)"""
+
+    def __init__(self, pid: int):
+        self._pid = pid
+        self._clockTicks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._first: dict[int, tuple[float, float]] = {}
+        self._last: dict[int, tuple[float, float]] = {}
+        self._maxRss: dict[int, int] = {}
+
+    def _pids(self) -> list[int]:
+        if psutil is not None:
+            try:
+                process = psutil.Process(self._pid)
+                return [self._pid] + [p.pid for p in process.children(recursive=True)]
+            except psutil.NoSuchProcess:
+                return []
+        pids, index = [self._pid], 0
+        while index < len(pids):
+            for path in glob.glob(f"/proc/{pids[index]}/task/*/children"):
+                with open(path) as f:
+                    pids.extend(int(pid) for pid in f.read().split())
+            index += 1
+        return pids
+
+    def _read(self, pid: int) -> tuple[float, int] | None:
+        """返回(累计CPU时间, 常驻内存字节数)"""
+        if psutil is not None:
+            try:
+                process = psutil.Process(pid)
+                times = process.cpu_times()
+                return times.user + times.system, process.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                return None
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                pages = int(f.read().split()[1])
+        except (OSError, IndexError):
+            return None
+        cpu = (int(fields[11]) + int(fields[12])) / self._clockTicks
+        return cpu, pages * os.sysconf("SC_PAGE_SIZE")
+
+    def sample(self):
+        now = time.monotonic()
+        for pid in self._pids():
+            value = self._read(pid)
+            if value is None:
+                continue
+            cpu, rss = value
+            self._first.setdefault(pid, (now, cpu))
+            self._last[pid] = (now, cpu)
+            self._maxRss[pid] = max(self._maxRss.get(pid, 0), rss)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        result = {}
+        for pid, (firstTime, firstCpu) in self._first.items():
+            lastTime, lastCpu = self._last[pid]
+            if lastTime <= firstTime:
+                continue
+            role = "main" if pid == self._pid else f"child-{pid}"
+            result[role] = {
+                "cpu": (lastCpu - firstCpu) / (lastTime - firstTime) * 100,
+                "maxRssMB": self._maxRss[pid] / 2**20,
+            }
+        return result
+
+
+def udp_receive_errors() -> int | None:
+    """系统累计的UDP接收缓冲区溢出次数(仅Linux)，用于确认丢帧发生在内核中"""
+    try:
+        with open("/proc/net/snmp") as f:
+            header, values = [line.split() for line in f if line.startswith("Udp:")]
+    except (OSError, ValueError):
+        return None
+    return int(values[header.index("RcvbufErrors")])
+
+
+def write_lag(saveDir: str) -> dict[str, float] | None:
+    """文件修改时间与文件名中数据时间之差，反映排队和写入的总延迟"""
+    lags = []
+    for path in glob.glob(os.path.join(saveDir, "*.dat")):
+        match = FILE_TIME_PATTERN.search(os.path.basename(path))
+        if match is None:
+            continue
+        fileTime = datetime.strptime(match.group(), "%Y-%m-%d_%H-%M-%S.%f")
+        lags.append(os.path.getmtime(path) - fileTime.timestamp())
+    if not lags:
+        return None
+    return {"files": len(lags), "mean": sum(lags) / len(lags), "max": max(lags)}
+
+
+def soak(
+    duration: float,
+    sampleRate: int | None,
+    dataSize: int | None,
+    loss: float,
+    reorder: float,
+    saveRoot: str | None,
+    keep: bool = False,
+    lowLatency: bool = False,
+    stress: int = 0,
+) -> dict:
+    remotePort = free_port(socket.SOCK_DGRAM)
+    localPort = free_port(socket.SOCK_DGRAM)
+    metricsPort = free_port(socket.SOCK_STREAM)
+    workDir = tempfile.mkdtemp(prefix="das_soak_", dir=saveRoot)
+    saveDir = os.path.join(workDir, "data")
+    os.makedirs(saveDir)
+    reportPath = os.path.join(workDir, "simulator.json")
+    env = {
+        **os.environ,
+        "DAS_REMOTE_ADDRESS": f"{LOOPBACK}:{remotePort}",
+        "DAS_LOCAL_ADDRESS": f"{LOOPBACK}:{localPort}",
+        "DAS_SAVE_PATH": saveDir,
+        "DAS_METRICS_PORT": str(metricsPort),
+        "DAS_HEADLESS": "1",
+        "DAS_LOW_LATENCY": "1" if lowLatency else "0",
+    }
+    if sampleRate:
+        env["DAS_SAMPLE_RATE"] = str(sampleRate)
+    if dataSize:
+        env["DAS_DATA_SIZE"] = str(dataSize)
+
+    simulator = subprocess.Popen(
+        [
+            sys.executable,
+            "das_simulator.py",
+            "--loss",
+            str(loss),
+            "--reorder",
+            str(reorder),
+            "--report",
+            reportPath,
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    time.sleep(1)
+    pipeline = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=ROOT, env=env, stdout=subprocess.DEVNULL
+    )
+    stressors = [
+        subprocess.Popen([sys.executable, "-c", STRESS_CODE]) for _ in range(stress)
+    ]
+    sampler = ProcessSampler(pipeline.pid)
+    receiveErrors = udp_receive_errors()
+    print(
+        f"运行{duration}s, {'低延迟' if lowLatency else '普通'}模式, 干扰进程{stress}个, 临时目录: {workDir}"
+    )
+    try:
+        endTime = time.monotonic() + duration
+        while time.monotonic() < endTime:
+            if pipeline.poll() is not None:
+                raise RuntimeError(f"main.py异常退出，返回值{pipeline.returncode}")
+            sampler.sample()
+            time.sleep(1)
+        # 先停止发送，等待已发出的数据处理完再读取指标
+        simulator.send_signal(signal.SIGINT)
+        simulator.wait(10)
+        time.sleep(2)
+        with urllib.request.urlopen(
+            f"http://{LOOPBACK}:{metricsPort}/metrics", timeout=5
+        ) as response:
+            metrics = parse_metrics(response.read().decode("utf-8"))
+        if receiveErrors is not None:
+            receiveErrors = udp_receive_errors() - receiveErrors  # type: ignore
+    finally:
+        for process in stressors:
+            process.kill()
+        for process in (pipeline, simulator):
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in (pipeline, simulator):
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    with open(reportPath, "r", encoding="utf-8") as f:
+        simulated = json.load(f)
+    targets = {}
+    for name, sent in simulated["sent"].items():
+        label = f'target="{name}"'
+        received = metrics["das_frames_received_total"].get(label, 0)
+        targets[name] = {
+            "sent": sent,
+            "injectedLoss": simulated["dropped"][name],
+            "received": received,
+            "lossRate": 1 - received / sent if sent else 0,
+            # 模拟器实际达到的发送速率，低于配置的采样率时瓶颈在模拟器
+            "sendRate": (sent + simulated["dropped"][name]) / simulated["elapsed"],
+            "reportedLost": metrics["das_frames_lost_total"].get(label, 0),
+            "blockLatency": histogram_summary(
+                metrics, "das_block_handoff_seconds", name, "saver"
+            ),
+            "ringOverflow": metrics.get("das_ring_overflow_frames_total", {}).get(
+                label, 0
+            ),
+            "skipped": {
+                labels.split('consumer="')[1].rstrip('"'): value
+                for labels, value in metrics.get("das_blocks_skipped_total", {}).items()
+                if labels.startswith(f"{label},")
+            },
+            "fileWrite": histogram_summary(metrics, "das_file_write_seconds", name),
+        }
+    lag = write_lag(saveDir)
+    if not keep:
+        shutil.rmtree(workDir, ignore_errors=True)
+    return {
+        "duration": duration,
+        "sampleRate": sampleRate,
+        "dataSize": dataSize,
+        "lowLatency": lowLatency,
+        "stress": stress,
+        "targets": targets,
+        "udpReceiveErrors": receiveErrors,
+        "parseErrors": sum(metrics.get("das_parse_errors_total", {}).values()),
+        "processes": sampler.summary(),
+        "writeLag": lag,
+    }
+
+
+def report(result: dict):
+    for name, target in result["targets"].items():
+        print(
+            f"{name}: 模拟器发送速率 {target['sendRate']:.0f}Hz, 发送 {target['sent']}, 接收 {target['received']:.0f}, 丢帧率 {target['lossRate']*100:.4f}%, 程序统计丢帧 {target['reportedLost']:.0f}, 注入丢帧 {target['injectedLoss']}"
+        )
+        print(
+            f"  环形缓冲区溢出丢帧 {target['ringOverflow']:.0f}, 跳过的数据块 {target['skipped']}"
+        )
+        if target["blockLatency"]:
+            print(
+                f"  数据块延迟: 均值 {target['blockLatency']['mean']*1000:.2f}ms, p99 <= {target['blockLatency']['p99']*1000:.1f}ms"
+            )
+        if target["fileWrite"]:
+            print(
+                f"  文件写入: 均值 {target['fileWrite']['mean']*1000:.2f}ms, p99 <= {target['fileWrite']['p99']*1000:.1f}ms"
+            )
+    print(f"无效命令: {result['parseErrors']:.0f}")
+    if result["udpReceiveErrors"] is not None:
+        print(f"系统UDP接收缓冲区溢出: {result['udpReceiveErrors']}")
+    if result["writeLag"]:
+        print(
+            f"文件滞后: {result['writeLag']['files']}个文件, 均值 {result['writeLag']['mean']:.3f}s, 最大 {result['writeLag']['max']:.3f}s"
+        )
+    for role, process in result["processes"].items():
+        print(
+            f"{role}: CPU {process['cpu']:.1f}%, 最大常驻内存 {process['maxRssMB']:.1f}MB"
+        )
+
+
+def compare(normal: dict, lowLatency: dict):
+    """对比普通模式和低延迟模式的丢帧"""
+    print("低延迟模式对比:")
+    for name, target in normal["targets"].items():
+        before = target["lossRate"]
+        after = lowLatency["targets"][name]["lossRate"]
+        reduction = f", 减少 {(1 - after / before) * 100:.1f}%" if before > 0 else ""
+        print(f"  {name}: 丢帧率 {before*100:.4f}% -> {after*100:.4f}%{reduction}")
+    if normal["udpReceiveErrors"] is not None:
+        print(
+            f"  系统UDP接收缓冲区溢出: {normal['udpReceiveErrors']} -> {lowLatency['udpReceiveErrors']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="使用DAS模拟器在本机回环上运行完整流程"
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=60, help="运行时长，单位: 秒"
+    )
+    parser.add_argument("--sample-rate", type=int, help="振动解调数据采样率")
+    parser.add_argument("--data-size", type=int, help="每帧点数")
+    parser.add_argument("--loss", type=float, default=0, help="模拟器主动丢帧比例")
+    parser.add_argument("--reorder", type=float, default=0, help="模拟器相邻帧乱序比例")
+    parser.add_argument("--tmp", help="保存数据的临时目录所在位置")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录中保存的数据")
+    parser.add_argument(
+        "--low-latency", action="store_true", help="以低延迟模式运行接收进程"
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="依次以普通模式和低延迟模式运行，输出丢帧的变化",
+    )
+    parser.add_argument("--stress", type=int, default=0, help="占满CPU核的干扰进程数")
+    parser.add_argument("-o", "--output", help="结果保存路径(JSON)")
+    args = parser.parse_args()
+
+    results = {}
+    modes = [False, True] if args.compare else [args.low_latency]
+    for lowLatency in modes:
+        result = soak(
+            args.duration,
+            args.sample_rate,
+            args.data_size,
+            args.loss,
+            args.reorder,
+            args.tmp,
+            args.keep,
+            lowLatency,
+            args.stress,
+        )
+        report(result)
+        results["lowLatency" if lowLatency else "normal"] = result
+    output = result
+    if args.compare:
+        compare(results["normal"], results["lowLatency"])
+        output = results
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,168 @@
+import ctypes
+import math
+from multiprocessing import RawArray, RawValue
+import numpy as np
+from command import RecvCommand
+from config import DAS_CONFIG, SOUND_CONFIG
+from metrics import Histogram, MetricsRegistry
+from profiling import timed
+from utils import log, butter_bandpass_sos
+
+# 点位读取与切换冲突时的最大重试次数，仍失败则沿用旧点位，不阻塞接收进程
+SOUND_POINT_RETRIES = 3
+
+
+class SoundMonitor:
+    """
+    低延迟声音监听
+    接收进程逐帧写入单生产者单消费者的无锁环形缓冲区，声卡回调线程按小块读取并流式滤波。
+    监听点位保存在共享内存中，任意持有该对象的进程都可以在运行时切换或混合多个点位。
+    """
+
+    def __init__(self, metrics: MetricsRegistry):
+        self._target = SOUND_CONFIG["target"]
+        self._sampleRate = DAS_CONFIG["targets"][self._target]["sampleRate"]
+        # 环形缓冲区容量取2的幂，便于用位运算取模
+        self._capacity = 1 << math.ceil(
+            math.log2(self._sampleRate * SOUND_CONFIG["ringTime"])
+        )
+        self._ring = RawArray(ctypes.c_float, self._capacity)
+        # 读写索引单调递增，仅由各自的一端修改
+        self._writeIndex = RawValue(ctypes.c_uint64, 0)
+        self._readIndex = RawValue(ctypes.c_uint64, 0)
+        self._points = RawArray(ctypes.c_int32, SOUND_CONFIG["maxMixPoints"])
+        self._pointCount = RawValue(ctypes.c_int32, 0)
+        # 点位版本号，写入过程中为奇数
+        self._pointVersion = RawValue(ctypes.c_uint32, 0)
+        self.set_points([SOUND_CONFIG["point"]])
+
+        # 生产者状态
+        self._cachedVersion = -1
+        self._cachedPoints = np.zeros(0, dtype=np.intp)
+        self._droppedSamples = metrics.counter("das_sound_dropped_samples_total")
+        # 消费者状态
+        self._stream = None
+        self._sos = None
+        self._zi = None
+        # scipy在start中导入，声卡回调线程中不再导入模块
+        self._sosfilt = None
+        self._sosfiltZi = None
+        self._filterVersion = -1
+        self._primed = False
+        self._chunk = None
+
+    @property
+    def points(self) -> list[int]:
+        return list(self._points[: self._pointCount.value])
+
+    def set_points(self, points: list[int]):
+        """切换监听点位，传入多个点位时取平均混合"""
+        if not 0 < len(points) <= SOUND_CONFIG["maxMixPoints"]:
+            raise ValueError(f"监听点位数量必须在1到{SOUND_CONFIG['maxMixPoints']}之间")
+        for point in points:
+            if point not in DAS_CONFIG["validPointRange"]:
+                raise ValueError(f"{point}不在有效点位范围内")
+        self._pointVersion.value += 1
+        for i, point in enumerate(points):
+            self._points[i] = point
+        self._pointCount.value = len(points)
+        self._pointVersion.value += 1
+        log.info("监听点位: %s", points)
+
+    def on_command(self, cmd: RecvCommand):
+        if cmd.name != self._target:
+            return
+        version = self._pointVersion.value
+        # 点位切换进行中时沿用旧点位，复制后版本号变化说明读到了写入一半的点位，重新读取
+        for _ in range(SOUND_POINT_RETRIES):
+            if version == self._cachedVersion or version % 2:
+                break
+            points = np.array(self._points[: self._pointCount.value], dtype=np.intp)
+            current = self._pointVersion.value
+            if current == version:
+                self._cachedPoints = points
+                self._cachedVersion = version
+                break
+            version = current
+        frame = np.frombuffer(cmd.body, dtype=DAS_CONFIG["dtype"])
+        if len(self._cachedPoints) == 1:
+            sample = frame[self._cachedPoints[0]]
+        else:
+            sample = frame[self._cachedPoints].mean()
+
+        writeIndex = self._writeIndex.value
+        # 缓冲区满时丢弃新数据，不覆盖消费者尚未读取的部分
+        if writeIndex - self._readIndex.value >= self._capacity:
+            self._droppedSamples.inc()
+            return
+        self._ring[writeIndex & (self._capacity - 1)] = sample
+        self._writeIndex.value = writeIndex + 1
+
+    def _read(self, out: np.ndarray) -> int:
+        ring = np.frombuffer(self._ring, dtype=np.float32)
+        readIndex = self._readIndex.value
+        available = self._writeIndex.value - readIndex
+        latencySamples = int(self._sampleRate * SOUND_CONFIG["latency"])
+        # 积压超过两倍目标延迟时跳过旧数据，保持延迟有界
+        if available > 2 * latencySamples:
+            readIndex += available - latencySamples
+            available = latencySamples
+        # 欠载后需重新积累到目标延迟再播放，避免断续
+        if not self._primed:
+            if available < latencySamples:
+                self._readIndex.value = readIndex
+                return 0
+            self._primed = True
+        n = min(len(out), available)
+        begin = readIndex & (self._capacity - 1)
+        first = min(n, self._capacity - begin)
+        out[:first] = ring[begin : begin + first]
+        out[first:n] = ring[: n - first]
+        self._readIndex.value = readIndex + n
+        if n < len(out):
+            self._primed = False
+        return n
+
+    def _callback(self, outdata: np.ndarray, frames: int, time, status):
+        if self._chunk is None or len(self._chunk) < frames:
+            self._chunk = np.zeros(frames, dtype=np.float32)
+        chunk = self._chunk[:frames]
+        n = self._read(chunk)
+        chunk[n:] = 0
+        # 点位切换后重置滤波器状态，避免旧点位的瞬态串入
+        version = self._pointVersion.value
+        if version != self._filterVersion:
+            self._zi = self._sosfiltZi(self._sos) * (chunk[0] if n else 0)
+            self._filterVersion = version
+        data, self._zi = self._sosfilt(self._sos, chunk, zi=self._zi)
+        # 绝对值大于最大值的数据置零
+        data[np.abs(data) > SOUND_CONFIG["max"]] = 0
+        # 数据缩放到[-1, 1]之间
+        outdata[:, 0] = data / SOUND_CONFIG["max"]
+
+    def start(self, callbackTimer: Histogram | None = None):
+        """在消费者进程中打开声卡输出流，callbackTimer不为None时统计声卡回调的耗时"""
+        import sounddevice as sd
+        from scipy.signal import sosfilt, sosfilt_zi
+
+        self._sosfilt, self._sosfiltZi = sosfilt, sosfilt_zi
+        self._sos = butter_bandpass_sos(
+            SOUND_CONFIG["lowcut"],
+            SOUND_CONFIG["highcut"],
+            self._sampleRate,
+            order=SOUND_CONFIG["order"],
+        )
+        self._stream = sd.OutputStream(
+            samplerate=self._sampleRate,
+            channels=1,
+            dtype=np.float32,
+            blocksize=SOUND_CONFIG["blocksize"],
+            latency=SOUND_CONFIG["latency"],
+            callback=timed(self._callback, callbackTimer),
+        )
+        self._stream.start()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import json
+import numpy as np
+from stream_server import (
+    MSG_AGG,
+    MSG_EVENT,
+    MSG_FRAME,
+    MSG_HELLO,
+    MSG_SUBSCRIBE,
+    POINTS,
+    pack_message,
+    read_message,
+)
+
+# 实时数据流的参考客户端，订阅后打印每条消息的摘要
+
+
+async def main(args):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    msgType, _, _, payload = await read_message(reader)
+    if msgType != MSG_HELLO:
+        raise ValueError(f"Unexpected message type {msgType}")
+    hello = json.loads(payload)
+    print(f"数据源: {hello['targets']}, 点位范围: {hello['points']}")
+    subscription = {
+        "target": args.target or hello["targets"][0],
+        "rate": args.rate,
+        "kinds": args.kinds,
+    }
+    if args.points:
+        subscription["points"] = args.points
+    writer.write(pack_message(MSG_SUBSCRIBE, 0, json.dumps(subscription).encode()))
+    await writer.drain()
+
+    while True:
+        msgType, targetId, timestamp, payload = await read_message(reader)
+        if msgType == MSG_EVENT:
+            print(f"[{timestamp:.3f}] 事件: {json.loads(payload)}")
+            continue
+        if msgType not in (MSG_FRAME, MSG_AGG):
+            continue
+        start, step, count = POINTS.unpack_from(payload)
+        data = np.frombuffer(payload, np.float32, offset=POINTS.size)
+        data = data.reshape(-1, count)
+        name = hello["targets"][targetId]
+        if msgType == MSG_FRAME:
+            print(
+                f"[{timestamp:.3f}] {name} 最新值: 点位{start}起步长{step}共{count}点, 范围[{data.min():.3f}, {data.max():.3f}]"
+            )
+        else:
+            print(
+                f"[{timestamp:.3f}] {name} 区间统计: 最大绝对值{data[0].max():.3f}, 平均RMS{data[1].mean():.3f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="实时数据流客户端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--target", help="数据源名称，默认为第一个")
+    parser.add_argument(
+        "--points", type=int, nargs=3, metavar=("START", "STOP", "STEP")
+    )
+    parser.add_argument("--rate", type=float, default=10, help="发送速率，单位: Hz")
+    parser.add_argument(
+        "--kinds", nargs="+", default=["frame", "agg", "event"], help="订阅的消息类型"
+    )
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,309 @@
+import asyncio
+from collections import deque
+import json
+import multiprocessing.queues
+import multiprocessing.synchronize
+import queue
+import struct
+import time
+import numpy as np
+from config import DAS_CONFIG, PLOT_AGGREGATES, STREAM_CONFIG
+from converter import PhysicalConverter
+from seqlock import SeqLockBuffer
+from utils import log
+
+# 实时数据流协议
+# 所有消息均为 头部 + 负载，头部为HEADER: 魔数, 消息类型, 数据源序号, 负载长度, 时间戳(秒)
+# - HELLO(服务端→客户端): JSON，包含数据源列表、点位范围和单位
+# - SUBSCRIBE(客户端→服务端): JSON，{"target": 名称, "points": [start, stop, step], "rate": Hz, "kinds": ["frame", "agg", "event"]}，
+#   每个数据源只保留一个订阅，重复订阅同一数据源时替换原订阅
+# - UNSUBSCRIBE(客户端→服务端): JSON，{"target": 名称}，取消该数据源的订阅
+# - FRAME(服务端→客户端): POINTS头 + float32[count]，刷新区间内的最新值
+# - AGG(服务端→客户端): POINTS头 + float32[2, count]，刷新区间内的最大绝对值和RMS
+# - EVENT(服务端→客户端): JSON，区域事件，kind为detection(检测事件)或spectrum(每个点位的主频和幅值)
+MAGIC = b"DASS"
+HEADER = struct.Struct("<4sBxHId")
+POINTS = struct.Struct("<III")
+MSG_HELLO = 0
+MSG_FRAME = 1
+MSG_AGG = 2
+MSG_EVENT = 3
+MSG_SUBSCRIBE = 0x10
+MSG_UNSUBSCRIBE = 0x11
+TARGET_NAMES = list(DAS_CONFIG["targets"])
+KINDS = ["frame", "agg", "event"]
+SUBSCRIPTION_KEYS = ["target", "points", "rate", "kinds"]
+# 客户端消息负载的上限，为最长的有效SUBSCRIBE(json.dumps默认格式)的长度
+MAX_PAYLOAD = len(
+    json.dumps(
+        {
+            "target": max(TARGET_NAMES, key=lambda name: len(json.dumps(name))),
+            "points": [DAS_CONFIG["validPointRange"].stop] * 3,
+            "rate": 1.7976931348623157e308,
+            "kinds": KINDS,
+        }
+    ).encode()
+)
+
+
+def pack_message(msgType: int, targetId: int, payload: bytes) -> bytes:
+    return HEADER.pack(MAGIC, msgType, targetId, len(payload), time.time()) + payload
+
+
+async def read_message(
+    reader: asyncio.StreamReader, maxLength: int | None = None
+) -> tuple[int, int, float, bytes]:
+    """读取一条消息，返回(消息类型, 数据源序号, 时间戳, 负载)，负载超过maxLength时抛出ValueError"""
+    header = await reader.readexactly(HEADER.size)
+    magic, msgType, targetId, length, timestamp = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f"Invalid magic {magic!r}")
+    if maxLength is not None and length > maxLength:
+        raise ValueError(f"消息负载长度{length}超过上限{maxLength}")
+    return msgType, targetId, timestamp, await reader.readexactly(length)
+
+
+def parse_target(params) -> str:
+    if not isinstance(params, dict):
+        raise ValueError(f"{params}不是JSON对象")
+    target = params.get("target")
+    if target not in TARGET_NAMES:
+        raise ValueError(f"{target}未在DAS_CONFIG中定义")
+    return target
+
+
+class Subscription:
+    """
+    客户端的一个订阅，参数无效时抛出ValueError
+    服务端每次读到新的区间统计量都累积到所有订阅中，每个订阅在两次发送之间保留自己的最大值和平方和，
+    低速率的订阅不会丢失其他订阅发送后出现的峰值
+    """
+
+    def __init__(self, params):
+        self.target = parse_target(params)
+        for key in params:
+            if key not in SUBSCRIPTION_KEYS:
+                raise ValueError(f"{key}不是有效的订阅参数")
+        validRange = DAS_CONFIG["validPointRange"]
+        points = params.get("points", [validRange.start, validRange.stop, 1])
+        if not (
+            isinstance(points, list)
+            and len(points) == 3
+            and all(type(point) is int for point in points)
+        ):
+            raise ValueError(f"{points}不是[start, stop, step]形式的整数")
+        start, stop, step = points
+        if not (validRange.start <= start < stop <= validRange.stop and step > 0):
+            raise ValueError(f"{points}不在有效点位范围内")
+        self.start = start
+        self.step = step
+        self.columns = slice(start - validRange.start, stop - validRange.start, step)
+        rate = params.get("rate", 10)
+        if type(rate) not in (int, float) or not rate > 0:
+            raise ValueError(f"{rate}不是正数")
+        self.interval = 1 / min(rate, STREAM_CONFIG["maxRate"])
+        self.kinds: list[str] = params.get("kinds", KINDS)
+        if not isinstance(self.kinds, list):
+            raise ValueError(f"{self.kinds}不是消息类型列表")
+        for kind in self.kinds:
+            if kind not in KINDS:
+                raise ValueError(f"{kind}不是有效的消息类型")
+        if len(set(self.kinds)) != len(self.kinds):
+            raise ValueError(f"{self.kinds}中有重复的消息类型")
+        self.nextTime = 0.0
+        # 上次发送以来的统计量，权重为覆盖的发布次数
+        self.last: np.ndarray | None = None
+        self.max: np.ndarray | None = None
+        self.squares: np.ndarray | None = None
+        self.weight = 0
+
+    def accumulate(self, frames: np.ndarray, weight: int):
+        """累积一次读取的区间统计量，frames为(统计量数, 点位数)的物理量"""
+        data = frames[:, self.columns]
+        rms = data[PLOT_AGGREGATES.index("rms")]
+        self.last = data[PLOT_AGGREGATES.index("last")].copy()
+        if not self.weight:
+            self.max = data[PLOT_AGGREGATES.index("max")].copy()
+            self.squares = np.square(rms) * weight
+        else:
+            np.maximum(self.max, data[PLOT_AGGREGATES.index("max")], out=self.max)
+            self.squares += np.square(rms) * weight
+        self.weight += weight
+
+    def take(self) -> tuple[np.ndarray, np.ndarray] | None:
+        """返回上次发送以来的(最新值, [最大值, RMS])并清空，没有新数据时返回None"""
+        if not self.weight:
+            return None
+        agg = np.stack((self.max, np.sqrt(self.squares / self.weight)))
+        self.weight = 0
+        return self.last, agg
+
+
+class Client:
+    """单个客户端，发送队列满时丢弃最旧的消息"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.queue: deque[bytes] = deque(maxlen=STREAM_CONFIG["queueSize"])
+        self.ready = asyncio.Event()
+        # 数据源名称 -> 订阅
+        self.subscriptions: dict[str, Subscription] = {}
+        self.dropped = 0
+
+    def send(self, message: bytes):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(message)
+        self.ready.set()
+
+    async def flush(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.queue:
+                self.writer.write(self.queue.popleft())
+                await self.writer.drain()
+
+
+class StreamServer:
+    """
+    无界面的实时数据流服务
+    从共享内存中的顺序锁缓冲区读取区间统计量，按每个客户端订阅的点位范围和速率发送，
+    读取共享内存不影响接收进程，因此观看者的数量与采集链路无关
+    """
+
+    def __init__(
+        self,
+        latestFrames: dict[str, SeqLockBuffer],
+        eventQueue: multiprocessing.queues.Queue | None,
+    ):
+        self._latestFrames = latestFrames
+        self._eventQueue = eventQueue
+        self._clients: set[Client] = set()
+        self._converters = {name: PhysicalConverter(name) for name in latestFrames}
+        shape = (len(PLOT_AGGREGATES), len(DAS_CONFIG["validPointRange"]))
+        self._raw = {name: np.zeros(shape, np.float32) for name in latestFrames}
+        self._frames = {name: np.zeros(shape, np.float32) for name in latestFrames}
+        self._sequences = {name: -1 for name in latestFrames}
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client = Client(writer)
+        peer = writer.get_extra_info("peername")
+        log.info("数据流客户端已连接: %s", peer)
+        hello = {
+            "targets": TARGET_NAMES,
+            "points": [
+                DAS_CONFIG["validPointRange"].start,
+                DAS_CONFIG["validPointRange"].stop,
+            ],
+            "units": {
+                name: converter.unit for name, converter in self._converters.items()
+            },
+        }
+        client.send(
+            pack_message(MSG_HELLO, 0, json.dumps(hello, ensure_ascii=False).encode())
+        )
+        self._clients.add(client)
+        flusher = asyncio.create_task(client.flush())
+        try:
+            while True:
+                msgType, _, _, payload = await read_message(reader, MAX_PAYLOAD)
+                if msgType == MSG_SUBSCRIBE:
+                    subscription = Subscription(json.loads(payload))
+                    if subscription.target not in self._latestFrames:
+                        raise ValueError(f"{subscription.target}未启用实时数据")
+                    client.subscriptions[subscription.target] = subscription
+                elif msgType == MSG_UNSUBSCRIBE:
+                    client.subscriptions.pop(parse_target(json.loads(payload)), None)
+                else:
+                    raise ValueError(f"Unknown message type {msgType}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            log.warning("数据流客户端%s请求无效: %s", peer, e)
+        finally:
+            self._clients.discard(client)
+            flusher.cancel()
+            writer.close()
+            log.info("数据流客户端已断开: %s, 丢弃消息数: %s", peer, client.dropped)
+
+    def _read(self, name: str) -> int:
+        """读取新的区间统计量，返回其覆盖的发布次数，没有新数据时返回0"""
+        sequence = self._latestFrames[name].read(self._raw[name])
+        if sequence is None or sequence == self._sequences[name]:
+            return 0
+        # 本服务有自己的缓冲区，确认读取不影响绘图的区间统计
+        self._latestFrames[name].acknowledge(sequence)
+        weight = sequence - self._sequences[name] if self._sequences[name] >= 0 else 1
+        self._sequences[name] = sequence
+        self._converters[name].convert(self._raw[name], out=self._frames[name])
+        return weight
+
+    def _publish(self, now: float):
+        subscriptions = [
+            (client, subscription)
+            for client in self._clients
+            for subscription in client.subscriptions.values()
+        ]
+        # 每次轮询都读取并确认，区间统计量累积到各订阅中，由订阅按自己的速率发送
+        for name in {subscription.target for _, subscription in subscriptions}:
+            weight = self._read(name)
+            if not weight:
+                continue
+            for _, subscription in subscriptions:
+                if subscription.target == name:
+                    subscription.accumulate(self._frames[name], weight)
+        for client, subscription in subscriptions:
+            if now < subscription.nextTime:
+                continue
+            taken = subscription.take()
+            if taken is None:
+                continue
+            last, agg = taken
+            subscription.nextTime = now + subscription.interval
+            targetId = TARGET_NAMES.index(subscription.target)
+            head = POINTS.pack(subscription.start, subscription.step, len(last))
+            if "frame" in subscription.kinds:
+                client.send(pack_message(MSG_FRAME, targetId, head + last.tobytes()))
+            if "agg" in subscription.kinds:
+                client.send(pack_message(MSG_AGG, targetId, head + agg.tobytes()))
+
+    def _publish_events(self):
+        if self._eventQueue is None:
+            return
+        while True:
+            try:
+                event = self._eventQueue.get_nowait()
+            except queue.Empty:
+                return
+            payload = json.dumps(event, default=str, ensure_ascii=False).encode()
+            for client in self._clients:
+                if any("event" in s.kinds for s in client.subscriptions.values()):
+                    client.send(pack_message(MSG_EVENT, 0, payload))
+
+    async def serve(self, exit_event: multiprocessing.synchronize.Event):
+        server = await asyncio.start_server(
+            self.handle_client, STREAM_CONFIG["host"], STREAM_CONFIG["port"]
+        )
+        log.info(
+            "数据流服务已启动: %s:%s", STREAM_CONFIG["host"], STREAM_CONFIG["port"]
+        )
+        async with server:
+            while not exit_event.is_set():
+                await asyncio.sleep(STREAM_CONFIG["pollInterval"] / 1000)
+                self._publish(time.monotonic())
+                self._publish_events()
+            # 先断开客户端，让各连接的处理协程正常结束
+            for client in list(self._clients):
+                client.writer.close()
+            await asyncio.sleep(0)
+
+
+def serve_stream(
+    latestFrames: dict[str, SeqLockBuffer],
+    eventQueue: multiprocessing.queues.Queue | None,
+    exit_event: multiprocessing.synchronize.Event,
+):
+    asyncio.run(StreamServer(latestFrames, eventQueue).serve(exit_event))
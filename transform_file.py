@@ -1,21 +1,13 @@
+from collections import deque
 import os
 import re
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
+from typing import TypedDict
 import numpy as np
-from tqdm import tqdm
 import argparse
+from check import apply_renames
 
-# 参数解析
-parser = argparse.ArgumentParser(description="文件转换")
-parser.add_argument(
-    "source_dir",
-    type=str,
-    help="源文件夹路径",
-)
-args = parser.parse_args()
-
-SOURCE_DIR = args.source_dir
-TARGET_DIR = os.path.join(SOURCE_DIR, "label")
 FILE_PREFIX = "Raw"
 
 TIME_INTERVAL = 1
@@ -25,24 +17,32 @@ FILE_TIME_INTERVAL = 30
 OVERLAP = 0.5
 DOWN_SAMPLE = 10
 
-OVERWRITE = True
-
-CHECK_ONLY = False
 TOTAL_TOL = 1
 SINGLE_TOL = 0.05
 
+# 每个进程最多排队的源文件数，限制未取走的降采样结果占用的内存
+QUEUE_PER_WORKER = 2
+
 
 assert FILE_TIME_INTERVAL % TIME_INTERVAL == 0, "文件时间间隔不是处理时间间隔的整数倍"
 assert 0 <= OVERLAP < 1, "重叠率不在[0, 1)范围内"
 assert OVERLAP * FILE_TIME_INTERVAL % TIME_INTERVAL == 0, "重叠率不合理"
+assert TIME_INTERVAL * SAMPLE_RATE % DOWN_SAMPLE == 0, "降采样倍数不合理"
+
 
-ORIGIN_FILES = [f for f in os.listdir(SOURCE_DIR) if f.endswith(".dat")]
-assert ORIGIN_FILES, "源文件夹内无有效文件"
-example_file = ORIGIN_FILES[0]
-example_data = np.fromfile(
-    os.path.join(SOURCE_DIR, example_file), dtype=np.dtype("<i2")
-)
-DATA_SHAPE = example_data.reshape(TIME_INTERVAL * SAMPLE_RATE, -1).shape
+class FileParam(TypedDict):
+    name: str
+    # 组成该标注文件的源文件在排序后文件列表中的起始序号
+    begin: int
+
+
+def data_points(filePath: str) -> int:
+    """由文件大小得到点位数"""
+    return (
+        os.path.getsize(filePath)
+        // np.dtype("<i2").itemsize
+        // (TIME_INTERVAL * SAMPLE_RATE)
+    )
 
 
 def storage_format_to_timestamp(file):
@@ -61,11 +61,11 @@ def label_format_to_timestamp(file):
 
 
 def timestamp_to_label_format(
-    timestamp: int, file_time_interval: float = TIME_INTERVAL
+    timestamp: int, points: int, file_time_interval: float = TIME_INTERVAL
 ):
     end_timestamp = timestamp
     begin_timestamp = end_timestamp - file_time_interval * 1000
-    return f"{begin_timestamp}_{end_timestamp}_{DATA_SHAPE[1]}.dat"
+    return f"{begin_timestamp}_{end_timestamp}_{points}.dat"
 
 
 def timestamp_to_storage_format(timestamp: int):
@@ -73,12 +73,16 @@ def timestamp_to_storage_format(timestamp: int):
     return f"{FILE_PREFIX}{date.strftime('%Y-%m-%d_%H-%M-%S.%f')[0:-3]}.dat"
 
 
-def storage_format_to_label_format(files, file_time_interval: float = TIME_INTERVAL):
+def storage_format_to_label_format(
+    files, points: int, file_time_interval: float = TIME_INTERVAL
+):
     next_file_names = []
     for file in files:
         assert file.startswith(FILE_PREFIX), f"{file}不符合格式"
         end_timestamp = storage_format_to_timestamp(file)
-        format_file_name = timestamp_to_label_format(end_timestamp, file_time_interval)
+        format_file_name = timestamp_to_label_format(
+            end_timestamp, points, file_time_interval
+        )
         next_file_names.append(format_file_name)
 
     assert len(set(next_file_names)) == len(next_file_names), "文件名重复"
@@ -96,24 +100,50 @@ def label_format_to_storage_format(files):
     return next_file_names
 
 
-def storage_combin_to_label(
-    files,
+def rms_downsample(data: np.ndarray, factor: int = DOWN_SAMPLE) -> np.ndarray:
+    """
+    RMS降采样，data为(采样数, 点位数)的int16数组
+    按步长取出每个区间的第k个采样，平方后累加到float32缓冲区，不生成整个文件的float32副本
+    """
+    intervals = len(data) // factor
+    total = np.zeros((intervals, data.shape[1]), dtype=np.float32)
+    square = np.empty_like(total)
+    for k in range(factor):
+        np.square(data[k : intervals * factor : factor], out=square, dtype=np.float32)
+        total += square
+    total /= factor
+    np.sqrt(total, out=total)
+    return total.astype("<i2")
+
+
+def downsample_file(filePath: str) -> np.ndarray:
+    """读取一个源文件并降采样，在进程池中运行"""
+    data = np.fromfile(filePath, dtype=np.dtype("<i2")).reshape(
+        TIME_INTERVAL * SAMPLE_RATE, -1
+    )
+    return rms_downsample(data)
+
+
+def check_timestamps(
+    files: list[str],
+    points: int,
     total_tol: float = TIME_INTERVAL / 2,
     single_tol: float = TIME_INTERVAL / 10,
-    check_only: bool = False,
-):
+) -> tuple[list[FileParam], list[str], float, float]:
+    """
+    检查文件时间戳是否连续，files为排序后的源文件
+    返回(标注文件列表, 源文件重命名后的文件名, 最大单个文件误差, 最大总体误差)，误差单位: ms
+    """
     combine_length = int(FILE_TIME_INTERVAL / TIME_INTERVAL)
     overlap_length = int(OVERLAP * combine_length)
-    files = [file for file in files if file.startswith(FILE_PREFIX)]
-    files = sorted(files)
-    combine_files = []
     vaild_timestamp = storage_format_to_timestamp(files[0])
     max_single_error = 0
     max_total_error = 0
     last_timestamp = vaild_timestamp - TIME_INTERVAL * 1000
-    file_params = []
+    file_params: list[FileParam] = []
     next_file_names = []
-    for file in files:
+    begin = 0
+    for index, file in enumerate(files):
         file_timestamp = storage_format_to_timestamp(file)
         single_error = abs(file_timestamp - last_timestamp - TIME_INTERVAL * 1000)
         assert (
@@ -126,66 +156,163 @@ def storage_combin_to_label(
             total_error <= total_tol * 1000
         ), f"总体时间戳不连续，当前文件{file}，误差{total_error}ms"
         max_total_error = max(max_total_error, total_error)
-        next_file_names.extend([timestamp_to_storage_format(vaild_timestamp)])
+        next_file_names.append(timestamp_to_storage_format(vaild_timestamp))
+        if index + 1 - begin == combine_length:
+            # 源文件名为数据的结束时间，标注文件的结束时间为最后一个源文件校正后的时间，与在线生成的标注文件相同
+            file_params.append(
+                {
+                    "name": timestamp_to_label_format(
+                        vaild_timestamp, points, FILE_TIME_INTERVAL
+                    ),
+                    "begin": begin,
+                }
+            )
+            begin = index + 1 - overlap_length
         vaild_timestamp += TIME_INTERVAL * 1000
-        combine_files.append(file)
-        if len(combine_files) != combine_length:
-            continue
-        file_params.append(
-            {
-                "name": timestamp_to_label_format(vaild_timestamp, FILE_TIME_INTERVAL),
-                "files": [*combine_files],
-            }
-        )
 
-        combine_files = combine_files[-overlap_length:]
+    return file_params, next_file_names, max_single_error, max_total_error
+
+
+def storage_combin_to_label(
+    source_dir: str,
+    files: list[str],
+    total_tol: float = TIME_INTERVAL / 2,
+    single_tol: float = TIME_INTERVAL / 10,
+    check_only: bool = False,
+    workers: int | None = None,
+    overwrite: bool = False,
+):
+    """
+    将源文件合并为有重叠的标注文件
+    每个源文件只读取和降采样一次，由进程池按顺序计算，主进程缓存最近的降采样结果拼接重叠的标注文件。
+    标注文件先写入临时文件再改名，已存在且大小正确的标注文件视为已完成，中断后重新运行时跳过。
+    标注文件名的结束时间为窗口内最后一个源文件校正后的时间(源文件名为数据的结束时间)，与在线生成的标注文件相同，
+    旧版本为该时间再加TIME_INTERVAL，旧版本生成的标注文件不会被视为已完成
+    """
+    from tqdm import tqdm
+
+    target_dir = os.path.join(source_dir, "label")
+    combine_length = int(FILE_TIME_INTERVAL / TIME_INTERVAL)
+    files = sorted(file for file in files if file.startswith(FILE_PREFIX))
+    points = data_points(os.path.join(source_dir, files[0]))
+    file_params, next_file_names, max_single_error, max_total_error = check_timestamps(
+        files, points, total_tol, single_tol
+    )
 
     if check_only:
         return max_single_error, max_total_error
 
-    os.makedirs(TARGET_DIR, exist_ok=True)
-
-    for file_param in tqdm(file_params, desc="生成标注文件"):
-        combine_data = []
-        for combine_file in file_param["files"]:
-            data = np.fromfile(
-                os.path.join(SOURCE_DIR, combine_file), dtype=np.dtype("<i2")
-            ).reshape(TIME_INTERVAL * SAMPLE_RATE, -1)
-            # 使用RMS降采样
-            # 计算区间数
-            INTERVAL = int(len(data) / DOWN_SAMPLE)
-            data = (
-                data[: INTERVAL * DOWN_SAMPLE]
-                .reshape(INTERVAL, DOWN_SAMPLE, -1)
-                .astype(np.float32)
-            )
-            data = np.sqrt(np.mean(data**2, axis=1)).astype("<i2")
-            combine_data.append(data)
-        combine_data = np.concatenate(combine_data, axis=0)
-        combine_data.tofile(os.path.join(TARGET_DIR, file_param["name"]))
-
-    log_file = open(os.path.join(TARGET_DIR, "rename.log"), "+a", encoding="utf-8")
-    for file, next_file_name in tqdm(
-        zip(files, next_file_names), desc="重命名文件", total=len(files)
-    ):
-        if file != next_file_name:
-            os.rename(
-                os.path.join(SOURCE_DIR, file), os.path.join(SOURCE_DIR, next_file_name)
+    os.makedirs(target_dir, exist_ok=True)
+    label_size = (
+        combine_length
+        * (TIME_INTERVAL * SAMPLE_RATE // DOWN_SAMPLE)
+        * points
+        * np.dtype("<i2").itemsize
+    )
+    pending = []
+    for file_param in file_params:
+        label_path = os.path.join(target_dir, file_param["name"])
+        if (
+            not overwrite
+            and os.path.exists(label_path)
+            and os.path.getsize(label_path) == label_size
+        ):
+            continue
+        pending.append(file_param)
+    if len(pending) < len(file_params):
+        print(f"跳过已完成的标注文件{len(file_params) - len(pending)}个")
+    # 只计算未完成的标注文件用到的源文件
+    needed = sorted(
+        {
+            index
+            for file_param in pending
+            for index in range(
+                file_param["begin"], file_param["begin"] + combine_length
             )
-            log_file.write(f"{file} -> {next_file_name}\n")
+        }
+    )
+
+    cache: dict[int, np.ndarray] = {}
+    progress = tqdm(total=len(pending), desc="生成标注文件")
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        submitted: deque[tuple[int, Future]] = deque()
+        remaining = iter(needed)
+        position = 0
+        while True:
+            for index in remaining:
+                submitted.append(
+                    (
+                        index,
+                        executor.submit(
+                            downsample_file, os.path.join(source_dir, files[index])
+                        ),
+                    )
+                )
+                if len(submitted) >= workers * QUEUE_PER_WORKER:
+                    break
+            if not submitted:
+                break
+            index, future = submitted.popleft()
+            cache[index] = future.result()
+            while (
+                position < len(pending)
+                and pending[position]["begin"] + combine_length - 1 <= index
+            ):
+                file_param = pending[position]
+                begin = file_param["begin"]
+                label_path = os.path.join(target_dir, file_param["name"])
+                np.concatenate(
+                    [cache[i] for i in range(begin, begin + combine_length)], axis=0
+                ).tofile(label_path + ".tmp")
+                os.replace(label_path + ".tmp", label_path)
+                position += 1
+                progress.update()
+                # 之后的标注文件不会再用到起始序号之前的数据
+                nextBegin = (
+                    pending[position]["begin"] if position < len(pending) else index + 1
+                )
+                for i in [i for i in cache if i < nextBegin]:
+                    del cache[i]
+    progress.close()
+
+    # 与check.py --rename相同，先写入改名日志再按依赖顺序改名，目标已存在时不改名，可用check.py --rollback撤销
+    pairs = [
+        (file, next_file_name)
+        for file, next_file_name in zip(files, next_file_names)
+        if file != next_file_name
+    ]
+    if pairs:
+        print(f"重命名{len(pairs)}个源文件，日志: {apply_renames(source_dir, pairs)}")
 
     return max_single_error, max_total_error
 
 
 if __name__ == "__main__":
-    if OVERWRITE and os.path.exists(TARGET_DIR):
-        # 删除target文件夹下所有dat文件
-        for file in os.listdir(TARGET_DIR):
-            if file.endswith(".dat"):
-                os.remove(os.path.join(TARGET_DIR, file))
+    # 参数解析
+    parser = argparse.ArgumentParser(description="文件转换")
+    parser.add_argument(
+        "source_dir",
+        type=str,
+        help="源文件夹路径",
+    )
+    parser.add_argument("-j", "--workers", type=int, help="进程数，默认为CPU核数")
+    parser.add_argument(
+        "--overwrite", action="store_true", help="重新生成已完成的标注文件"
+    )
+    parser.add_argument("--check-only", action="store_true", help="只检查时间戳")
+    args = parser.parse_args()
 
+    origin_files = [f for f in os.listdir(args.source_dir) if f.endswith(".dat")]
+    assert origin_files, "源文件夹内无有效文件"
     max_single_error, max_total_error = storage_combin_to_label(
-        ORIGIN_FILES, total_tol=TOTAL_TOL, single_tol=SINGLE_TOL, check_only=CHECK_ONLY
+        args.source_dir,
+        origin_files,
+        total_tol=TOTAL_TOL,
+        single_tol=SINGLE_TOL,
+        check_only=args.check_only,
+        workers=args.workers,
+        overwrite=args.overwrite,
     )
     print(f"最大单个文件时间戳误差：{max_single_error}ms")
     print(f"最大总体时间戳误差：{max_total_error}ms")
@@ -6,10 +6,14 @@ from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandl
 import os
 import re
 import queue
+import multiprocessing
+import multiprocessing.queues
 import multiprocessing.synchronize
+import signal
+import threading
+import time
 from typing import TypedDict
 import atexit
-from scipy.signal import butter, lfilter
 from config import LOG_CONFIG
 
 
@@ -19,6 +23,36 @@ class DataBuffer(TypedDict):
 
 
 class RollingStreamHandler(logging.StreamHandler):
+    """
+    DEBUG日志在同一行滚动显示，其它日志正常换行
+    终端宽度只在启动和窗口大小变化(SIGWINCH，Windows下每秒最多一次)时读取
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._columns = shutil.get_terminal_size().columns
+        self._resized = False
+        self._sizeTime = time.monotonic()
+        # 当前行是否有未换行的滚动内容
+        self._rolling = False
+        if (
+            hasattr(signal, "SIGWINCH")
+            and threading.current_thread() is threading.main_thread()
+        ):
+            signal.signal(signal.SIGWINCH, self._on_resize)
+
+    def _on_resize(self, signum, frame):
+        self._resized = True
+
+    def _columns_now(self) -> int:
+        if self._resized or (
+            not hasattr(signal, "SIGWINCH") and time.monotonic() - self._sizeTime >= 1
+        ):
+            self._resized = False
+            self._sizeTime = time.monotonic()
+            self._columns = shutil.get_terminal_size().columns
+        return self._columns
+
     def emit(self, record):
         try:
             # 根据日志级别选择格式化输出
@@ -28,42 +62,169 @@ class RollingStreamHandler(logging.StreamHandler):
                 msg = self.format(record)
 
             stream = self.stream
-            # 清空当前行
-            logStr = "\r" + " " * (shutil.get_terminal_size().columns - 2) + "\r"
+            logStr = ""
+            # 只有滚动内容需要清空当前行
+            if self._rolling:
+                logStr = "\r" + " " * (self._columns_now() - 2) + "\r"
             # 滚动输出消息
             logStr += msg
-            if record.levelno != logging.DEBUG:
+            self._rolling = record.levelno == logging.DEBUG
+            if not self._rolling:
                 logStr += "\n"
             stream.write(logStr)
-            if record.levelno == logging.DEBUG:
+            if self._rolling:
                 stream.flush()
         except Exception:
             self.handleError(record)
 
 
-class LazyQueueHandler(QueueHandler):
-    def __init__(self, log_queue, listener):
-        super().__init__(log_queue)
+class RateLimiter:
+    """
+    按消息键限流，每个键在interval秒内最多通过burst条，其余只计数
+    键默认为未格式化的消息模板，因此热点路径应使用 log.error("...%s", arg) 的形式，也可用key参数指定
+    """
+
+    def __init__(self, interval: float, burst: int):
+        self._interval = interval
+        self._burst = burst
+        # 键 -> [窗口开始时间, 窗口内通过条数, 被抑制条数]
+        self._states: dict[str, list] = {}
+        self._lastPending = time.monotonic()
+
+    def check(self, key: str) -> int | None:
+        """被限流时返回None，否则返回此前被抑制的条数"""
+        now = time.monotonic()
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = [now, 0, 0]
+        elif now - state[0] >= self._interval:
+            state[0] = now
+            state[1] = 0
+        if state[1] >= self._burst:
+            state[2] += 1
+            return None
+        state[1] += 1
+        suppressed = state[2]
+        state[2] = 0
+        return suppressed
+
+    def pending_due(self) -> bool:
+        """距上次汇总已超过一个限流窗口"""
+        return time.monotonic() - self._lastPending >= self._interval
+
+    def pending(self) -> dict[str, int]:
+        """返回并清空尚未汇总的被抑制条数，同时删除窗口已结束且没有被抑制条数的键，键的数量不会一直增长"""
+        now = time.monotonic()
+        self._lastPending = now
+        result = {}
+        for key, state in list(self._states.items()):
+            if state[2]:
+                result[key] = state[2]
+                state[2] = 0
+            elif now - state[0] >= self._interval:
+                del self._states[key]
+        return result
+
+
+class LogListener(QueueListener):
+    """在后台线程中完成消息格式化和文件写入"""
+
+    def prepare(self, record):
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} (此前{suppressed}条相同日志被抑制)"
+            record.args = None
+        return record
+
+
+class AsyncLogHandler(QueueHandler):
+    """
+    日志记录只在调用线程中放入队列，消息格式化和I/O都由后台线程完成
+    默认在本进程启动后台线程；主进程调用share后，子进程通过attach把日志交给主进程统一写入
+    """
+
+    def __init__(self, listener: LogListener):
+        super().__init__(listener.queue)
         self.listener = listener
-        self.listener_started = False
+        self._listenerPid: int | None = None
+
+    def prepare(self, record):
+        # 不在调用线程中格式化消息，参数原样传给后台线程，跨进程时参数需要可以pickle
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
     def emit(self, record):
-        self.start()
+        if self.listener is not None and self._listenerPid is None:
+            self.start()
         super().emit(record)
 
     def start(self):
-        if not self.listener_started:
-            self.listener.start()
-            self.listener_started = True
+        self.listener.start()
+        self._listenerPid = os.getpid()
 
     def stop(self):
-        if self.listener_started:
+        # fork出的子进程继承了主进程的后台线程对象，不能由子进程停止
+        if self._listenerPid == os.getpid():
             self.listener.stop()
-            self.listener_started = False
+            self._listenerPid = None
+
+    def share(self) -> multiprocessing.queues.Queue:
+        """在主进程创建子进程前调用，返回传给子进程的队列"""
+        self.stop()
+        self.queue = self.listener.queue = multiprocessing.Queue()
+        self.start()
+        return self.queue  # type: ignore
+
+    def attach(self, logQueue: multiprocessing.queues.Queue):
+        """在子进程中调用，之后本进程的日志由主进程写入"""
+        self.stop()
+        self.queue = logQueue
+        self.listener = None  # type: ignore
+
+
+class RateLimitedLogger(logging.LoggerAdapter):
+    """在创建日志记录之前检查级别和限流，被抑制的日志几乎没有开销，DEBUG日志只在终端滚动显示，不限流"""
+
+    def __init__(self, logger: logging.Logger, handler: AsyncLogHandler):
+        super().__init__(logger, None)
+        self.handler = handler
+        self.limiter = RateLimiter(LOG_CONFIG["rateInterval"], LOG_CONFIG["rateBurst"])
+
+    def log(self, level, msg, *args, key: str | None = None, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level > logging.DEBUG:
+            # 每个限流窗口汇总一次被抑制的日志并清理不再出现的键
+            if self.limiter.pending_due():
+                self.summarize()
+            suppressed = self.limiter.check(key or str(msg))
+            if suppressed is None:
+                return
+            if suppressed:
+                kwargs["extra"] = {
+                    **(kwargs.get("extra") or {}),
+                    "suppressed": suppressed,
+                }
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def summarize(self):
+        """输出尚未汇总的被抑制条数"""
+        for key, count in self.limiter.pending().items():
+            self.logger.warning("%d条日志被抑制: %s", count, key)
+
+    def stop(self):
+        self.summarize()
+        self.handler.stop()
 
 
-def getThreadLogger(name: str | None = None) -> logging.Logger:
-    logQueue = queue.Queue()
+def getThreadLogger(name: str | None = None) -> RateLimitedLogger:
+    # 不查找调用位置，也不记录进程和线程信息，降低创建日志记录的开销
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
 
     formatter = logging.Formatter(
         "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
@@ -76,25 +237,117 @@ def getThreadLogger(name: str | None = None) -> logging.Logger:
         os.path.join(LOG_CONFIG["path"], "das.log"),
         when="midnight",
         interval=1,
-        backupCount=7,
+        backupCount=LOG_CONFIG["backupCount"],
         encoding="utf-8",
+        delay=True,
     )
     fileHandler.suffix = "%Y-%m-%d"
     fileHandler.setLevel(logging.INFO)
     fileHandler.setFormatter(formatter)
 
-    listener = QueueListener(
-        logQueue, streamHandler, fileHandler, respect_handler_level=True
+    listener = LogListener(
+        queue.Queue(), streamHandler, fileHandler, respect_handler_level=True
     )
-    lazyQueueHandler = LazyQueueHandler(logQueue, listener)
+    asyncHandler = AsyncLogHandler(listener)
 
     logger = logging.getLogger(name)
     logger.setLevel(LOG_CONFIG["level"])
-    logger.addHandler(lazyQueueHandler)
+    logger.addHandler(asyncHandler)
+    rateLimitedLogger = RateLimitedLogger(logger, asyncHandler)
 
-    atexit.register(lazyQueueHandler.stop)
+    atexit.register(rateLimitedLogger.stop)
 
-    return logger
+    return rateLimitedLogger
+
+
+def process_rss(pid: int) -> int | None:
+    """进程的常驻内存字节数，没有psutil时读取/proc(仅Linux)，无法获取时返回None"""
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+    try:
+        return psutil.Process(pid).memory_info().rss
+    except psutil.Error:
+        return None
+
+
+def pin_cpus(cpus: list[int]):
+    """将当前进程绑定到指定的CPU核，Linux下使用sched_setaffinity，其它平台需要psutil"""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        else:
+            import psutil
+
+            psutil.Process().cpu_affinity(cpus)
+    except ImportError:
+        log.warning("没有安装psutil，无法绑定CPU核%s", cpus)
+        return
+    except (OSError, ValueError) as e:
+        # CPU核不存在或没有权限时不影响接收
+        log.warning("无法绑定CPU核%s: %s", cpus, e)
+        return
+    log.info("进程(pid %s)已绑定到CPU核%s", os.getpid(), cpus)
+
+
+def isolated_cpus() -> list[int]:
+    """由内核参数isolcpus隔离的CPU核(仅Linux)，没有时返回空列表"""
+    try:
+        with open("/sys/devices/system/cpu/isolated") as f:
+            content = f.read().strip()
+    except OSError:
+        return []
+    cpus = []
+    for part in filter(None, content.split(",")):
+        begin, _, end = part.partition("-")
+        cpus.extend(range(int(begin), int(end or begin) + 1))
+    return cpus
+
+
+def set_realtime(priority: int):
+    """Linux下将当前进程改为SCHED_FIFO实时调度，其它平台需要psutil，改为高优先级"""
+    try:
+        if hasattr(os, "sched_setscheduler"):
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            policy = f"SCHED_FIFO({priority})"
+        else:
+            import psutil
+
+            psutil.Process().nice(psutil.HIGH_PRIORITY_CLASS)
+            policy = "HIGH_PRIORITY_CLASS"
+    except ImportError:
+        log.warning("没有安装psutil，无法提高进程优先级")
+        return
+    except (OSError, AttributeError) as e:
+        # 没有CAP_SYS_NICE或RLIMIT_RTPRIO为0时保持普通调度
+        log.warning("无法提高进程优先级: %s", e)
+        return
+    log.info("进程(pid %s)的调度策略已改为%s", os.getpid(), policy)
+
+
+def lower_priority(nice: int):
+    """降低当前进程的优先级，POSIX下nice值增加nice，其它平台需要psutil，改为低于正常优先级"""
+    try:
+        if hasattr(os, "nice"):
+            os.nice(nice)
+            policy = f"nice +{nice}"
+        else:
+            import psutil
+
+            psutil.Process().nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            policy = "BELOW_NORMAL_PRIORITY_CLASS"
+    except ImportError:
+        log.warning("没有安装psutil，无法降低进程优先级")
+        return
+    except OSError as e:
+        log.warning("无法降低进程优先级: %s", e)
+        return
+    log.info("进程(pid %s)的优先级已改为%s", os.getpid(), policy)
 
 
 def bytes_to_hex(bytesData: bytes) -> str:
@@ -125,15 +378,46 @@ def extract_timestamp(filename):
 log = getThreadLogger("DAS")
 
 
+def share_log() -> multiprocessing.queues.Queue:
+    """主进程调用，所有进程的日志都由主进程的后台线程写入，避免多个进程同时写入和轮转日志文件"""
+    return log.handler.share()
+
+
+def run_with_log(logQueue: multiprocessing.queues.Queue, target, *args):
+    """子进程入口，先把日志交给主进程再运行target"""
+    # fork时继承的限流状态属于主进程，由主进程汇总
+    log.limiter = RateLimiter(LOG_CONFIG["rateInterval"], LOG_CONFIG["rateBurst"])
+    log.handler.attach(logQueue)
+    try:
+        return target(*args)
+    finally:
+        # 子进程退出时队列可能已关闭，在这里汇总被抑制的日志
+        log.summarize()
+
+
 def butter_bandpass(lowcut, highcut, fs, order=5):
     nyq = 0.5 * fs
     low = lowcut / nyq
     high = highcut / nyq
+    # scipy.signal导入耗时较长，只在需要滤波时导入
+    from scipy.signal import butter
+
     b, a = butter(order, [low, high], btype="band")
     return b, a
 
 
 def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
+    from scipy.signal import lfilter
+
     b, a = butter_bandpass(lowcut, highcut, fs, order=order)
     y = lfilter(b, a, data)
     return y
+
+
+def butter_bandpass_sos(lowcut, highcut, fs, order=5):
+    nyq = 0.5 * fs
+    low = lowcut / nyq
+    high = highcut / nyq
+    from scipy.signal import butter
+
+    return butter(order, [low, high], btype="band", output="sos")